@@ -0,0 +1,113 @@
+"""Benchmark brace-stripped ID joins against joins on normalized key columns.
+
+Usage:
+    python benchmark_id_joins.py [--scale 0.25] [--runs 3] [--output id_join_benchmark.json]
+
+Runs on a synthetic CRM dataset in SQLite (crm_fixture.py), so no SQL Server is needed.
+Each query is run as generated (REPLACE on both sides of the join) and as rewritten by
+IdKeyRewriter; both must return the same rows.
+"""
+import sys
+import json
+import time
+import argparse
+import statistics
+
+from crm_fixture import create_crm_fixture, add_id_keys, sqlite_sql
+from id_keys import IdKeyRewriter
+from sql_complex_app import CATALOG
+
+QUERIES = {
+    "opportunities_with_lead": """
+        SELECT COUNT(*) AS opportunities
+        FROM DynamicsShortlisted.dbo.opportunity o
+        JOIN DynamicsShortlisted.dbo.lead l
+            ON REPLACE(REPLACE(o.xt_lead, '{', ''), '}', '') = REPLACE(REPLACE(l.leadid, '{', ''), '}', '')
+    """,
+    "leads_per_account": """
+        SELECT a.accountid, COUNT(l.leadid) AS leads
+        FROM DynamicsShortlisted.dbo.account a
+        LEFT JOIN DynamicsShortlisted.dbo.lead l
+            ON REPLACE(REPLACE(l.parentaccountid, '{', ''), '}', '') = REPLACE(REPLACE(a.accountid, '{', ''), '}', '')
+        GROUP BY a.accountid
+        ORDER BY leads DESC, a.accountid
+    """,
+    "opportunity_contact_account": """
+        SELECT o.opportunityid, c.contactid, a.accountid
+        FROM DynamicsShortlisted.dbo.opportunity o
+        JOIN DynamicsShortlisted.dbo.contact c
+            ON REPLACE(REPLACE(o.parentcontactid, '{', ''), '}', '') = REPLACE(REPLACE(c.contactid, '{', ''), '}', '')
+        JOIN DynamicsShortlisted.dbo.account a
+            ON REPLACE(REPLACE(o.parentaccountid, '{', ''), '}', '') = REPLACE(REPLACE(a.accountid, '{', ''), '}', '')
+        ORDER BY o.opportunityid, c.contactid, a.accountid
+    """,
+    "dropouts_by_owner": """
+        SELECT ow.fullname, dr.DropoutReason, COUNT(*) AS dropouts
+        FROM DynamicsShortlisted.dbo.opportunity o
+        JOIN DynamicsShortlisted.dbo.lead l
+            ON REPLACE(REPLACE(o.xt_lead, '{', ''), '}', '') = REPLACE(REPLACE(l.leadid, '{', ''), '}', '')
+        JOIN DynamicsShortlisted.dbo.owner ow
+            ON REPLACE(REPLACE(o.ownerid, '{', ''), '}', '') = REPLACE(REPLACE(ow.ownerid, '{', ''), '}', '')
+        JOIN DynamicsShortlisted.dbo.dropout_reason dr ON o.new_dropoutreason = dr.DropoutReasonID
+        GROUP BY ow.fullname, dr.DropoutReason
+        ORDER BY ow.fullname, dr.DropoutReason
+    """,
+}
+
+
+def time_query(connection, query: str, runs: int):
+    """Median wall time over runs, plus the rows of the last run"""
+    timings = []
+    rows = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        rows = connection.execute(query).fetchall()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), rows
+
+
+def query_plan(connection, query: str) -> list:
+    return [row[-1] for row in connection.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=float, default=0.25, help="Dataset size relative to crm_fixture.TABLE_ROWS")
+    parser.add_argument("--runs", type=int, default=3, help="Repetitions per query and variant")
+    parser.add_argument("--output", help="Write per-query timings and plans as JSON to this file")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    connection = create_crm_fixture(":memory:", CATALOG, scale=args.scale)
+    rewriter = IdKeyRewriter(CATALOG, available=add_id_keys(connection, CATALOG))
+    print(f"Built fixture at scale {args.scale} in {time.perf_counter() - start:.1f}s")
+
+    rows = []
+    for name, query in QUERIES.items():
+        original = sqlite_sql(query)
+        rewritten = sqlite_sql(rewriter.rewrite(query))
+        original_s, original_rows = time_query(connection, original, args.runs)
+        rewritten_s, rewritten_rows = time_query(connection, rewritten, args.runs)
+        row = {
+            "query": name,
+            "original_s": round(original_s, 4),
+            "rewritten_s": round(rewritten_s, 4),
+            "speedup": round(original_s / rewritten_s, 1) if rewritten_s else None,
+            "rows": len(original_rows),
+            "same_rows": original_rows == rewritten_rows,
+            "original_plan": query_plan(connection, original),
+            "rewritten_plan": query_plan(connection, rewritten),
+        }
+        rows.append(row)
+        print(f"{name:<30} {row['original_s']:8.3f}s -> {row['rewritten_s']:8.3f}s "
+              f"({row['speedup']}x, {row['rows']} rows, same rows: {row['same_rows']})")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"scale": args.scale, "runs": args.runs, "results": rows}, f, indent=2)
+        print(f"Wrote {args.output}")
+    return 0 if all(row["same_rows"] for row in rows) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
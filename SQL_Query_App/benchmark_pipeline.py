@@ -0,0 +1,646 @@
+"""Offline end-to-end benchmark of the SQL pipelines, with no OpenAI or SQL Server.
+
+Usage:
+    python benchmark_pipeline.py run [--flows complex,streamlit] [--scale 0.1] [--runs 3]
+                                     [--planning-mode staged] [--llm-latency 0] [--corpus questions.json]
+                                     [--output pipeline_benchmark.json]
+    python benchmark_pipeline.py compare baseline.json candidate.json [--tolerance 0.25]
+
+Replays a question corpus (TEST_QUESTIONS plus retry, local repair, large result and
+non-data cases) through process_query and the Streamlit flow. A deterministic fake LLM
+answers every prompt from the corpus, and queries run on the synthetic CRM fixture
+(crm_fixture.py). Per question it reports latency percentiles, LLM calls and tokens,
+retries, statements, rows fetched and peak memory, and per flow the repair rule and cache
+counters (tracing.counter_values) that moved. The JSON output only changes when the
+pipeline does, so results from two commits can be diffed or checked with compare.
+"""
+import io
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+import statistics
+import tracemalloc
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from typing import Callable, Dict, List, Optional
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+import tracing
+from crm_fixture import build_fixture_pool, FixturePool, SQLGLOT_AVAILABLE
+from id_keys import IdKeyRewriter
+from model_router import ModelRouter
+from triage_classifier import TriageLabelLog
+from result_profile import count_tokens
+from schema_index import select_schema_context
+
+FLOWS = ("complex", "complex_async", "streamlit", "complex_follow_up")
+STREAM_CHUNK_CHARS = 16
+# Timing changes smaller than these are noise, whatever the relative change
+LATENCY_NOISE_FLOOR_S = 0.005
+MEMORY_NOISE_FLOOR_KIB = 256
+DETERMINISTIC_METRICS = ("query_type", "llm_calls", "prompt_tokens", "completion_tokens",
+                         "retries", "statements", "rows_fetched", "result_rows")
+TIMING_METRICS = ("latency_p50_s", "latency_p95_s", "peak_memory_kib")
+# Component values that are levels, not counts; left out of the per-question counter deltas
+COUNTER_GAUGES = {"entries", "hit_rate", "memory_entries", "memory_bytes", "disk_entries", "disk_bytes"}
+
+# "sql" lists the query the LLM writes first, then its answers to each regeneration prompt;
+# "follow_ups" are drill-downs on the entry's result, for the complex_follow_up flow
+CORPUS = [
+    {
+        "question": "For the opportunities that dropped out because the product 'Doesn't Accomplish the Task', identify from the use case which product was missing.",
+        "query_type": "DATA_QUESTION",
+        "sql": ["""
+            SELECT o.name, o.customerneed, o.new_dropoutexplanation
+            FROM DynamicsShortlisted.dbo.opportunity o
+            JOIN DynamicsShortlisted.dbo.dropout_reason dr ON o.new_dropoutreason = dr.DropoutReasonID
+            WHERE dr.DropoutReason = 'Doesn''t Accomplish the Task'
+            ORDER BY o.name
+        """],
+    },
+    {
+        "question": "Looking at the dropout reasons and explanations, suggest actionable strategies to reduce our dropout rates.",
+        "query_type": "DATA_QUESTION",
+        "sql": ["""
+            SELECT dr.DropoutReason, COUNT(*) AS dropouts,
+                   COUNT(o.new_dropoutexplanation) AS with_explanation
+            FROM DynamicsShortlisted.dbo.opportunity o
+            JOIN DynamicsShortlisted.dbo.dropout_reason dr ON o.new_dropoutreason = dr.DropoutReasonID
+            GROUP BY dr.DropoutReason
+            ORDER BY dropouts DESC
+        """],
+        "follow_ups": ["Sort them by with explanation descending", "Top 3 by dropouts"],
+    },
+    {
+        "question": "Analyze the opportunities that dropped out based on sales reps’ performance. Include their opportunities-to-leads ratio.",
+        "query_type": "DATA_QUESTION",
+        "sql": ["""
+            SELECT ow.fullname AS sales_rep,
+                   COUNT(DISTINCT o.opportunityid) AS dropped_opportunities,
+                   COUNT(DISTINCT l.leadid) AS leads,
+                   CAST(COUNT(DISTINCT o.opportunityid) AS FLOAT) / NULLIF(COUNT(DISTINCT l.leadid), 0) AS opportunities_to_leads
+            FROM DynamicsShortlisted.dbo.owner ow
+            LEFT JOIN DynamicsShortlisted.dbo.opportunity o
+                ON REPLACE(REPLACE(o.ownerid, '{', ''), '}', '') = ow.ownerid AND o.new_dropoutreason IS NOT NULL
+            LEFT JOIN DynamicsShortlisted.dbo.lead l
+                ON REPLACE(REPLACE(l.ownerid, '{', ''), '}', '') = ow.ownerid
+            GROUP BY ow.fullname
+            ORDER BY dropped_opportunities DESC
+        """],
+        "follow_ups": ["Only those with leads over 10", "Top 5 reps by opportunities to leads"],
+    },
+    {
+        # The fixture has no recent data: the first query returns nothing and is regenerated
+        "question": "How many leads were created last month?",
+        "query_type": "DATA_QUESTION",
+        "sql": [
+            """
+            SELECT TOP 100 l.leadid, l.companyname, l.createdon
+            FROM DynamicsShortlisted.dbo.lead l
+            WHERE l.createdon >= DATEADD(month, -1, GETDATE())
+            ORDER BY l.createdon DESC
+            """,
+            """
+            SELECT COUNT(*) AS leads_created
+            FROM DynamicsShortlisted.dbo.lead l
+            WHERE l.createdon >= DATEADD(month, -1, (SELECT MAX(createdon) FROM DynamicsShortlisted.dbo.lead))
+            """,
+        ],
+    },
+    {
+        "question": "What are the top reasons for opportunity dropouts and their counts?",
+        "query_type": "DATA_QUESTION",
+        "sql": ["""
+            SELECT dr.DropoutReason, COUNT(*) AS dropout_count
+            FROM DynamicsShortlisted.dbo.opportunity o
+            JOIN DynamicsShortlisted.dbo.dropout_reason dr ON o.new_dropoutreason = dr.DropoutReasonID
+            GROUP BY dr.DropoutReason
+            ORDER BY dropout_count DESC
+        """],
+    },
+    {
+        # Misspelled column: fixed by the local repair rules, without another LLM call
+        "question": "Which email subjects get opened most often?",
+        "query_type": "DATA_QUESTION",
+        "sql": ["""
+            SELECT TOP 20 e.subject, SUM(e.opencount) AS opens
+            FROM DynamicsShortlisted.dbo.email e
+            GROUP BY e.subject
+            ORDER BY SUM(e.open_count) DESC
+        """],
+    },
+    {
+        # Wide, long result: exercises batched fetching and the result profile
+        "question": "List every lead with its company, city, source and creation date.",
+        "query_type": "DATA_QUESTION",
+        "sql": ["""
+            SELECT l.leadid, l.companyname, l.address1_city, s.Label AS lead_source, l.createdon
+            FROM DynamicsShortlisted.dbo.lead l
+            LEFT JOIN DynamicsShortlisted.dbo.source s
+                ON s.LogicalName = 'xt_leadsource' AND s.Value = l.xt_leadsource
+            ORDER BY l.createdon
+        """],
+        "follow_ups": ["Count by lead source", "Just the ones where lead source is Webinar, first 10"],
+    },
+    {
+        "question": "What was our marketing spend per ad campaign last quarter?",
+        "query_type": "DATA_QUESTION",
+        "answerable": False,
+        "sql": [],
+    },
+    {
+        "question": "What are industry best practices for reducing dropouts?",
+        "query_type": "GENERAL_QUESTION",
+        "sql": [],
+    },
+    {
+        "question": "What's the weather like in Lisbon today?",
+        "query_type": "OUT_OF_SCOPE",
+        "sql": [],
+    },
+]
+
+# First marker found in the prompt decides which response the fake LLM gives
+PROMPT_KINDS = [
+    ("You are a query classifier", "triage"),
+    ("You decide whether a follow-up question", "follow_up"),
+    ("You are a query planner", "fused_plan"),
+    ("Previous Query (if any)", "regeneration"),
+    ("is too expensive", "regeneration"),
+    ('"candidates": [', "candidates"),
+    ("You are a database expert. Analyze", "schema_analysis"),
+    ("You are an expert SQL query generator for a CRM database", "sql_generation"),
+    ("You are an expert SQL query generator.", "sql"),
+    ("You are the AskAstera assistant", "answer"),
+    ("final quality check", "validation"),
+    ("You are a CRM expert", "general"),
+    ("Given the following data results", "analysis"),
+]
+TABLE_PATTERN = re.compile(r'DynamicsShortlisted\.dbo\.\w+', re.IGNORECASE)
+ROWS_PATTERN = re.compile(r'Rows: ([^;\n]+)')
+# Every prompt states the user's question on a "Question:" / "User Question:" line; the
+# triage prompt also quotes example questions, which must not be mistaken for it
+QUESTION_LINE_PATTERN = re.compile(r'Question: *(.+)')
+
+
+def prompt_kind(prompt: str) -> str:
+    for marker, kind in PROMPT_KINDS:
+        if marker in prompt:
+            return kind
+    raise ValueError(f"Benchmark LLM does not recognize this prompt: {prompt[:80]!r}")
+
+
+class FakeLLM:
+    """Deterministic stand-in for ChatOpenAI (invoke, ainvoke and stream).
+
+    Answers each prompt from the corpus entry whose question it asks, after an optional
+    fixed latency, and counts calls and tokens.
+    """
+
+    def __init__(self, corpus: List[dict], latency: float = 0.0):
+        # Longest question first, so a question quoted inside another can't shadow it
+        self.corpus = sorted(corpus, key=lambda entry: len(entry["question"]), reverse=True)
+        self.latency = latency
+        self.counters = {"llm_calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        self._regenerations = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """Start the next question: regeneration prompts get the first alternative again"""
+        with self._lock:
+            self._regenerations.clear()
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counters)
+
+    def _entry(self, prompt: str) -> dict:
+        asked = QUESTION_LINE_PATTERN.findall(prompt)
+        for entry in self.corpus:
+            if any(entry["question"] in line for line in asked):
+                return entry
+        # A follow-up answered from the cached result still gets its answer prompt
+        for entry in self.corpus:
+            if any(follow_up in line for follow_up in entry.get("follow_ups", []) for line in asked):
+                return entry
+        raise ValueError(f"Benchmark LLM got a prompt for a question not in the corpus: {prompt[:80]!r}")
+
+    def _analysis(self, entry: dict) -> dict:
+        answerable = entry.get("answerable", True)
+        tables = sorted(set(TABLE_PATTERN.findall(entry["sql"][0]))) if entry["sql"] else []
+        return {
+            "isAnswerable": answerable,
+            "outOfScopeReason": None if answerable else "The schema has no marketing spend data",
+            "relevantTables": [{"tableName": table, "fields": [], "reason": "Used by the benchmark query"} for table in tables],
+            "relationships": [],
+            "conditions": [],
+        }
+
+    def _next_sql(self, entry: dict) -> str:
+        with self._lock:
+            self._regenerations[entry["question"]] += 1
+            attempt = self._regenerations[entry["question"]]
+        return entry["sql"][min(attempt, len(entry["sql"]) - 1)].strip()
+
+    def respond(self, prompt: str) -> str:
+        kind = prompt_kind(prompt)
+        if kind == "follow_up":
+            # Corpus follow-ups are all handled by the rules; anything else needs a new query
+            return json.dumps({"action": "new_query"})
+        entry = self._entry(prompt)
+        first_sql = entry["sql"][0].strip() if entry["sql"] else None
+        if kind == "triage":
+            return json.dumps({"queryType": entry["query_type"], "confidence": 0.95})
+        if kind == "schema_analysis":
+            return json.dumps(self._analysis(entry))
+        if kind == "fused_plan":
+            plan = {"queryType": entry["query_type"], "isAnswerable": None, "outOfScopeReason": None}
+            if entry["query_type"] == "DATA_QUESTION":
+                plan.update(self._analysis(entry))
+            plan.update({"query": first_sql if plan["isAnswerable"] else None, "explanation": "Benchmark query"})
+            return json.dumps(plan)
+        if kind == "sql_generation":
+            return json.dumps({"query": first_sql, "explanation": "Benchmark query"})
+        if kind == "candidates":
+            queries = entry.get("candidates") or [first_sql]
+            return json.dumps({"candidates": [{"query": query.strip(), "explanation": "Benchmark query"} for query in queries]})
+        if kind == "regeneration":
+            return self._next_sql(entry)
+        if kind == "sql":
+            return first_sql
+        if kind == "answer":
+            rows = ROWS_PATTERN.search(prompt)
+            answer = f"The query returned {rows.group(1) if rows else 'no'} rows for this question."
+            return json.dumps({"user_query": entry["question"], "answer": answer})
+        if kind == "validation":
+            return json.dumps({"isValid": True, "reason": "The answer addresses the question", "suggestedFix": None,
+                               "confidence": 0.9})
+        if kind == "general":
+            return "Qualify leads early, follow up within a day and review dropout reasons with the team every month."
+        return "The results above answer the question."
+
+    def _complete(self, messages) -> str:
+        prompt = "\n".join(message.content for message in messages)
+        content = self.respond(prompt)
+        prompt_tokens, completion_tokens = count_tokens(prompt), count_tokens(content)
+        with self._lock:
+            self.counters["llm_calls"] += 1
+            self.counters["prompt_tokens"] += prompt_tokens
+            self.counters["completion_tokens"] += completion_tokens
+        # Attribute usage to the enclosing span, as TracingCallback does for ChatOpenAI
+        active = tracing.current_span()
+        if active is not None:
+            active.add_usage(prompt_tokens, completion_tokens, 0.0)
+        return content
+
+    def invoke(self, messages, **kwargs) -> AIMessage:
+        content = self._complete(messages)
+        if self.latency:
+            time.sleep(self.latency)
+        return AIMessage(content=content)
+
+    async def ainvoke(self, messages, **kwargs) -> AIMessage:
+        content = self._complete(messages)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return AIMessage(content=content)
+
+    def stream(self, messages, **kwargs):
+        content = self._complete(messages)
+        if self.latency:
+            time.sleep(self.latency)
+        for i in range(0, len(content), STREAM_CHUNK_CHARS):
+            yield AIMessageChunk(content=content[i:i + STREAM_CHUNK_CHARS])
+
+
+def install_complex_app(llm, pool: FixturePool, id_keys: Optional[IdKeyRewriter], keep_caches: bool,
+                        router: Optional[ModelRouter] = None):
+    """Point sql_complex_app at an LLM (the fake one, or any chat model) for every stage, or at a router, and the fixture pool"""
+    import sql_complex_app as app
+    app.router = router or ModelRouter(lambda route: llm)
+    # Benchmark labels mustn't end up in the triage training log, nor a local model in the call counts
+    app.triage_classifier = None
+    app.triage_labels = TriageLabelLog(os.devnull)
+    app.get_pool = lambda *args, **kwargs: pool
+    app.id_keys = id_keys
+    app.cost_gate = None  # needs SQL Server's estimated plans
+    app.replica = None
+    if not keep_caches:
+        app.query_cache = None
+        app.result_cache = None
+    return app
+
+
+def install_streamlit_app(llm: FakeLLM, pool: FixturePool, id_keys: Optional[IdKeyRewriter]):
+    """Point sql_query_app at the fake LLM and the fixture pool (its result cache stays off)"""
+    import logging
+    # sql_query_app builds its ChatOpenAI client at import, which fails without a key; no call ever reaches it
+    os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+    import sql_query_app as app
+    # Bare-mode warnings about the missing Streamlit runtime would drown the report
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").disabled = True
+    app.llm = llm
+    app.get_db_pool = lambda: pool
+    app.get_id_keys = lambda: id_keys
+    app.get_cost_gate = lambda: None
+    app.get_result_cache = lambda: None
+    return app
+
+
+def drain_speculation(app):
+    """Wait for speculative schema analyses still running, so their calls count for the question that started them"""
+    executor = app.speculation_executor
+    app.speculation_executor = ThreadPoolExecutor(max_workers=executor._max_workers,
+                                                  thread_name_prefix="speculative-analysis")
+    executor.shutdown(wait=True)
+
+
+def flow_runner(flow: str, llm: FakeLLM, pool: FixturePool, id_keys, planning_mode: str, keep_caches: bool,
+                corpus: List[dict]) -> Callable:
+    """Function running one question through the flow, returning (query_type, result frame)"""
+    if flow == "streamlit":
+        app = install_streamlit_app(llm, pool, id_keys)
+
+        def run(question: str):
+            # Same steps as create_streamlit_app, without the widgets
+            with tracing.span("question"):
+                sql_query = app.generate_sql_query(question, select_schema_context(question, app.DB_SCHEMA))
+                results = app.execute_sql_query(sql_query)
+                if results is None:
+                    return "ERROR", None
+                "".join(app.stream_analysis(results, question))
+                return "DATA_QUESTION", results
+        return run
+
+    app = install_complex_app(llm, pool, id_keys, keep_caches)
+    if flow == "complex_follow_up":
+        from follow_up import Conversation
+        base_of = {follow_up: entry["question"] for entry in corpus for follow_up in entry.get("follow_ups", [])}
+        base_results = {}
+
+        def run(question: str):
+            # The base question runs once (in the untimed pass); each follow-up starts from its cached result
+            base = base_of[question]
+            if base not in base_results:
+                conversation = Conversation()
+                app.process_query(base, planning_mode, conversation)
+                drain_speculation(app)
+                base_results[base] = conversation.results()[0]
+            cached = base_results[base]
+            conversation = Conversation()
+            conversation.remember(cached.question, cached.sql, cached.df)
+            _, results, query_type = app.process_query(question, planning_mode, conversation)
+            drain_speculation(app)
+            return query_type, results
+    elif flow == "complex_async":
+        def run(question: str):
+            _, results, query_type = asyncio.run(app.process_query_async(question, planning_mode))
+            return query_type, results
+    else:
+        def run(question: str):
+            _, results, query_type = app.process_query(question, planning_mode)
+            drain_speculation(app)
+            return query_type, results
+    return run
+
+
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def counter_deltas(before: dict, after: dict) -> dict:
+    """Change of every monotonic component counter (repairs, cache hits/misses, ...) as "component.key" """
+    deltas = {}
+    for name, values in after.items():
+        for key, value in values.items():
+            if key in COUNTER_GAUGES:
+                continue
+            delta = value - before.get(name, {}).get(key, 0)
+            if delta:
+                deltas[f"{name}.{key}"] = delta
+    return deltas
+
+
+def measure(run: Callable, question: str, llm: FakeLLM, pool: FixturePool, profile_memory: bool, verbose: bool) -> dict:
+    """One run of one question: latency, counter deltas and (optionally) peak traced memory"""
+    llm.reset()
+    llm_before, db_before = llm.snapshot(), pool.snapshot()
+    retries_before = tracing.stage_totals().get("question", {}).get("retries", 0)
+    counters_before = tracing.counter_values()
+    if profile_memory:
+        tracemalloc.start()
+    output = sys.stdout if verbose else io.StringIO()
+    start = time.perf_counter()
+    error = None
+    try:
+        with redirect_stdout(output):
+            query_type, results = run(question)
+    except Exception as e:
+        query_type, results, error = "ERROR", None, f"{type(e).__name__}: {str(e)}"
+    latency = time.perf_counter() - start
+    peak = 0
+    if profile_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    llm_after, db_after = llm.snapshot(), pool.snapshot()
+    row = {name: llm_after[name] - llm_before[name] for name in llm_after}
+    row.update({name: db_after[name] - db_before[name] for name in db_after})
+    row.update({
+        "query_type": query_type,
+        "error": error,
+        "retries": tracing.stage_totals().get("question", {}).get("retries", 0) - retries_before,
+        "counters": counter_deltas(counters_before, tracing.counter_values()),
+        "result_rows": 0 if results is None else len(results),
+        "latency_s": latency,
+        "peak_memory_kib": round(peak / 1024),
+    })
+    return row
+
+
+def summarize(rows: List[dict]) -> dict:
+    summary = {}
+    for flow in dict.fromkeys(row["flow"] for row in rows):
+        flow_rows = [row for row in rows if row["flow"] == flow]
+        flow_latencies = [latency for row in flow_rows for latency in row["latencies"]]
+        summary[flow] = {
+            "questions": len(flow_rows),
+            "errors": sum(row["query_type"] == "ERROR" for row in flow_rows),
+            "latency_p50_s": round(statistics.median(flow_latencies), 4),
+            "latency_p95_s": round(_percentile(flow_latencies, 0.95), 4),
+            "llm_calls": sum(row["llm_calls"] for row in flow_rows),
+            "prompt_tokens": sum(row["prompt_tokens"] for row in flow_rows),
+            "retries": sum(row["retries"] for row in flow_rows),
+            "rows_fetched": sum(row["rows_fetched"] for row in flow_rows),
+            "peak_memory_kib": max(row["peak_memory_kib"] for row in flow_rows),
+            "counters": dict(sum((Counter(row["counters"]) for row in flow_rows), Counter())),
+        }
+    return summary
+
+
+def benchmark_flow(flow: str, corpus: List[dict], run: Callable, llm: FakeLLM, pool: FixturePool, args) -> List[dict]:
+    """Per-question rows for one flow; each row keeps its raw timings under "latencies" """
+    if flow == "streamlit":
+        # The Streamlit app has no triage: it only handles answerable data questions
+        corpus = [entry for entry in corpus
+                  if entry["query_type"] == "DATA_QUESTION" and entry.get("answerable", True)]
+    elif flow == "complex_follow_up":
+        corpus = [{"question": follow_up, "query_type": "DATA_QUESTION"}
+                  for entry in corpus for follow_up in entry.get("follow_ups", [])]
+    # One untimed pass, so lazy imports and first-use setup don't land on the first question
+    for entry in corpus:
+        measure(run, entry["question"], llm, pool, False, args.verbose)
+
+    rows = []
+    for entry in corpus:
+        question = entry["question"]
+        # Counters and peak memory come from a separate run; tracemalloc would distort the timings
+        row = measure(run, question, llm, pool, profile_memory=True, verbose=args.verbose)
+        timings = [measure(run, question, llm, pool, False, args.verbose)["latency_s"] for _ in range(args.runs)]
+        del row["latency_s"]
+        row.update({
+            "flow": flow,
+            "question": question,
+            "latency_p50_s": round(statistics.median(timings), 4),
+            "latency_p95_s": round(_percentile(timings, 0.95), 4),
+            "latency_mean_s": round(statistics.mean(timings), 4),
+            "latencies": timings,
+        })
+        rows.append(row)
+        status = row["error"] or row["query_type"]
+        print(f"{flow:<14} {question[:48]:<48} {row['latency_p50_s']:8.3f}s  {row['llm_calls']} calls  "
+              f"{row['retries']} retries  {row['rows_fetched']:>6} rows  {row['peak_memory_kib']:>7} KiB  {status}")
+    return rows
+
+
+def run_benchmark(args) -> int:
+    corpus = CORPUS
+    if args.corpus:
+        with open(args.corpus) as f:
+            corpus = json.load(f)
+    flows = [flow.strip() for flow in args.flows.split(",") if flow.strip()]
+    unknown = [flow for flow in flows if flow not in FLOWS]
+    if unknown:
+        print(f"Unknown flow(s): {', '.join(unknown)}; choose from {', '.join(FLOWS)}")
+        return 2
+
+    # Spans feed the retry counts; they aren't written anywhere unless asked for
+    tracing.TRACING_ENABLED = True
+    tracing.TRACE_LOG_PATH = args.trace_log or os.devnull
+
+    from sql_complex_app import CATALOG
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="pipeline-benchmark-") as workdir:
+        # A file, not :memory:, so every pooled connection sees the same data
+        start = time.perf_counter()
+        pool, available_keys = build_fixture_pool(os.path.join(workdir, "crm.sqlite"), CATALOG, args.scale, args.seed)
+        print(f"Built fixture at scale {args.scale} in {time.perf_counter() - start:.1f}s")
+
+        llm = FakeLLM(corpus, latency=args.llm_latency)
+        id_keys = IdKeyRewriter(CATALOG, available=available_keys)
+        for flow in flows:
+            run = flow_runner(flow, llm, pool, id_keys, args.planning_mode, args.keep_caches, corpus)
+            rows += benchmark_flow(flow, corpus, run, llm, pool, args)
+
+    summary = summarize(rows)
+    for flow, values in summary.items():
+        print(f"\n{flow}: {json.dumps(values)}")
+
+    if args.output:
+        config = {
+            "flows": flows,
+            "scale": args.scale,
+            "seed": args.seed,
+            "runs": args.runs,
+            "planning_mode": args.planning_mode,
+            "llm_latency_s": args.llm_latency,
+            "keep_caches": args.keep_caches,
+            "sqlglot": SQLGLOT_AVAILABLE,
+        }
+        ordered = [{key: row[key] for key in ("flow", "question", *DETERMINISTIC_METRICS, "error", *TIMING_METRICS,
+                                               "latency_mean_s", "counters")} for row in rows]
+        with open(args.output, "w") as f:
+            json.dump({"config": config, "summary": summary, "questions": ordered}, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        print(f"Wrote {args.output}")
+    return 0 if not any(row["error"] for row in rows) else 1
+
+
+def compare(baseline_path: str, candidate_path: str, tolerance: float) -> int:
+    """Print what changed between two benchmark files; exit status 1 on a regression"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(candidate_path) as f:
+        candidate = json.load(f)
+    if baseline["config"] != candidate["config"]:
+        print(f"Warning: configurations differ\n  {baseline['config']}\n  {candidate['config']}")
+
+    before = {(row["flow"], row["question"]): row for row in baseline["questions"]}
+    after = {(row["flow"], row["question"]): row for row in candidate["questions"]}
+    regressions = 0
+    for key in sorted(before.keys() | after.keys()):
+        flow, question = key
+        label = f"{flow} / {question[:60]}"
+        if key not in after or key not in before:
+            print(f"{label}: only in {'baseline' if key in before else 'candidate'}")
+            continue
+        old, new = before[key], after[key]
+        for metric in DETERMINISTIC_METRICS:
+            if old[metric] == new[metric]:
+                continue
+            worse = metric == "query_type" or new[metric] > old[metric]
+            regressions += worse
+            print(f"{label}: {metric} {old[metric]} -> {new[metric]}{'  REGRESSION' if worse else ''}")
+        for metric in TIMING_METRICS:
+            floor = MEMORY_NOISE_FLOOR_KIB if metric == "peak_memory_kib" else LATENCY_NOISE_FLOOR_S
+            if abs(new[metric] - old[metric]) <= floor:
+                continue
+            if new[metric] > old[metric] * (1 + tolerance):
+                regressions += 1
+                print(f"{label}: {metric} {old[metric]} -> {new[metric]}  REGRESSION")
+            elif new[metric] < old[metric] / (1 + tolerance):
+                print(f"{label}: {metric} {old[metric]} -> {new[metric]}")
+
+    print(f"\n{regressions} regression(s)")
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Replay the corpus and report per-question metrics")
+    run.add_argument("--flows", default="complex,streamlit", help=f"Comma-separated flows out of {', '.join(FLOWS)}")
+    run.add_argument("--scale", type=float, default=0.1, help="Dataset size relative to crm_fixture.TABLE_ROWS")
+    run.add_argument("--seed", type=int, default=7, help="Fixture random seed")
+    run.add_argument("--runs", type=int, default=3, help="Timed repetitions per question, after one profiled run")
+    run.add_argument("--planning-mode", default="staged", choices=("staged", "fused"))
+    run.add_argument("--llm-latency", type=float, default=0.0, help="Seconds the fake LLM waits per call")
+    run.add_argument("--keep-caches", action="store_true", help="Leave the query and result caches on (complex flows)")
+    run.add_argument("--corpus", help="JSON list of {question, query_type, sql: [...], answerable} to replay instead")
+    run.add_argument("--trace-log", help="Also write the pipeline's trace spans to this file")
+    run.add_argument("--output", help="Write the results as JSON to this file")
+    run.add_argument("--verbose", action="store_true", help="Show the pipelines' own output")
+
+    diff = commands.add_parser("compare", help="Compare two benchmark JSON files")
+    diff.add_argument("baseline")
+    diff.add_argument("candidate")
+    diff.add_argument("--tolerance", type=float, default=0.25, help="Relative timing change tolerated as noise")
+
+    args = parser.parse_args(argv)
+    if args.command == "compare":
+        return compare(args.baseline, args.candidate, args.tolerance)
+    return run_benchmark(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
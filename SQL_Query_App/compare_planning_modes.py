@@ -0,0 +1,98 @@
+"""Compare latency and token usage of staged vs fused planning.
+
+Usage:
+    python compare_planning_modes.py [--runs 1] [--output planning_comparison.json] [questions ...]
+
+Only the planning step is measured (no database access), so the numbers show
+what each mode costs before the first query is executed.
+"""
+import sys
+import json
+import time
+import argparse
+import statistics
+
+from langchain_community.callbacks import get_openai_callback
+
+from sql_complex_app import plan_query, TEST_QUESTIONS
+
+MODES = ("staged", "fused")
+
+
+def measure(question: str, mode: str) -> dict:
+    """Plan one question in the given mode and record latency and token usage"""
+    with get_openai_callback() as cb:
+        start = time.perf_counter()
+        try:
+            plan = plan_query(question, planning_mode=mode)
+            error = None
+        except Exception as e:
+            plan, error = {}, str(e)
+        latency = time.perf_counter() - start
+
+    return {
+        "question": question,
+        "mode": mode,
+        "planning_mode_used": plan.get("planning_mode"),
+        "query_type": plan.get("query_type"),
+        "latency_s": round(latency, 3),
+        "llm_calls": cb.successful_requests,
+        "prompt_tokens": cb.prompt_tokens,
+        "completion_tokens": cb.completion_tokens,
+        "total_tokens": cb.total_tokens,
+        "cost_usd": round(cb.total_cost, 6),
+        "error": error,
+    }
+
+
+def summarize(rows: list) -> dict:
+    summary = {}
+    for mode in MODES:
+        mode_rows = [r for r in rows if r["mode"] == mode and not r["error"]]
+        if not mode_rows:
+            continue
+        latencies = sorted(r["latency_s"] for r in mode_rows)
+        summary[mode] = {
+            "runs": len(mode_rows),
+            "latency_p50_s": round(statistics.median(latencies), 3),
+            "latency_p95_s": round(latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))], 3),
+            "avg_llm_calls": round(statistics.mean(r["llm_calls"] for r in mode_rows), 2),
+            "avg_total_tokens": round(statistics.mean(r["total_tokens"] for r in mode_rows), 1),
+            "avg_cost_usd": round(statistics.mean(r["cost_usd"] for r in mode_rows), 6),
+            "fallbacks": sum(r["planning_mode_used"] == "staged_fallback" for r in mode_rows),
+        }
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("questions", nargs="*", help="Questions to plan (defaults to TEST_QUESTIONS)")
+    parser.add_argument("--runs", type=int, default=1, help="Repetitions per question and mode")
+    parser.add_argument("--output", help="Write per-run rows and the summary as JSON to this file")
+    args = parser.parse_args(argv)
+
+    questions = args.questions or TEST_QUESTIONS
+    rows = []
+    for _ in range(args.runs):
+        for question in questions:
+            # Alternate modes per question so drift in API latency affects both equally
+            for mode in MODES:
+                row = measure(question, mode)
+                rows.append(row)
+                print(f"[{mode:>6}] {row['latency_s']:6.2f}s {row['total_tokens']:6d} tok "
+                      f"{row['llm_calls']} calls  {question[:60]}")
+
+    summary = summarize(rows)
+    print("\nSummary:")
+    print(f"{'mode':<8}{'p50 s':>8}{'p95 s':>8}{'calls':>8}{'tokens':>10}{'cost $':>10}{'fallbacks':>11}")
+    for mode, s in summary.items():
+        print(f"{mode:<8}{s['latency_p50_s']:>8}{s['latency_p95_s']:>8}{s['avg_llm_calls']:>8}"
+              f"{s['avg_total_tokens']:>10}{s['avg_cost_usd']:>10}{s['fallbacks']:>11}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"summary": summary, "runs": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
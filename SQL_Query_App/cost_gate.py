@@ -0,0 +1,126 @@
+import os
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+# Pre-flight cost check on the estimated plan; off unless enabled
+COST_GATE_ENABLED = os.getenv("COST_GATE_ENABLED", "false").lower() == "true"
+COST_GATE_MAX_COST = float(os.getenv("COST_GATE_MAX_COST", "500"))
+COST_GATE_MAX_ROWS = float(os.getenv("COST_GATE_MAX_ROWS", "10000000"))
+
+SHOWPLAN_NAMESPACE = "{http://schemas.microsoft.com/sqlserver/2004/07/showplan}"
+SCAN_OPERATORS = {"Table Scan", "Clustered Index Scan", "Index Scan"}
+
+
+class QueryTooExpensiveError(Exception):
+    """The estimated plan is above the configured cost or row limit"""
+
+
+@dataclass
+class PlanEstimate:
+    estimated_cost: float = 0.0  # optimizer subtree cost of the statement
+    estimated_rows: float = 0.0  # rows the statement is expected to return
+    scans: List[tuple] = field(default_factory=list)  # (table, operator, estimated rows)
+    warnings: List[str] = field(default_factory=list)  # e.g. NoJoinPredicate (a cross join)
+
+
+@dataclass
+class GateDecision:
+    allowed: bool
+    estimate: Optional[PlanEstimate] = None
+    reason: str = ""
+
+
+def parse_showplan_xml(plan_xml: str) -> PlanEstimate:
+    """Statement cost, rows, large scans and warnings from SHOWPLAN_XML output"""
+    root = ET.fromstring(plan_xml)
+    estimate = PlanEstimate()
+    for statement in root.iter(f"{SHOWPLAN_NAMESPACE}StmtSimple"):
+        estimate.estimated_cost += float(statement.get("StatementSubTreeCost", 0))
+        estimate.estimated_rows = max(estimate.estimated_rows, float(statement.get("StatementEstRows", 0)))
+
+    for operator in root.iter(f"{SHOWPLAN_NAMESPACE}RelOp"):
+        if operator.get("PhysicalOp") in SCAN_OPERATORS:
+            table = next(operator.iter(f"{SHOWPLAN_NAMESPACE}Object"), None)
+            name = table.get("Table", "?").strip("[]") if table is not None else "?"
+            # Rows read by the scan (newer servers) rather than rows passed on after predicates
+            rows = float(operator.get("EstimatedRowsRead") or operator.get("EstimateRows", 0))
+            estimate.scans.append((name, operator.get("PhysicalOp"), rows))
+        for warnings in operator.findall(f"{SHOWPLAN_NAMESPACE}Warnings"):
+            if warnings.get("NoJoinPredicate") == "true" and "NoJoinPredicate" not in estimate.warnings:
+                estimate.warnings.append("NoJoinPredicate")
+    return estimate
+
+
+class PlanProvider:
+    """Source of estimated plans; subclass for another engine"""
+
+    def estimate(self, query: str) -> PlanEstimate:
+        raise NotImplementedError
+
+
+class ShowplanProvider(PlanProvider):
+    """Estimated plans from SQL Server via SET SHOWPLAN_XML (the query is compiled, not run)"""
+
+    def __init__(self, connect: Callable):
+        self.connect = connect  # returns a pooled DBAPI connection
+
+    def estimate(self, query: str) -> PlanEstimate:
+        connection = self.connect()
+        cursor = connection.cursor()
+        showplan_on = False
+        try:
+            cursor.execute("SET SHOWPLAN_XML ON")
+            showplan_on = True
+            cursor.execute(query)
+            row = cursor.fetchone()
+            return parse_showplan_xml(row[0])
+        finally:
+            try:
+                if showplan_on:
+                    cursor.execute("SET SHOWPLAN_XML OFF")
+                cursor.close()
+            except Exception:
+                # A connection stuck in showplan mode would return plans instead of rows
+                invalidate = getattr(connection, "invalidate", None)
+                if invalidate:
+                    invalidate()
+            connection.close()
+
+
+class CostGate:
+    """Rejects queries whose estimated plan is above the cost or row threshold"""
+
+    def __init__(self, provider: PlanProvider, max_cost: float = COST_GATE_MAX_COST,
+                 max_rows: float = COST_GATE_MAX_ROWS):
+        self.provider = provider
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+
+    def check(self, query: str) -> GateDecision:
+        try:
+            estimate = self.provider.estimate(query)
+        except Exception as e:
+            # The gate is advisory: if no plan can be produced, let the query run
+            print(f"Cost gate could not estimate the plan: {str(e)}")
+            return GateDecision(True, reason="no estimate")
+
+        problems = []
+        if estimate.estimated_cost > self.max_cost:
+            problems.append(f"estimated cost {estimate.estimated_cost:,.1f} exceeds {self.max_cost:,.1f}")
+        if estimate.estimated_rows > self.max_rows:
+            problems.append(f"estimated {estimate.estimated_rows:,.0f} rows exceeds {self.max_rows:,.0f}")
+        if "NoJoinPredicate" in estimate.warnings:
+            problems.append("the plan contains a join without a join predicate (cross join)")
+        if problems:
+            largest = sorted(estimate.scans, key=lambda scan: -scan[2])[:3]
+            scans = ", ".join(f"{operator} on {table} (~{rows:,.0f} rows)" for table, operator, rows in largest)
+            reason = "; ".join(problems) + (f". Largest scans: {scans}" if scans else "")
+            return GateDecision(False, estimate, reason)
+        return GateDecision(True, estimate)
+
+    def enforce(self, query: str) -> PlanEstimate:
+        decision = self.check(query)
+        if not decision.allowed:
+            raise QueryTooExpensiveError(f"Query rejected before execution: {decision.reason}")
+        return decision.estimate
@@ -0,0 +1,289 @@
+"""Synthetic CRM data in SQLite, shaped like the DynamicsShortlisted schema.
+
+Every catalog table gets every column; keys are linked so joins return rows, and
+IDs are stored with and without curly braces as in the real CRM export.
+FixturePool stands in for the SQL Server pool, translating T-SQL on the way in.
+"""
+import re
+import uuid
+import random
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+try:
+    import sqlglot
+    SQLGLOT_AVAILABLE = True
+except ImportError:
+    SQLGLOT_AVAILABLE = False
+
+from schema_catalog import SchemaCatalog
+from id_keys import id_key_columns, key_column_name
+from result_cache import VERSION_COLUMNS
+
+# Rows per table at scale 1.0
+TABLE_ROWS = {
+    "owner": 50,
+    "account": 2000,
+    "contact": 4000,
+    "lead": 10000,
+    "opportunity": 3000,
+    "email": 10000,
+}
+DROPOUT_REASONS = [
+    "Doesn't Accomplish the Task", "Price Too High", "Chose a Competitor", "No Budget",
+    "Project Cancelled", "No Response", "Missing Integration", "Performance Concerns",
+]
+LEAD_SOURCES = ["Website", "Google Ads", "Referral", "Webinar", "Trade Show", "Partner", "Cold Call", "Email Campaign"]
+SQLITE_TYPES = {"String": "TEXT", "Integer": "INTEGER", "Decimal": "REAL", "Date": "TEXT", "Boolean": "INTEGER"}
+NULL_RATE = 0.1
+BRACED_RATE = 0.5
+START_DATE = datetime(2022, 1, 1)
+DATE_RANGE_DAYS = 3 * 365
+
+SCHEMA_PREFIX_PATTERN = re.compile(r'\b(?:\[?\w+\]?\.)?\[?dbo\]?\.', re.IGNORECASE)
+
+
+TOP_PATTERN = re.compile(r'^(\s*SELECT\s+(?:DISTINCT\s+)?)TOP\s*\(?\s*(\d+)\s*\)?\s+', re.IGNORECASE)
+FUNCTION_REPLACEMENTS = [
+    (re.compile(r'\bGETDATE\s*\(\s*\)', re.IGNORECASE), "CURRENT_TIMESTAMP"),
+    (re.compile(r'\bISNULL\s*\(', re.IGNORECASE), "IFNULL("),
+    (re.compile(r'\bLEN\s*\(', re.IGNORECASE), "LENGTH("),
+]
+
+
+def sqlite_sql(query: str) -> str:
+    """Drop database/schema prefixes (DynamicsShortlisted.dbo.lead -> lead) so SQLite can run it"""
+    return SCHEMA_PREFIX_PATTERN.sub("", query)
+
+
+def tsql_to_sqlite(query: str) -> str:
+    """T-SQL as the pipeline generates it (TOP, DATEADD, ISNULL, ...) rewritten for SQLite"""
+    query = sqlite_sql(query).strip().rstrip(";")
+    if SQLGLOT_AVAILABLE:
+        try:
+            return sqlglot.transpile(query, read="tsql", write="sqlite")[0]
+        except sqlglot.errors.ParseError:
+            pass  # Let SQLite report the syntax error
+    # Without sqlglot only the most common differences are handled
+    match = TOP_PATTERN.match(query)
+    if match:
+        query = f"{match.group(1)}{query[match.end():]} LIMIT {match.group(2)}"
+    for pattern, replacement in FUNCTION_REPLACEMENTS:
+        query = pattern.sub(replacement, query)
+    return query
+
+
+def _guid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def _braced(rng: random.Random, value: str) -> str:
+    return f"{{{value}}}" if rng.random() < BRACED_RATE else value
+
+
+def _watermark_column(table) -> Optional[str]:
+    """modifiedon for the entity tables; the schema text only documents it for some of them"""
+    column = VERSION_COLUMNS.get(table.name.lower())
+    return column if column and table.primary_key and not table.column(column) else None
+
+
+def _create_tables(connection: sqlite3.Connection, catalog: SchemaCatalog):
+    for table in catalog.table_list:
+        columns = [f'"{c.name}" {SQLITE_TYPES.get(c.data_type, "TEXT")}' for c in table.columns.values()]
+        if _watermark_column(table):
+            columns.append(f'"{_watermark_column(table)}" TEXT')
+        connection.execute(f'CREATE TABLE "{table.name}" ({", ".join(columns)})')
+
+
+def _lookup_rows(catalog: SchemaCatalog) -> Dict[str, List[dict]]:
+    rows = {}
+    if catalog.table("dropout_reason"):
+        rows["dropout_reason"] = [{"DropoutReasonID": i, "DropoutReason": reason}
+                                  for i, reason in enumerate(DROPOUT_REASONS, 1)]
+    if catalog.table("source"):
+        rows["source"] = [{"LogicalName": "xt_leadsource", "Value": i, "Label": label}
+                          for i, label in enumerate(LEAD_SOURCES, 1)]
+    return rows
+
+
+def create_crm_fixture(path: str, catalog: SchemaCatalog, scale: float = 1.0, seed: int = 7) -> sqlite3.Connection:
+    """Create and fill a SQLite database at path (":memory:" works); returns the open connection"""
+    rng = random.Random(seed)
+    connection = sqlite3.connect(path, check_same_thread=False)
+    _create_tables(connection, catalog)
+
+    counts = {name: max(1, int(rows * scale)) for name, rows in TABLE_ROWS.items()}
+    counts["owner"] = TABLE_ROWS["owner"]
+    # Generate every primary key first: account -> lead -> account references are circular
+    keys = {}
+    for table in catalog.table_list:
+        if table.name in counts and table.primary_key:
+            keys[table.full_name] = [_guid(rng) for _ in range(counts[table.name])]
+    owner_ids = list(range(1, counts["owner"] + 1))
+    entity_keys = [key for table_keys in keys.values() for key in table_keys]
+
+    def random_date():
+        moment = START_DATE + timedelta(days=rng.randrange(DATE_RANGE_DAYS), seconds=rng.randrange(86400))
+        return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+    def value(table, column, row_index):
+        if column.name == table.primary_key:
+            return _braced(rng, keys[table.full_name][row_index])
+        if column.references and column.references[0] in keys:
+            return None if rng.random() < NULL_RATE else _braced(rng, rng.choice(keys[column.references[0]]))
+        name = column.name.lower()
+        if name == "ownerid":
+            return _braced(rng, str(rng.choice(owner_ids))) if column.data_type == "String" else rng.choice(owner_ids)
+        if name == "new_dropoutreason":
+            return rng.randint(1, len(DROPOUT_REASONS)) if rng.random() < 0.4 else None
+        if name == "xt_leadsource":
+            return rng.randint(1, len(LEAD_SOURCES))
+        if rng.random() < NULL_RATE:
+            return None
+        if column.is_polymorphic or (column.data_type == "String" and name.endswith("id")):
+            return _braced(rng, rng.choice(entity_keys))
+        if column.data_type == "Date":
+            return random_date()
+        if column.data_type == "Integer":
+            return rng.randint(1, 10)
+        if column.data_type == "Decimal":
+            return round(rng.uniform(0, 100000), 2)
+        if column.data_type == "Boolean":
+            return rng.randint(0, 1)
+        return f"{column.name} {rng.randint(1, 20)}"
+
+    lookups = _lookup_rows(catalog)
+    for table in catalog.table_list:
+        columns = list(table.columns.values())
+        if table.name in lookups:
+            rows = [tuple(row.get(c.name) for c in columns) for row in lookups[table.name]]
+        elif table.name == "owner":
+            rows = [tuple(i if c.name.lower() == "ownerid" else f"Sales Rep {i}" for c in columns) for i in owner_ids]
+        elif table.name in counts:
+            rows = [tuple(value(table, c, i) for c in columns) for i in range(counts[table.name])]
+            if _watermark_column(table):
+                rows = [row + (random_date(),) for row in rows]
+        else:
+            continue
+        placeholders = ", ".join("?" for _ in rows[0]) if rows else ""
+        connection.executemany(f'INSERT INTO "{table.name}" VALUES ({placeholders})', rows)
+
+    # Plain indexes on the raw ID columns, as the production tables have
+    for table, columns in id_key_columns(catalog).items():
+        short_name = table.split(".")[-1]
+        for column in columns:
+            connection.execute(f'CREATE INDEX "ix_{short_name}_{column}" ON "{short_name}" ("{column}")')
+    connection.commit()
+    return connection
+
+
+def add_id_keys(connection: sqlite3.Connection, catalog: SchemaCatalog) -> Set[Tuple[str, str]]:
+    """Indexed normalized key columns, the SQLite counterpart of id_keys.key_columns_ddl.
+
+    Returns the (table, column) set to pass to IdKeyRewriter as available keys.
+    """
+    available = set()
+    for table, columns in id_key_columns(catalog).items():
+        short_name = table.split(".")[-1]
+        for column in columns:
+            key = key_column_name(column)
+            connection.execute(
+                f'ALTER TABLE "{short_name}" ADD COLUMN "{key}" TEXT '
+                f"GENERATED ALWAYS AS (REPLACE(REPLACE(\"{column}\", '{{', ''), '}}', '')) VIRTUAL"
+            )
+            connection.execute(f'CREATE INDEX "ix_{short_name}_{key}" ON "{short_name}" ("{key}")')
+            available.add((table.lower(), column.lower()))
+    connection.commit()
+    return available
+
+
+def build_fixture_pool(path: str, catalog: SchemaCatalog, scale: float = 1.0,
+                       seed: int = 7) -> Tuple["FixturePool", Set[Tuple[str, str]]]:
+    """Fixture file with key columns at path; returns a pool on it and the available key columns"""
+    connection = create_crm_fixture(path, catalog, scale=scale, seed=seed)
+    available = add_id_keys(connection, catalog)
+    connection.close()
+    return FixturePool(path), available
+
+
+class FixtureCursor:
+    """DBAPI cursor over the fixture that accepts the T-SQL sent to SQL Server"""
+
+    def __init__(self, connection: "FixtureConnection"):
+        self.connection = connection
+        self.cursor = connection.sqlite.cursor()
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    def execute(self, query: str, params=()):
+        self.connection.pool.record("statements")
+        self.cursor.execute(tsql_to_sqlite(query), params)
+        return self
+
+    def fetchmany(self, size: int = 1) -> list:
+        rows = self.cursor.fetchmany(size)
+        self.connection.pool.record("rows_fetched", len(rows))
+        return rows
+
+    def fetchall(self) -> list:
+        rows = self.cursor.fetchall()
+        self.connection.pool.record("rows_fetched", len(rows))
+        return rows
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        self.connection.pool.record("rows_fetched", row is not None)
+        return row
+
+    def cancel(self):
+        self.connection.sqlite.interrupt()
+
+    def close(self):
+        self.cursor.close()
+
+
+class FixtureConnection:
+    def __init__(self, pool: "FixturePool"):
+        self.pool = pool
+        self.sqlite = sqlite3.connect(pool.path, check_same_thread=False)
+
+    def cursor(self) -> FixtureCursor:
+        return FixtureCursor(self)
+
+    def rollback(self):
+        self.sqlite.rollback()
+
+    def close(self):
+        self.sqlite.close()
+
+
+class FixturePool:
+    """Drop-in for db_pool's pool on a fixture file: raw_connection() opens a translating connection.
+
+    Counts statements and fetched rows, so benchmarks can report database work per question.
+    """
+
+    engine = None
+
+    def __init__(self, path: str):
+        self.path = path
+        self.counters = {"statements": 0, "rows_fetched": 0}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counters)
+
+    def raw_connection(self) -> FixtureConnection:
+        return FixtureConnection(self)
+
+    def start_warmup(self):
+        pass
@@ -0,0 +1,162 @@
+import os
+import time
+import urllib
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+# Pool settings, shared by every engine created in this process
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_POOL_MAX_OVERFLOW = int(os.getenv("DB_POOL_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT_SECONDS = int(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# Connections opened in the background when the app starts
+DB_POOL_WARMUP = int(os.getenv("DB_POOL_WARMUP", "2"))
+
+STATS_WINDOW = 1000
+
+
+def _percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class ConnectionPool:
+    """Thread-safe SQLAlchemy engine for one ODBC connection string, with checkout statistics"""
+
+    def __init__(self, odbc_connect: str, pool_size: int = DB_POOL_SIZE, max_overflow: int = DB_POOL_MAX_OVERFLOW,
+                 timeout: int = DB_POOL_TIMEOUT_SECONDS, recycle: int = DB_POOL_RECYCLE_SECONDS,
+                 pre_ping: bool = DB_POOL_PRE_PING):
+        params = urllib.parse.quote_plus(odbc_connect)
+        self.engine = create_engine(
+            f"mssql+pyodbc:///?odbc_connect={params}",
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=timeout,
+            pool_recycle=recycle,
+            pool_pre_ping=pre_ping,
+        )
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=STATS_WINDOW)  # seconds spent waiting for a checkout
+        self._ages = deque(maxlen=STATS_WINDOW)  # age of the connection handed out, seconds
+        self._counters = {"checkouts": 0, "connections_opened": 0, "invalidated": 0, "checkout_timeouts": 0}
+        self._warmup_thread = None
+
+        event.listen(self.engine, "connect", self._on_connect)
+        event.listen(self.engine, "checkout", self._on_checkout)
+        event.listen(self.engine, "invalidate", self._on_invalidate)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        connection_record.info["opened_at"] = time.monotonic()
+        with self._lock:
+            self._counters["connections_opened"] += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        age = time.monotonic() - connection_record.info.get("opened_at", time.monotonic())
+        with self._lock:
+            self._counters["checkouts"] += 1
+            self._ages.append(age)
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        # Pre-ping failures and connections dropped after errors
+        with self._lock:
+            self._counters["invalidated"] += 1
+
+    def _checkout(self, factory):
+        start = time.perf_counter()
+        try:
+            connection = factory()
+        except PoolTimeoutError:
+            with self._lock:
+                self._counters["checkout_timeouts"] += 1
+            raise
+        with self._lock:
+            self._waits.append(time.perf_counter() - start)
+        return connection
+
+    @contextmanager
+    def connect(self):
+        """SQLAlchemy connection from the pool, returned to it on exit"""
+        connection = self._checkout(self.engine.connect)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def raw_connection(self):
+        """Pooled DBAPI (pyodbc) connection; close() hands it back to the pool"""
+        return self._checkout(self.engine.raw_connection)
+
+    def warmup(self, connections: int = DB_POOL_WARMUP) -> int:
+        """Open connections ahead of the first question; returns how many were opened"""
+        opened = []
+        try:
+            for _ in range(min(connections, self.pool_size)):
+                opened.append(self.engine.raw_connection())
+        except Exception as e:
+            print(f"Connection pool warmup failed: {str(e)}")
+        finally:
+            for connection in opened:
+                connection.close()
+        return len(opened)
+
+    def start_warmup(self, connections: int = DB_POOL_WARMUP):
+        """Warm the pool in a background thread so startup isn't blocked on ODBC logins"""
+        with self._lock:
+            if self._warmup_thread is not None or connections <= 0:
+                return
+            self._warmup_thread = threading.Thread(target=self.warmup, args=(connections,),
+                                                   name="db-pool-warmup", daemon=True)
+        self._warmup_thread.start()
+
+    def stats(self) -> dict:
+        pool = self.engine.pool
+        with self._lock:
+            waits = list(self._waits)
+            ages = list(self._ages)
+            stats = dict(self._counters)
+        stats.update({
+            "pool_size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "checkout_wait_p50_ms": round(_percentile(waits, 0.5) * 1000, 2),
+            "checkout_wait_p95_ms": round(_percentile(waits, 0.95) * 1000, 2),
+            "checkout_wait_max_ms": round(max(waits, default=0.0) * 1000, 2),
+            "connection_age_p50_s": round(_percentile(ages, 0.5), 1),
+            "connection_age_max_s": round(max(ages, default=0.0), 1),
+        })
+        return stats
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(odbc_connect: str, **options) -> ConnectionPool:
+    """The process-wide pool for a connection string, created on first use"""
+    with _pools_lock:
+        pool = _pools.get(odbc_connect)
+        if pool is None:
+            pool = _pools[odbc_connect] = ConnectionPool(odbc_connect, **options)
+        return pool
+
+
+def pool_stats() -> dict:
+    """Stats for every pool in this process, keyed by server/database"""
+    with _pools_lock:
+        pools = list(_pools.items())
+    stats = {}
+    for odbc_connect, pool in pools:
+        # Never expose credentials in stats output
+        fields = dict(part.split("=", 1) for part in odbc_connect.split(";") if "=" in part)
+        stats[f"{fields.get('SERVER', '?')}/{fields.get('DATABASE', '?')}"] = pool.stats()
+    return stats
@@ -0,0 +1,316 @@
+"""Execution accuracy versus latency of NL-to-SQL model configurations.
+
+Usage:
+    python evaluate_models.py [--configs configs.json] [--only NAME ...] [--golden golden_set.json]
+                              [--scale 0.1] [--min-accuracy 0.9] [--output model_evaluation.json] [--fake] [--verbose]
+
+Every configuration (model, temperature, planning mode, SQL candidates and optional per-stage
+routes, see model_router.py) runs each golden question through sql_complex_app's whole
+pipeline, answer and validation included, against the synthetic CRM fixture (crm_fixture.py).
+Latency is end to end; answer and validation calls and time are also reported on their own.
+A data question is correct when its rows match the rows of the reference SQL on the same
+fixture; the SQL text itself is never compared. Other questions are correct when triage
+labels them right. --fake uses the deterministic benchmark LLM, which answers with the
+reference SQL, to check the harness without calling OpenAI.
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+from collections import Counter
+from contextlib import redirect_stdout
+from decimal import Decimal
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+import tracing
+from benchmark_pipeline import FakeLLM, install_complex_app, drain_speculation
+from crm_fixture import build_fixture_pool, FixturePool
+from id_keys import IdKeyRewriter
+from model_router import ModelRouter, Route, DEFAULT_ROUTES
+from triage_classifier import load_triage_classifier
+from result_fetch import fetch_frame
+
+GOLDEN_SET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden_set.json")
+CONFIGURATIONS = [
+    {"name": "gpt-4 staged", "model": "gpt-4", "planning_mode": "staged"},
+    {"name": "gpt-4o staged", "model": "gpt-4o", "planning_mode": "staged"},
+    {"name": "gpt-4o-mini staged", "model": "gpt-4o-mini", "planning_mode": "staged"},
+    {"name": "gpt-4o-mini fused", "model": "gpt-4o-mini", "planning_mode": "fused"},
+    {"name": "gpt-4o-mini staged x3", "model": "gpt-4o-mini", "planning_mode": "staged", "sql_candidates": 3},
+    # "routes": true uses model_router.DEFAULT_ROUTES; an object sets {model, temperature, max_tokens,
+    # min_confidence} per stage, and unlisted stages use the configuration's model
+    {"name": "gpt-4 routed", "model": "gpt-4", "planning_mode": "staged", "routes": True},
+    {"name": "gpt-4o routed", "model": "gpt-4o", "planning_mode": "staged", "routes": True},
+    # "local_triage": true answers triage with the trained triage_classifier.py model when it is confident
+    {"name": "gpt-4 routed + local triage", "model": "gpt-4", "planning_mode": "staged", "routes": True, "local_triage": True},
+]
+# Numbers are compared after rounding, so FLOAT vs DECIMAL arithmetic doesn't count as wrong
+FLOAT_DIGITS = 4
+
+
+def make_router(app, config: dict, golden: List[dict], fake: bool) -> ModelRouter:
+    """The configuration's model for every stage, except the stages its routes assign elsewhere"""
+    routes = config.get("routes") or {}
+    if routes is True:
+        routes = DEFAULT_ROUTES
+    else:
+        routes = {stage: Route(**{"model": config["model"], **route}) for stage, route in routes.items()}
+    factory = app.make_chat_model
+    if fake:
+        corpus = [{"question": item["question"], "query_type": item["query_type"],
+                   "sql": [item["sql"]] if item.get("sql") else []} for item in golden]
+        fake_llm = FakeLLM(corpus)
+        factory = lambda route: fake_llm
+    return ModelRouter(factory, routes=routes, strong=Route(config["model"], config.get("temperature", 0.0)), enabled=True)
+
+
+def routing_delta(before: dict, after: dict) -> dict:
+    """Per-stage LLM calls by model and escalations by reason between two tracing.route_totals() snapshots"""
+    delta = {}
+    for stage, values in after.items():
+        previous = before.get(stage, {"calls": {}, "escalations": {}})
+        calls = {model: count - previous["calls"].get(model, 0) for model, count in values["calls"].items()}
+        escalations = {reason: count - previous["escalations"].get(reason, 0)
+                       for reason, count in values["escalations"].items()}
+        calls = {model: count for model, count in calls.items() if count}
+        escalations = {reason: count for reason, count in escalations.items() if count}
+        if calls:
+            first_attempts = sum(calls.values()) - sum(escalations.values())
+            delta[stage] = {"calls": calls, "escalations": escalations,
+                            "escalation_rate": round(sum(escalations.values()) / first_attempts, 3) if first_attempts else 0.0}
+    return delta
+
+
+def stage_delta(before: dict, after: dict) -> dict:
+    """Span count and summed wall time per stage between two tracing.stage_totals() snapshots"""
+    delta = {}
+    for stage, values in after.items():
+        previous = before.get(stage, {})
+        count = values["count"] - previous.get("count", 0)
+        if count:
+            delta[stage] = {"count": count, "duration_sum": values["duration_sum"] - previous.get("duration_sum", 0.0)}
+    return delta
+
+
+def _normalize(value):
+    """Comparable form of a result value: rounded numbers, IDs without braces, case-folded text"""
+    if value is None:
+        return None
+    if isinstance(value, (bool, np.bool_)):
+        return float(value)
+    if isinstance(value, (int, float, Decimal, np.integer, np.floating)):
+        return None if pd.isna(value) else round(float(value), FLOAT_DIGITS)
+    if pd.api.types.is_scalar(value) and pd.isna(value):
+        return None
+    text = str(value).strip()
+    if text.startswith("{") and text.endswith("}"):
+        text = text[1:-1]
+    try:
+        return round(float(text), FLOAT_DIGITS)
+    except ValueError:
+        return text.lower()
+
+
+def results_match(predicted: pd.DataFrame, expected: pd.DataFrame) -> bool:
+    """Same rows as the reference, ignoring column names and order, row order and extra predicted columns"""
+    if len(predicted) != len(expected):
+        return False
+    predicted_columns = [tuple(_normalize(v) for v in predicted.iloc[:, i]) for i in range(predicted.shape[1])]
+    expected_columns = [tuple(_normalize(v) for v in expected.iloc[:, i]) for i in range(expected.shape[1])]
+
+    # Pair each reference column with an unused predicted column holding the same values
+    used = []
+    for values in expected_columns:
+        wanted = Counter(values)
+        match = next((i for i, candidate in enumerate(predicted_columns)
+                      if i not in used and Counter(candidate) == wanted), None)
+        if match is None:
+            return False
+        used.append(match)
+    predicted_rows = Counter(zip(*(predicted_columns[i] for i in used)))
+    return predicted_rows == Counter(zip(*expected_columns))
+
+
+def expected_results(pool: FixturePool, golden: List[dict]) -> dict:
+    """Rows of every reference query on the fixture, by question"""
+    expected = {}
+    for item in golden:
+        if not item.get("sql"):
+            continue
+        connection = pool.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(item["sql"])
+            expected[item["question"]] = fetch_frame(cursor)
+        finally:
+            connection.close()
+        if expected[item["question"]].empty:
+            print(f"Warning: reference SQL returns no rows on this fixture: {item['question']}")
+    return expected
+
+
+def evaluate_question(app, config: dict, item: dict, expected: Optional[pd.DataFrame], verbose: bool = False) -> dict:
+    """Run one golden question through the whole of process_query, answer and validation included"""
+    question = item["question"]
+    query_type, df, error = None, None, None
+    output = sys.stdout if verbose else io.StringIO()
+    stages_before = tracing.stage_totals()
+    with redirect_stdout(output), tracing.span("question", evaluation=config["name"]) as trace:
+        start = time.perf_counter()
+        try:
+            response, df, query_type = app._process_query(question, config.get("planning_mode", "staged"))
+            if query_type == "ERROR":
+                error = response
+        except Exception as e:
+            error = f"{type(e).__name__}: {str(e)}"
+        latency = time.perf_counter() - start
+        drain_speculation(app)
+    stages = stage_delta(stages_before, tracing.stage_totals())
+
+    if item["query_type"] != "DATA_QUESTION":
+        correct = query_type == item["query_type"]
+    else:
+        correct = df is not None and expected is not None and results_match(df, expected)
+    return {
+        "config": config["name"],
+        "question": question,
+        "expected_type": item["query_type"],
+        "query_type": query_type,
+        "correct": correct,
+        "retries": trace.retries,
+        "prompt_tokens": trace.tokens_in,
+        "completion_tokens": trace.tokens_out,
+        "cost_usd": round(trace.cost_usd, 6),
+        "latency_s": round(latency, 3),
+        "answer_calls": stages.get("answer_generation", {}).get("count", 0),
+        "answer_s": round(stages.get("answer_generation", {}).get("duration_sum", 0.0), 3),
+        "validation_calls": stages.get("validation", {}).get("count", 0),
+        "validation_s": round(stages.get("validation", {}).get("duration_sum", 0.0), 3),
+        "rows": None if df is None else len(df),
+        "sql": trace.attributes.get("sql"),
+        "error": error,
+    }
+
+
+def summarize(config: dict, rows: List[dict], routing: dict) -> dict:
+    latencies = sorted(row["latency_s"] for row in rows)
+    data_rows = [row for row in rows if row["expected_type"] == "DATA_QUESTION"]
+    return {
+        "config": config["name"],
+        "model": config.get("model"),
+        "planning_mode": config.get("planning_mode", "staged"),
+        "sql_candidates": config.get("sql_candidates", 1),
+        "questions": len(rows),
+        "accuracy": round(sum(row["correct"] for row in rows) / len(rows), 3),
+        "execution_accuracy": round(sum(row["correct"] for row in data_rows) / len(data_rows), 3) if data_rows else None,
+        "triage_accuracy": round(sum(row["query_type"] == row["expected_type"] for row in rows) / len(rows), 3),
+        "avg_retries": round(statistics.mean(row["retries"] for row in rows), 2),
+        "prompt_tokens": sum(row["prompt_tokens"] for row in rows),
+        "completion_tokens": sum(row["completion_tokens"] for row in rows),
+        "cost_usd": round(sum(row["cost_usd"] for row in rows), 4),
+        "latency_p50_s": round(statistics.median(latencies), 3),
+        "latency_p95_s": round(latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))], 3),
+        "answer_calls": sum(row["answer_calls"] for row in rows),
+        "answer_s": round(sum(row["answer_s"] for row in rows), 3),
+        "validation_calls": sum(row["validation_calls"] for row in rows),
+        "validation_s": round(sum(row["validation_s"] for row in rows), 3),
+        "errors": sum(row["error"] is not None for row in rows),
+        "routing": routing,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--configs", help="JSON list of {name, model, temperature, planning_mode, sql_candidates, routes, local_triage}")
+    parser.add_argument("--only", nargs="*", help="Evaluate only the configurations with these names")
+    parser.add_argument("--golden", default=GOLDEN_SET_PATH, help="JSON list of {question, query_type, sql}")
+    parser.add_argument("--scale", type=float, default=0.1, help="Fixture size relative to crm_fixture.TABLE_ROWS")
+    parser.add_argument("--seed", type=int, default=7, help="Fixture random seed")
+    parser.add_argument("--min-accuracy", type=float, default=0.9, help="Accuracy bar for the recommendation")
+    parser.add_argument("--fake", action="store_true", help="Use the deterministic benchmark LLM instead of OpenAI")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own output")
+    parser.add_argument("--trace-log", help="Also write the pipeline's trace spans to this file")
+    parser.add_argument("--output", help="Write per-question rows and per-configuration summaries as JSON")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    with open(args.golden) as f:
+        golden = json.load(f)
+    configs = CONFIGURATIONS
+    if args.configs:
+        with open(args.configs) as f:
+            configs = json.load(f)
+    if args.only:
+        configs = [config for config in configs if config["name"] in args.only]
+
+    # Token usage and retries are read from the question span
+    tracing.TRACING_ENABLED = True
+    tracing.TRACE_LOG_PATH = args.trace_log or os.devnull
+
+    import sql_complex_app as app
+    from sql_complex_app import CATALOG
+    rows, summaries = [], []
+    with tempfile.TemporaryDirectory(prefix="model-evaluation-") as workdir:
+        pool, available_keys = build_fixture_pool(os.path.join(workdir, "crm.sqlite"), CATALOG, args.scale, args.seed)
+        id_keys = IdKeyRewriter(CATALOG, available=available_keys)
+        expected = expected_results(pool, golden)
+        for config in configs:
+            router = make_router(app, config, golden, args.fake)
+            install_complex_app(None, pool, id_keys, keep_caches=False, router=router)
+            routes_before = tracing.route_totals()
+            app.SQL_CANDIDATES = config.get("sql_candidates", 1)
+            if config.get("local_triage"):
+                app.triage_classifier = load_triage_classifier()
+                if app.triage_classifier is None:
+                    print(f"{config['name']}: no trained triage classifier, triage goes to the LLM")
+            config_rows = []
+            for item in golden:
+                row = evaluate_question(app, config, item, expected.get(item["question"]), args.verbose)
+                config_rows.append(row)
+                print(f"{config['name']:<28} {'ok  ' if row['correct'] else 'FAIL'} {row['latency_s']:6.2f}s "
+                      f"{row['retries']} retries  {item['question'][:60]}")
+            rows += config_rows
+            summaries.append(summarize(config, config_rows, routing_delta(routes_before, tracing.route_totals())))
+
+    print(f"\n{'configuration':<28} {'accuracy':>8} {'exec acc':>8} {'retries':>7} {'escalated':>9} {'tokens':>8} "
+          f"{'cost $':>8} {'p50 s':>7} {'p95 s':>7} {'answer s':>8} {'valid s':>7}")
+    for summary in summaries:
+        execution = "-" if summary["execution_accuracy"] is None else f"{summary['execution_accuracy']:.0%}"
+        escalated = sum(sum(stage["escalations"].values()) for stage in summary["routing"].values())
+        print(f"{summary['config']:<28} {summary['accuracy']:>8.0%} {execution:>8} {summary['avg_retries']:>7} {escalated:>9} "
+              f"{summary['prompt_tokens'] + summary['completion_tokens']:>8} {summary['cost_usd']:>8.4f} "
+              f"{summary['latency_p50_s']:>7} {summary['latency_p95_s']:>7} {summary['answer_s']:>8} {summary['validation_s']:>7}")
+
+    qualifying = [summary for summary in summaries if summary["accuracy"] >= args.min_accuracy]
+    best = min(qualifying, key=lambda summary: (summary["latency_p50_s"], summary["cost_usd"])) if qualifying else None
+    if best:
+        print(f"\nFastest configuration with at least {args.min_accuracy:.0%} accuracy: {best['config']}")
+    else:
+        print(f"\nNo configuration reached {args.min_accuracy:.0%} accuracy")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "golden_set": os.path.basename(args.golden),
+                "scale": args.scale,
+                "seed": args.seed,
+                "min_accuracy": args.min_accuracy,
+                "recommended": best["config"] if best else None,
+                "configurations": summaries,
+                "questions": rows,
+            }, f, indent=2, default=str)
+            f.write("\n")
+        print(f"Wrote {args.output}")
+    return 0 if best else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
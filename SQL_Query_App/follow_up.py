@@ -0,0 +1,333 @@
+import os
+import re
+import json
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import pandas as pd
+
+from result_fetch import is_truncated
+
+# Follow-up questions that only sort, filter, cut or regroup a previous result run on the cached
+# DataFrame instead of planning and executing new SQL
+FOLLOW_UP_ENABLED = os.getenv("FOLLOW_UP_ENABLED", "true").lower() == "true"
+# Result frames kept per conversation, newest first
+FOLLOW_UP_HISTORY = int(os.getenv("FOLLOW_UP_HISTORY", "3"))
+# Ask the LLM for a transformation when the rules don't match but the question refers back
+FOLLOW_UP_LLM_PLANNER = os.getenv("FOLLOW_UP_LLM_PLANNER", "true").lower() == "true"
+
+OPERATORS = ("==", "!=", ">", ">=", "<", "<=", "contains", "in")
+AGGREGATIONS = ("sum", "mean", "count", "min", "max", "median", "nunique")
+# Filters run before grouping, grouping before ordering, ordering before cutting
+STEP_ORDER = {"filter": 0, "group": 1, "select": 2, "sort": 3, "head": 4, "tail": 4}
+
+
+@dataclass
+class CachedResult:
+    question: str
+    sql: Optional[str]
+    df: pd.DataFrame
+    # Transformations that produced df from the result of sql, for follow-ups of follow-ups
+    steps: List[dict] = field(default_factory=list)
+
+
+@dataclass
+class FollowUp:
+    source: CachedResult
+    steps: List[dict]
+    planner: str  # "rules" or "llm"
+
+
+class Conversation:
+    """The last few complete result frames of one user's conversation, with the SQL behind them"""
+
+    def __init__(self, history: int = FOLLOW_UP_HISTORY):
+        self._results = deque(maxlen=history)
+        self._lock = threading.Lock()
+
+    def remember(self, question: str, sql: Optional[str], df: Optional[pd.DataFrame], steps: Optional[List[dict]] = None):
+        # A truncated frame would give wrong counts, filters and top-N, so it is never reused
+        if df is None or df.empty or is_truncated(df):
+            return
+        with self._lock:
+            self._results.appendleft(CachedResult(question, sql, df, steps or []))
+
+    def results(self) -> List[CachedResult]:
+        with self._lock:
+            return list(self._results)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+
+def _normalize(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s.'<>=!-]", " ", text.lower().replace("_", " ")).split())
+
+
+def _column(df: pd.DataFrame, name: str) -> str:
+    """The frame's column called name, ignoring case, underscores and a plural s"""
+    if name in df.columns:
+        return name
+    wanted = _normalize(str(name)).strip("'")
+    for column in df.columns:
+        normalized = _normalize(str(column))
+        if wanted in (normalized, normalized + "s") or wanted.rstrip("s") == normalized:
+            return column
+    raise ValueError(f"Result has no column '{name}' (columns: {', '.join(map(str, df.columns))})")
+
+
+def _typed_value(series: pd.Series, value):
+    """value converted to the series' type, so comparisons are vectorized rather than per-row str()"""
+    if isinstance(value, list):
+        return [_typed_value(series, item) for item in value]
+    if pd.api.types.is_bool_dtype(series):
+        return str(value).lower() in ("1", "true", "yes")
+    if pd.api.types.is_numeric_dtype(series):
+        return float(value)
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return pd.Timestamp(value)
+    return str(value).strip().strip("'\"").lower()
+
+
+def _filter(df: pd.DataFrame, step: dict) -> pd.DataFrame:
+    column = _column(df, step["column"])
+    operator = step.get("operator", "==")
+    if operator not in OPERATORS:
+        raise ValueError(f"Unsupported filter operator '{operator}'")
+    series = df[column]
+    value = _typed_value(series, step["value"])
+    if isinstance(value, str) or (isinstance(value, list) and value and isinstance(value[0], str)):
+        series = series.astype("string").str.strip().str.lower()
+    if operator == "contains":
+        mask = series.astype("string").str.contains(str(value).lower(), case=False, regex=False)
+    elif operator == "in":
+        mask = series.isin(value if isinstance(value, list) else [value])
+    else:
+        mask = {"==": series.eq, "!=": series.ne, ">": series.gt, ">=": series.ge,
+                "<": series.lt, "<=": series.le}[operator](value)
+    return df[mask.fillna(False).astype(bool)]
+
+
+def _group(df: pd.DataFrame, step: dict) -> pd.DataFrame:
+    by = [_column(df, name) for name in _as_list(step["by"])]
+    aggregations = {_column(df, name): function for name, function in (step.get("aggregations") or {}).items()}
+    for function in aggregations.values():
+        if function not in AGGREGATIONS:
+            raise ValueError(f"Unsupported aggregation '{function}'")
+    grouped = df.groupby(by, dropna=False, sort=False)
+    if not aggregations:
+        return grouped.size().reset_index(name="count")
+    return grouped.agg(aggregations).reset_index()
+
+
+def _as_list(value) -> list:
+    return value if isinstance(value, list) else [value]
+
+
+def apply_steps(df: pd.DataFrame, steps: List[dict]) -> pd.DataFrame:
+    """Run filter/group/select/sort/head/tail steps on a frame; ValueError when one doesn't fit it"""
+    for step in steps:
+        op = step.get("op")
+        try:
+            if op == "filter":
+                df = _filter(df, step)
+            elif op == "group":
+                df = _group(df, step)
+            elif op == "select":
+                df = df[[_column(df, name) for name in _as_list(step["columns"])]]
+            elif op == "sort":
+                by = [_column(df, name) for name in _as_list(step["by"])]
+                df = df.sort_values(by, ascending=bool(step.get("ascending", True)), kind="stable")
+            elif op in ("head", "tail"):
+                n = int(step["n"])
+                if n < 1:
+                    raise ValueError(f"{op} needs a positive row count")
+                df = df.head(n) if op == "head" else df.tail(n)
+            else:
+                raise ValueError(f"Unsupported follow-up step '{op}'")
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"Invalid follow-up step {json.dumps(step, default=str)}: {str(e)}")
+    return df.reset_index(drop=True)
+
+
+def describe_steps(steps: List[dict]) -> str:
+    parts = []
+    for step in steps:
+        op = step["op"]
+        if op == "filter":
+            parts.append(f"filter {step['column']} {step.get('operator', '==')} {step['value']!r}")
+        elif op == "group":
+            aggregations = ", ".join(f"{function}({column})" for column, function in (step.get("aggregations") or {}).items())
+            parts.append(f"group by {', '.join(map(str, _as_list(step['by'])))}: {aggregations or 'count'}")
+        elif op == "sort":
+            parts.append(f"sort by {', '.join(map(str, _as_list(step['by'])))} {'asc' if step.get('ascending', True) else 'desc'}")
+        elif op == "select":
+            parts.append(f"columns {', '.join(map(str, _as_list(step['columns'])))}")
+        else:
+            parts.append(f"{op} {step['n']}")
+    return " -> ".join(parts)
+
+
+# Rules for the common drill-downs. Every clause of the question has to match one of them,
+# otherwise the question is left to the planner or to a new SQL query.
+FILLER_WORDS = {"show", "me", "only", "just", "now", "then", "please", "can", "you", "give", "list", "the",
+                "those", "these", "them", "it", "results", "result", "rows", "ones", "instead", "also", "and", "but"}
+SORT_CLAUSE = re.compile(r"(?:sort|order|rank)(?:ed)?(?: them| it| this)? by (?P<column>.+?)"
+                         r"(?: (?P<direction>asc|ascending|desc|descending|high to low|low to high|"
+                         r"highest first|lowest first|largest first|smallest first))?")
+CUT_CLAUSE = re.compile(r"(?P<which>top|first|bottom|last) (?P<n>\d+)(?: (?P<noun>\w+))??(?: by (?P<column>.+))?")
+FILTER_CLAUSE = re.compile(r"(?:where|with|for|filter(?:ed)? (?:to|on|by)?) ?(?P<column>.+?) (?P<operator>is not|isn't|is|==|=|!=|>=|<=|>|<|equals|"
+                           r"over|above|greater than|more than|under|below|less than|at least|at most|contains|containing) "
+                           r"(?P<value>.+)")
+GROUP_CLAUSE = re.compile(r"(?:(?P<function>count|total|sum|average|avg|mean|max|maximum|min|minimum)s?"
+                          r"(?: of)?(?: (?P<measure>.+?))? |group(?:ed)? |break(?: it)? down |broken down )(?:by|per) (?P<column>.+)")
+OPERATOR_WORDS = {"is": "==", "=": "==", "==": "==", ">": ">", ">=": ">=", "<": "<", "<=": "<=", "equals": "==", "is not": "!=", "isn't": "!=", "!=": "!=",
+                  "over": ">", "above": ">", "greater than": ">", "more than": ">", "under": "<", "below": "<",
+                  "less than": "<", "at least": ">=", "at most": "<=", "contains": "contains", "containing": "contains"}
+FUNCTION_WORDS = {"count": "count", "total": "sum", "sum": "sum", "average": "mean", "avg": "mean", "mean": "mean",
+                  "max": "max", "maximum": "max", "min": "min", "minimum": "min"}
+# Back-references to a result the user already has; only then is the planner worth a call.
+# Words such as "top", "order" or "their" also start fresh questions, which must not wait on it
+REFERRING_WORDS = re.compile(r"\b(those|these|them|ones|the same|instead|previous|previously|"
+                             r"what about|how about|(?:that|this|the last) (?:result|list|table|one))\b")
+
+
+def _strip_fillers(clause: str) -> str:
+    words = clause.split()
+    while words and words[0] in FILLER_WORDS:
+        words.pop(0)
+    while words and words[-1] in FILLER_WORDS:
+        words.pop()
+    return " ".join(words)
+
+
+def _rule_steps(clause: str, result: CachedResult) -> Optional[List[dict]]:
+    df = result.df
+    match = SORT_CLAUSE.fullmatch(clause)
+    if match:
+        direction = match.group("direction") or "asc"
+        ascending = direction in ("asc", "ascending", "low to high", "lowest first", "smallest first")
+        return [{"op": "sort", "by": [_column(df, match.group("column"))], "ascending": ascending}]
+    match = CUT_CLAUSE.fullmatch(clause)
+    if match:
+        n = int(match.group("n"))
+        which = match.group("which")
+        # "top 5 accounts" only cuts this result if it is about accounts
+        noun = match.group("noun")
+        if noun and noun not in FILLER_WORDS and noun.rstrip("s") not in _normalize(result.question):
+            return None
+        if match.group("column"):
+            column = _column(df, match.group("column"))
+            return [{"op": "sort", "by": [column], "ascending": which in ("bottom", "last")}, {"op": "head", "n": n}]
+        return [{"op": "tail" if which == "last" else "head", "n": n}]
+    match = GROUP_CLAUSE.fullmatch(clause)
+    if match:
+        by = _column(df, match.group("column"))
+        function = FUNCTION_WORDS.get(match.group("function") or "count")
+        if function == "count" and not match.group("measure"):
+            return [{"op": "group", "by": [by]}]
+        if match.group("measure"):
+            measures = [_column(df, match.group("measure"))]
+        else:
+            measures = [column for column in df.select_dtypes("number").columns if column != by]
+        if not measures:
+            return None
+        return [{"op": "group", "by": [by], "aggregations": {column: function for column in measures}}]
+    match = FILTER_CLAUSE.fullmatch(clause)
+    if match:
+        column = _column(df, match.group("column"))
+        value = match.group("value").strip("'\"")
+        _typed_value(df[column], value)  # "over 6k" on a number column is not a filter we can run
+        return [{"op": "filter", "column": column, "operator": OPERATOR_WORDS[match.group("operator")], "value": value}]
+    return None
+
+
+def match_follow_up(question: str, conversation: Conversation) -> Optional[FollowUp]:
+    """Steps for the latest result when every clause of the question matches a drill-down rule"""
+    results = conversation.results()
+    if not results:
+        return None
+    latest = results[0]
+    steps = []
+    for clause in re.split(r"[,;]| and then | then | and ", question.lower().strip().rstrip(".?!")):
+        clause = _strip_fillers(_normalize(clause))
+        if not clause:
+            continue
+        try:
+            clause_steps = _rule_steps(clause, latest)
+        except ValueError:
+            return None  # names something the result doesn't have: new data is needed
+        if clause_steps is None:
+            return None
+        steps += clause_steps
+    if not steps:
+        return None
+    steps.sort(key=lambda step: STEP_ORDER[step["op"]])
+    return FollowUp(latest, steps, "rules")
+
+
+def needs_planner(question: str, conversation: Conversation) -> bool:
+    return FOLLOW_UP_LLM_PLANNER and bool(conversation.results()) and bool(REFERRING_WORDS.search(question.lower()))
+
+
+FOLLOW_UP_PROMPT = """You decide whether a follow-up question can be answered by transforming a result the user
+already has, instead of querying the database again.
+
+Earlier results, newest first:
+{results}
+
+Follow-up question: {question}
+
+Choose "transform" only when the answer needs nothing but the rows and columns of one of these results
+(filtering, sorting, top-N, grouping with sum/mean/count/min/max/median/nunique, picking columns).
+Choose "new_query" when it needs other rows, other columns, other tables or other dates.
+
+Return ONLY a valid JSON object in one of these formats:
+{{"action": "new_query"}}
+{{"action": "transform", "result": <index of the result>, "steps": [<steps, applied in order>]}}
+
+Steps:
+{{"op": "filter", "column": "name", "operator": "==" | "!=" | ">" | ">=" | "<" | "<=" | "contains" | "in", "value": ...}}
+{{"op": "group", "by": ["name"], "aggregations": {{"name": "sum" | "mean" | "count" | "min" | "max" | "median" | "nunique"}}}}
+{{"op": "select", "columns": ["name"]}}
+{{"op": "sort", "by": ["name"], "ascending": true | false}}
+{{"op": "head", "n": 10}}
+{{"op": "tail", "n": 10}}"""
+
+
+def build_follow_up_prompt(question: str, conversation: Conversation) -> str:
+    descriptions = []
+    for i, result in enumerate(conversation.results()):
+        columns = ", ".join(f"{column} ({dtype})" for column, dtype in result.df.dtypes.astype(str).items())
+        descriptions.append(
+            f"[{i}] Earlier question: {result.question}\n"
+            f"    SQL: {result.sql}\n"
+            f"    Rows: {len(result.df)}; columns: {columns}\n"
+            f"    First rows: {result.df.head(3).to_json(orient='records', date_format='iso', default_handler=str)}"
+        )
+    return FOLLOW_UP_PROMPT.format(results="\n".join(descriptions), question=question)
+
+
+def parse_follow_up_plan(content: str, conversation: Conversation) -> Optional[FollowUp]:
+    """FollowUp from the planner's answer, None for "new_query"; ValueError when it is malformed"""
+    plan = json.loads(re.sub(r'```json\s*|\s*```', '', content).strip())
+    if plan.get("action") == "new_query":
+        return None
+    results = conversation.results()
+    index = plan.get("result", 0)
+    if plan.get("action") != "transform" or not isinstance(index, int) or not 0 <= index < len(results):
+        raise ValueError(f"Invalid follow-up plan: {content[:200]}")
+    steps = plan.get("steps")
+    if not isinstance(steps, list) or not steps or any(not isinstance(step, dict) for step in steps):
+        raise ValueError("Follow-up plan has no steps")
+    return FollowUp(results[index], steps, "llm")
+
+
+def run_follow_up(follow_up: FollowUp, question: str, conversation: Conversation) -> pd.DataFrame:
+    """Apply the steps to the cached frame and remember the result for the next follow-up"""
+    df = apply_steps(follow_up.source.df, follow_up.steps)
+    conversation.remember(question, follow_up.source.sql, df, follow_up.source.steps + follow_up.steps)
+    return df
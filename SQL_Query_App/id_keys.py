@@ -0,0 +1,147 @@
+import os
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from schema_catalog import SchemaCatalog
+from sql_repair import query_sources
+
+# "auto": rewrite onto the key columns found in the database; "off": never rewrite
+SARGABLE_ID_KEYS = os.getenv("SARGABLE_ID_KEYS", "auto").lower()
+ID_KEY_SUFFIX = os.getenv("ID_KEY_SUFFIX", "_key")
+# Wide enough for a braced GUID; computed columns must have a bounded type to be indexed
+ID_KEY_TYPE = "NVARCHAR(64)"
+
+# REPLACE(REPLACE(alias.column, '{', ''), '}', ''), braces stripped in either order
+BRACE_STRIP_PATTERN = re.compile(
+    r"REPLACE\s*\(\s*REPLACE\s*\(\s*(?:\[?(\w+)\]?\s*\.\s*)?\[?(\w+)\]?\s*,\s*N?'([{}])'\s*,\s*N?''\s*\)"
+    r"\s*,\s*N?'([{}])'\s*,\s*N?''\s*\)",
+    re.IGNORECASE
+)
+
+
+def key_column_name(column: str) -> str:
+    return f"{column}{ID_KEY_SUFFIX}"
+
+
+def id_key_columns(catalog: SchemaCatalog) -> Dict[str, List[str]]:
+    """table full name -> string primary/foreign key columns that are joined brace-stripped"""
+    columns = {}
+    for table in catalog.table_list:
+        names = [table.primary_key] if table.primary_key else []
+        names += [fk.column for fk in table.foreign_keys]
+        for name in names:
+            column = table.column(name)
+            if column and column.data_type == "String" and column.name not in columns.get(table.full_name, []):
+                columns.setdefault(table.full_name, []).append(column.name)
+    return columns
+
+
+def key_columns_ddl(catalog: SchemaCatalog) -> List[str]:
+    """SQL Server statements adding an indexed, persisted normalized key next to each ID column"""
+    statements = []
+    for table, columns in id_key_columns(catalog).items():
+        short_name = table.split(".")[-1]
+        for column in columns:
+            key = key_column_name(column)
+            statements.append(
+                f"ALTER TABLE {table} ADD {key} AS "
+                f"CAST(REPLACE(REPLACE({column}, '{{', ''), '}}', '') AS {ID_KEY_TYPE}) PERSISTED"
+            )
+            statements.append(f"CREATE INDEX IX_{short_name}_{key} ON {table} ({key})")
+    return statements
+
+
+class IdKeyRewriter:
+    """Moves brace-stripped ID comparisons onto indexed key columns, keeping them sargable.
+
+    REPLACE(REPLACE(l.leadid, '{', ''), '}', '') hides l.leadid from every index, so each
+    join on it scans both sides. The key column holds the same normalized value, so
+    l.leadid_key gives identical results and can be seeked.
+    """
+
+    def __init__(self, catalog: SchemaCatalog, connect: Optional[Callable] = None,
+                 available: Optional[Set[Tuple[str, str]]] = None):
+        self.catalog = catalog
+        self.connect = connect  # pooled DBAPI connection, used once to find the deployed keys
+        self.available = available  # (table full name, column), lowercase; None until loaded
+        self.rewrites = 0
+        self._lock = threading.Lock()
+
+    def load_available(self) -> Set[Tuple[str, str]]:
+        """Key columns that actually exist in the database"""
+        wanted = {}
+        for table, columns in id_key_columns(self.catalog).items():
+            for column in columns:
+                wanted[(table.split(".")[-1].lower(), key_column_name(column).lower())] = (table.lower(), column.lower())
+        connection = self.connect()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(
+                "SELECT TABLE_NAME, COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS "
+                f"WHERE COLUMN_NAME LIKE '%{ID_KEY_SUFFIX.replace('_', '[_]')}'"
+            )
+            found = {wanted[(t.lower(), c.lower())] for t, c in cursor.fetchall() if (t.lower(), c.lower()) in wanted}
+            cursor.close()
+        finally:
+            connection.close()
+        print(f"Normalized ID key columns available: {len(found)}")
+        return found
+
+    def _available(self) -> Set[Tuple[str, str]]:
+        with self._lock:
+            if self.available is None:
+                if self.connect is None:
+                    return set()
+                try:
+                    self.available = self.load_available()
+                except Exception as e:
+                    # Retried on the next query; until then queries run unchanged
+                    print(f"Could not look up ID key columns: {str(e)}")
+                    return set()
+            return self.available
+
+    def reset(self):
+        """Look the key columns up again, e.g. after one turned out to be missing"""
+        with self._lock:
+            self.available = None
+
+    def rewrite(self, sql: str) -> str:
+        available = self._available()
+        if not available or "replace" not in sql.lower():
+            return sql
+        sources = query_sources(sql, self.catalog)
+        count = 0
+
+        def replace(match):
+            nonlocal count
+            alias, column, first, second = match.groups()
+            if {first, second} != {"{", "}"}:
+                return match.group()
+            if alias:
+                table = sources.get(alias.lower())
+            else:
+                # Unqualified column: only when exactly one source table has it
+                tables = {t for t in sources.values() if self.catalog.column(t, column)}
+                table = tables.pop() if len(tables) == 1 else None
+            if not table or (table.lower(), column.lower()) not in available:
+                return match.group()
+            count += 1
+            return f"{alias}.{key_column_name(column)}" if alias else key_column_name(column)
+
+        rewritten = BRACE_STRIP_PATTERN.sub(replace, sql)
+        if count:
+            with self._lock:
+                self.rewrites += count
+        return rewritten
+
+    @staticmethod
+    def is_missing_key_error(error: Exception) -> bool:
+        return bool(re.search(rf"invalid column name '\w+{re.escape(ID_KEY_SUFFIX)}'", str(error), re.IGNORECASE))
+
+
+if __name__ == "__main__":
+    # Print the DDL for the key columns: python id_keys.py
+    from sql_complex_app import CATALOG
+    for statement in key_columns_ddl(CATALOG):
+        print(statement + ";")
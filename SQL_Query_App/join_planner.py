@@ -0,0 +1,164 @@
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from schema_catalog import SchemaCatalog, ForeignKey
+
+# Conventional aliases used in the generation prompts
+TABLE_ALIASES = {
+    "opportunity": "o",
+    "lead": "l",
+    "account": "a",
+    "contact": "c",
+    "email": "e",
+    "owner": "ow",
+    "dropout_reason": "dr",
+    "source": "s",
+    "annotation": "an",
+    "appointment": "ap",
+    "phonecall": "pc",
+    "task": "t",
+}
+
+NUMERIC_TYPES = {"Integer", "Decimal"}
+
+
+def brace_stripped(expression: str) -> str:
+    """CRM GUIDs are stored with and without curly braces; compare them normalized"""
+    return f"REPLACE(REPLACE({expression}, '{{', ''), '}}', '')"
+
+
+@dataclass
+class JoinStep:
+    table: str
+    alias: str
+    condition: str
+    via: ForeignKey
+
+
+@dataclass
+class JoinPlan:
+    root: str
+    aliases: Dict[str, str] = field(default_factory=dict)
+    steps: List[JoinStep] = field(default_factory=list)
+    unreachable: List[str] = field(default_factory=list)
+
+    def render(self) -> str:
+        """FROM/JOIN clauses ready to paste into a query"""
+        lines = [f"FROM {self.root} {self.aliases[self.root]}"]
+        for step in self.steps:
+            lines.append(f"LEFT JOIN {step.table} {step.alias}")
+            lines.append(f"    ON {step.condition}")
+        return "\n".join(lines)
+
+
+def _edge_rank(fk: ForeignKey) -> tuple:
+    # Declared keys beat lookup conventions; parent* columns are the canonical links
+    return (fk.implicit, not fk.column.lower().startswith("parent"), fk.table, fk.column)
+
+
+def _implicit_only(catalog: SchemaCatalog, table: str, neighbour: str) -> bool:
+    return all(fk.implicit for fk in catalog.graph[table][neighbour])
+
+
+def _shortest_path(catalog: SchemaCatalog, sources: List[str], target: str,
+                   leaves: frozenset = frozenset()) -> Optional[List[str]]:
+    """BFS over the foreign-key graph from any table already in the tree to the target.
+
+    Sources are expanded in tree order, so among equally short paths the one starting
+    closest to the root wins: a lookup such as owner hangs off o.ownerid, not l.ownerid.
+    Lookup conventions (e.g. ownerid -> owner) are leaves, never a route between entities:
+    an implicit edge only attaches the target itself, and tables in `leaves` (attached
+    through one) are never expanded.
+    """
+    queue = deque(source for source in sources if source not in leaves)
+    previous = {source: None for source in sources}
+    while queue:
+        table = queue.popleft()
+        if table == target:
+            path = []
+            while table is not None:
+                path.append(table)
+                table = previous[table]
+            return path[::-1]
+        for neighbour in sorted(catalog.graph[table]):
+            if neighbour != target and _implicit_only(catalog, table, neighbour):
+                continue
+            if neighbour not in previous:
+                previous[neighbour] = table
+                queue.append(neighbour)
+    return None
+
+
+def _join_condition(catalog: SchemaCatalog, fk: ForeignKey, aliases: Dict[str, str]) -> str:
+    left = f"{aliases[fk.table]}.{fk.column}"
+    right = f"{aliases[fk.ref_table]}.{fk.ref_column}"
+    left_type = catalog.column(fk.table, fk.column).data_type
+    right_type = catalog.column(fk.ref_table, fk.ref_column).data_type
+    if left_type in NUMERIC_TYPES and right_type in NUMERIC_TYPES:
+        condition = f"{left} = {right}"
+    else:
+        condition = f"{brace_stripped(left)} = {brace_stripped(right)}"
+
+    # The source lookup table holds several option sets; pick the one for this column
+    ref_table = catalog.table(fk.ref_table)
+    if ref_table.column("LogicalName"):
+        condition += f" AND {aliases[fk.ref_table]}.LogicalName = '{fk.column}'"
+    return condition
+
+
+def _assign_alias(table: str, aliases: Dict[str, str]):
+    short_name = table.split(".")[-1].lower()
+    alias = TABLE_ALIASES.get(short_name, short_name[:2])
+    candidate, n = alias, 2
+    while candidate in aliases.values():
+        candidate = f"{alias}{n}"
+        n += 1
+    aliases[table] = candidate
+
+
+def plan_joins(catalog: SchemaCatalog, table_names: List[str]) -> Optional[JoinPlan]:
+    """Shortest join tree connecting the given tables, rooted at the first known one"""
+    terminals = []
+    for name in table_names:
+        table = catalog.table(name)
+        if table and table.full_name not in terminals:
+            terminals.append(table.full_name)
+    if len(terminals) < 2:
+        return None
+
+    plan = JoinPlan(root=terminals[0])
+    _assign_alias(plan.root, plan.aliases)
+    in_tree = [plan.root]  # in attachment order, root first
+    leaves = set()
+
+    # Greedy Steiner tree: repeatedly attach the closest remaining table
+    remaining = terminals[1:]
+    while remaining:
+        best = None
+        for target in remaining:
+            path = _shortest_path(catalog, in_tree, target, frozenset(leaves))
+            if path and (best is None or len(path) < len(best)):
+                best = path
+        if best is None:
+            plan.unreachable.extend(remaining)
+            break
+
+        for parent, child in zip(best, best[1:]):
+            if child in in_tree:
+                continue
+            fk = sorted(catalog.graph[parent][child], key=_edge_rank)[0]
+            _assign_alias(child, plan.aliases)
+            plan.steps.append(JoinStep(child, plan.aliases[child], _join_condition(catalog, fk, plan.aliases), fk))
+            in_tree.append(child)
+            if _implicit_only(catalog, parent, child):
+                leaves.add(child)
+        remaining = [table for table in remaining if table not in in_tree]
+
+    return plan
+
+
+def plan_joins_for_analysis(catalog: SchemaCatalog, schema_analysis: dict) -> Optional[JoinPlan]:
+    """Join plan for the relevantTables of an analyze_schema result"""
+    tables = [t.get("tableName", "") for t in schema_analysis.get("relevantTables") or [] if isinstance(t, dict)]
+    return plan_joins(catalog, tables)
@@ -0,0 +1,360 @@
+"""Local DuckDB replica of the catalog tables for analytical queries.
+
+Usage:
+    python local_replica.py sync [--full]
+    python local_replica.py status
+
+Entity tables sync incrementally from their modifiedon watermark (the same columns the
+result cache versions on); lookup tables and tables without a watermark are reloaded.
+Aggregations and analytical queries are routed here when every table they read was
+synced within the freshness bound and the query translates to DuckDB SQL.
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional
+
+import pandas as pd
+
+from query_cache import CACHE_DIR
+from result_cache import VERSION_COLUMNS, referenced_tables
+from result_fetch import fetch_frame
+from query_control import classify_query
+from schema_catalog import SchemaCatalog, Table
+
+try:
+    import duckdb
+    DUCKDB_AVAILABLE = True
+except ImportError:
+    DUCKDB_AVAILABLE = False
+
+try:
+    import sqlglot
+    from sqlglot import exp
+    SQLGLOT_AVAILABLE = True
+except ImportError:
+    SQLGLOT_AVAILABLE = False
+
+# Replica settings; routing needs duckdb, translation uses sqlglot when installed
+LOCAL_REPLICA_ENABLED = os.getenv("LOCAL_REPLICA_ENABLED", "false").lower() == "true"
+REPLICA_PATH = os.getenv("REPLICA_PATH", os.path.join(CACHE_DIR, "replica.duckdb"))
+# Oldest data a routed query may see: seconds since the last sync of every table it reads
+REPLICA_MAX_STALENESS_SECONDS = float(os.getenv("REPLICA_MAX_STALENESS_SECONDS", "900"))
+REPLICA_SYNC_INTERVAL_SECONDS = float(os.getenv("REPLICA_SYNC_INTERVAL_SECONDS", "300"))
+# Watermarks only see changed rows; a periodic reload drops rows deleted at the source
+REPLICA_FULL_REFRESH_HOURS = float(os.getenv("REPLICA_FULL_REFRESH_HOURS", "24"))
+REPLICA_QUERY_CLASSES = set(os.getenv("REPLICA_QUERY_CLASSES", "aggregate,analytical").split(","))
+SYNC_BATCH_ROWS = int(os.getenv("REPLICA_SYNC_BATCH_ROWS", "10000"))
+
+DUCKDB_TYPES = {"String": "VARCHAR", "Integer": "BIGINT", "Decimal": "DOUBLE", "Date": "TIMESTAMP", "Boolean": "BOOLEAN"}
+STATE_TABLE = "_replica_state"
+
+# T-SQL the fallback shim can't translate; such queries stay on SQL Server
+UNSUPPORTED_TSQL_PATTERN = re.compile(
+    r'\b(dateadd|datediff|datepart|datename|convert|format|eomonth|iif|charindex|patindex|stuff|'
+    r'cross\s+apply|outer\s+apply|pivot|unpivot|percent|with\s+ties)\b|@@|#\w',
+    re.IGNORECASE
+)
+TOP_PATTERN = re.compile(r'^\s*select\s+(distinct\s+)?top\s*(?:\(\s*(\d+)\s*\)|(\d+))\s', re.IGNORECASE)
+STRING_LITERAL_PATTERN = re.compile(r"(N?'(?:[^']|'')*')")
+FUNCTION_REWRITES = [
+    # SQL Server converts REPLACE's argument to a string implicitly (e.g. integer owner IDs); DuckDB doesn't
+    (re.compile(r'\bREPLACE\s*\(\s*REPLACE\s*\(\s*((?:\[?\w+\]?\.)?\[?\w+\]?)\s*,', re.IGNORECASE),
+     r"REPLACE(REPLACE(CAST(\1 AS VARCHAR),"),
+    (re.compile(r'\bgetdate\s*\(\s*\)', re.IGNORECASE), "current_timestamp"),
+    (re.compile(r'\bgetutcdate\s*\(\s*\)', re.IGNORECASE), "current_timestamp"),
+    (re.compile(r'\bisnull\s*\(', re.IGNORECASE), "coalesce("),
+    (re.compile(r'\blen\s*\(', re.IGNORECASE), "length("),
+    (re.compile(r'\[(\w+)\]'), r'"\1"'),
+]
+
+
+class UntranslatableQuery(ValueError):
+    """The query uses T-SQL the replica's dialect shim can't express in DuckDB"""
+
+
+def _fallback_translate(query: str) -> str:
+    """Rule-based T-SQL -> DuckDB for plain SELECTs, used when sqlglot is not installed"""
+    sql = query.strip().rstrip(";")
+    parts = STRING_LITERAL_PATTERN.split(sql)
+    for i in range(0, len(parts), 2):
+        if UNSUPPORTED_TSQL_PATTERN.search(parts[i]):
+            raise UntranslatableQuery(f"Unsupported T-SQL: {UNSUPPORTED_TSQL_PATTERN.search(parts[i]).group()}")
+        for pattern, replacement in FUNCTION_REWRITES:
+            parts[i] = pattern.sub(replacement, parts[i])
+    for i in range(1, len(parts), 2):
+        parts[i] = parts[i][1:] if parts[i].startswith("N") else parts[i]
+    sql = "".join(parts)
+
+    top = TOP_PATTERN.match(sql)
+    code = STRING_LITERAL_PATTERN.sub("''", sql)
+    if len(re.findall(r'\btop\b', code, re.IGNORECASE)) > (1 if top else 0):
+        raise UntranslatableQuery("TOP inside a subquery")
+    if top:
+        sql = f"SELECT {top.group(1) or ''}{sql[top.end():]}\nLIMIT {top.group(2) or top.group(3)}"
+    return sql
+
+
+def _cast_replace_argument(node):
+    if isinstance(node, exp.Replace) and not isinstance(node.this, (exp.Replace, exp.Literal)):
+        node.set("this", exp.cast(node.this, "VARCHAR"))
+    return node
+
+
+def to_duckdb(query: str) -> str:
+    """Translate a generated T-SQL query to DuckDB SQL"""
+    if SQLGLOT_AVAILABLE:
+        try:
+            tree = sqlglot.parse_one(query, read="tsql")
+        except sqlglot.errors.SqlglotError as e:
+            raise UntranslatableQuery(str(e)) from e
+        return tree.transform(_cast_replace_argument).sql(dialect="duckdb")
+    return _fallback_translate(query)
+
+
+class LocalReplica:
+    """DuckDB copy of the catalog tables, kept current from modifiedon watermarks"""
+
+    def __init__(self, catalog: SchemaCatalog, connect: Callable, path: str = REPLICA_PATH,
+                 max_staleness: float = REPLICA_MAX_STALENESS_SECONDS):
+        self.catalog = catalog
+        self.connect = connect  # pooled DBAPI connection to the source database
+        self.max_staleness = max_staleness
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        # Attached under the source database name so three-part names resolve unchanged
+        self.database = catalog.table_list[0].full_name.split(".")[0]
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = duckdb.connect()
+        self._db.execute(f"ATTACH '{path}' AS {self.database}")
+        for schema in {table.full_name.split(".")[1] for table in catalog.table_list}:
+            self._db.execute(f"CREATE SCHEMA IF NOT EXISTS {self.database}.{schema}")
+        self._db.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.database}.main.{STATE_TABLE} ("
+            "table_name VARCHAR PRIMARY KEY, columns VARCHAR, watermark TIMESTAMP, "
+            "synced_at DOUBLE, full_sync_at DOUBLE, row_count BIGINT)"
+        )
+
+    def _cursor(self):
+        # DuckDB cursors are separate connections to the same database; one per thread/call
+        cursor = self._db.cursor()
+        cursor.execute(f"USE {self.database}.{self.catalog.table_list[0].full_name.split('.')[1]}")
+        return cursor
+
+    def _record(self, name: str):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    @staticmethod
+    def watermark_column(table: Table) -> Optional[str]:
+        return VERSION_COLUMNS.get(table.name.lower()) if table.primary_key else None
+
+    def _columns(self, table: Table) -> List[tuple]:
+        """(name, DuckDB type) for the catalog columns plus the watermark column"""
+        columns = [(c.name, DUCKDB_TYPES.get(c.data_type, "VARCHAR")) for c in table.columns.values()]
+        watermark = self.watermark_column(table)
+        if watermark and not table.column(watermark):
+            columns.append((watermark, "TIMESTAMP"))
+        return columns
+
+    def _state(self, cursor, table: Table) -> Optional[dict]:
+        row = cursor.execute(
+            f"SELECT columns, watermark, synced_at, full_sync_at, row_count FROM {self.database}.main.{STATE_TABLE} "
+            "WHERE table_name = ?", [table.full_name]
+        ).fetchone()
+        if not row:
+            return None
+        return dict(zip(("columns", "watermark", "synced_at", "full_sync_at", "row_count"), row))
+
+    def sync_table(self, table: Table, full: bool = False) -> int:
+        """Copy new and changed rows of one table; returns the number of rows fetched"""
+        columns = self._columns(table)
+        signature = json.dumps(columns)
+        watermark_column = self.watermark_column(table)
+        cursor = self._cursor()
+        try:
+            state = self._state(cursor, table)
+            if state is None or state["columns"] != signature:
+                # New table, or the schema text changed: rebuild it
+                column_sql = ", ".join(f'"{name}" {type_}' for name, type_ in columns)
+                key_sql = f', PRIMARY KEY ("{table.primary_key}")' if table.primary_key else ""
+                cursor.execute(f"DROP TABLE IF EXISTS {table.full_name}")
+                cursor.execute(f"CREATE TABLE {table.full_name} ({column_sql}{key_sql})")
+                state = None
+            refresh_due = state and time.time() - (state["full_sync_at"] or 0) > REPLICA_FULL_REFRESH_HOURS * 3600
+            incremental = bool(watermark_column and state and state["watermark"] and not full and not refresh_due)
+
+            select = f"SELECT {', '.join(name for name, _ in columns)} FROM {table.full_name}"
+            params = []
+            if incremental:
+                # >= so rows sharing the last timestamp are not missed; the upsert absorbs repeats
+                select += f" WHERE {watermark_column} >= ?"
+                params.append(state["watermark"])
+
+            source = self.connect()
+            fetched = 0
+            try:
+                source_cursor = source.cursor()
+                source_cursor.execute(select, params) if params else source_cursor.execute(select)
+                cursor.execute("BEGIN TRANSACTION")
+                if not incremental:
+                    cursor.execute(f"DELETE FROM {table.full_name}")
+                while True:
+                    rows = source_cursor.fetchmany(SYNC_BATCH_ROWS)
+                    if not rows:
+                        break
+                    batch = pd.DataFrame.from_records([tuple(row) for row in rows], columns=[n for n, _ in columns])
+                    cursor.register("replica_batch", batch)
+                    verb = "INSERT OR REPLACE" if table.primary_key else "INSERT"
+                    cursor.execute(f"{verb} INTO {table.full_name} SELECT * FROM replica_batch")
+                    cursor.unregister("replica_batch")
+                    fetched += len(rows)
+                source_cursor.close()
+
+                watermark = None
+                if watermark_column:
+                    watermark = cursor.execute(f'SELECT MAX("{watermark_column}") FROM {table.full_name}').fetchone()[0]
+                row_count = cursor.execute(f"SELECT COUNT(*) FROM {table.full_name}").fetchone()[0]
+                now = time.time()
+                full_sync_at = state["full_sync_at"] if incremental else now
+                cursor.execute(
+                    f"INSERT OR REPLACE INTO {self.database}.main.{STATE_TABLE} VALUES (?, ?, ?, ?, ?, ?)",
+                    [table.full_name, signature, watermark, now, full_sync_at, row_count]
+                )
+                cursor.execute("COMMIT")
+            except Exception:
+                try:
+                    cursor.execute("ROLLBACK")
+                except Exception:
+                    pass
+                raise
+            finally:
+                source.close()
+            return fetched
+        finally:
+            cursor.close()
+
+    def sync(self, full: bool = False) -> Dict[str, int]:
+        """Sync every catalog table; one failing table doesn't stop the others"""
+        fetched = {}
+        with self._sync_lock:
+            for table in self.catalog.table_list:
+                start = time.perf_counter()
+                try:
+                    fetched[table.name] = self.sync_table(table, full)
+                    print(f"Replica sync {table.name}: {fetched[table.name]} rows in {time.perf_counter() - start:.1f}s")
+                except Exception as e:
+                    self._record("sync_errors")
+                    print(f"Replica sync of {table.name} failed: {str(e)}")
+        return fetched
+
+    def start_background_sync(self, interval: float = REPLICA_SYNC_INTERVAL_SECONDS):
+        """Sync now and then every interval seconds on a daemon thread"""
+        def loop():
+            while not self._stop.is_set():
+                self.sync()
+                self._stop.wait(interval)
+
+        with self._stats_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=loop, name="replica-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def staleness(self, tables: Iterable[Table]) -> Optional[float]:
+        """Seconds since the least recently synced of the tables; None if one was never synced"""
+        cursor = self._cursor()
+        try:
+            oldest = None
+            for table in tables:
+                state = self._state(cursor, table)
+                if state is None or state["synced_at"] is None:
+                    return None
+                oldest = state["synced_at"] if oldest is None else min(oldest, state["synced_at"])
+            return None if oldest is None else time.time() - oldest
+        finally:
+            cursor.close()
+
+    def query(self, query: str, max_staleness: Optional[float] = None) -> Optional[pd.DataFrame]:
+        """Run the query on the replica; None when it should go to SQL Server instead"""
+        if classify_query(query) not in REPLICA_QUERY_CLASSES:
+            return None
+        tables = [self.catalog.table(name) for name in referenced_tables(query)]
+        if not tables or any(table is None for table in tables):
+            self._record("unknown_tables")
+            return None
+        staleness = self.staleness(tables)
+        bound = self.max_staleness if max_staleness is None else max_staleness
+        if staleness is None or staleness > bound:
+            self._record("stale")
+            return None
+        try:
+            translated = to_duckdb(query)
+        except UntranslatableQuery as e:
+            self._record("untranslatable")
+            print(f"Query not routed to the replica: {str(e)}")
+            return None
+
+        cursor = self._cursor()
+        try:
+            cursor.execute(translated)
+            df = fetch_frame(cursor)
+        except duckdb.Error as e:
+            self._record("replica_errors")
+            print(f"Replica query failed, using SQL Server: {str(e)}")
+            return None
+        finally:
+            cursor.close()
+        self._record("routed")
+        df.attrs["source"] = "replica"
+        df.attrs["staleness_s"] = round(staleness, 1)
+        print(f"Answered from the local replica ({staleness:.0f}s old)")
+        return df
+
+    def report(self) -> dict:
+        cursor = self._cursor()
+        try:
+            tables = {
+                name.split(".")[-1]: {"rows": rows, "age_s": round(time.time() - synced_at, 1) if synced_at else None}
+                for name, rows, synced_at in cursor.execute(
+                    f"SELECT table_name, row_count, synced_at FROM {self.database}.main.{STATE_TABLE} ORDER BY 1"
+                ).fetchall()
+            }
+        finally:
+            cursor.close()
+        with self._stats_lock:
+            return {"tables": tables, **self.stats}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("sync", "status"))
+    parser.add_argument("--full", action="store_true", help="Reload every table instead of syncing changes")
+    args = parser.parse_args(argv)
+
+    if not DUCKDB_AVAILABLE:
+        print("duckdb is not installed (pip install duckdb)")
+        return 1
+    from sql_complex_app import CATALOG, DatabaseConnection
+    replica = LocalReplica(CATALOG, lambda: DatabaseConnection().raw_connection())
+    if args.command == "sync":
+        replica.sync(full=args.full)
+    print(json.dumps(replica.report(), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
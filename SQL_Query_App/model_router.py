@@ -0,0 +1,123 @@
+import os
+import json
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from tracing import current_span, record_route
+
+# Model routing: each LLM stage gets its own model, temperature and max_tokens, and a cheap
+# model's answer is retried on the strong model when it is unusable or not confident enough
+MODEL_ROUTING_ENABLED = os.getenv("MODEL_ROUTING_ENABLED", "true").lower() == "true"
+STRONG_MODEL = os.getenv("STRONG_MODEL", "gpt-4")
+FAST_MODEL = os.getenv("FAST_MODEL", "gpt-4o-mini")
+# JSON object, or path to a JSON file, of stage -> {model, temperature, max_tokens, min_confidence}
+# overriding DEFAULT_ROUTES
+MODEL_ROUTES = os.getenv("MODEL_ROUTES", "")
+
+
+@dataclass(frozen=True)
+class Route:
+    model: str
+    temperature: float = 0.0
+    max_tokens: Optional[int] = None
+    # Escalate when the answer's "confidence" is below this; None never checks it
+    min_confidence: Optional[float] = None
+
+
+# Only stages whose output is checked (labels, yes/no, JSON plans) go to the fast model, where a
+# bad answer is caught and escalated. Free-text answers (general_response, answer_generation),
+# schema analysis and SQL generation use the strong one uncapped; MODEL_ROUTES can move them
+DEFAULT_ROUTES = {
+    "triage": Route(FAST_MODEL, max_tokens=60, min_confidence=0.7),
+    "validation": Route(FAST_MODEL, max_tokens=200, min_confidence=0.7),
+    "follow_up": Route(FAST_MODEL, max_tokens=400),
+}
+
+
+def load_routes(spec: str = MODEL_ROUTES) -> Dict[str, Route]:
+    """DEFAULT_ROUTES with the stages in spec (inline JSON or a JSON file path) replaced"""
+    routes = dict(DEFAULT_ROUTES)
+    if not spec:
+        return routes
+    if not spec.lstrip().startswith("{"):
+        with open(spec) as f:
+            spec = f.read()
+    for stage, route in json.loads(spec).items():
+        routes[stage] = Route(**{"model": STRONG_MODEL, **route})
+    return routes
+
+
+class ModelRouter:
+    """Chooses the chat model for each stage and escalates unusable cheap answers to the strong model"""
+
+    def __init__(self, factory: Callable[[Route], Any], routes: Optional[Dict[str, Route]] = None,
+                 strong: Optional[Route] = None, enabled: bool = MODEL_ROUTING_ENABLED):
+        self.factory = factory
+        self.routes = load_routes() if routes is None else routes
+        self.strong = strong or Route(STRONG_MODEL)
+        self.enabled = enabled
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def route(self, stage: str) -> Route:
+        return self.routes.get(stage, self.strong) if self.enabled else self.strong
+
+    def client(self, route: Route):
+        """One chat model per distinct route, created on first use"""
+        with self._lock:
+            if route not in self._clients:
+                self._clients[route] = self.factory(route)
+            return self._clients[route]
+
+    def model(self, stage: str):
+        """Chat model for a stage whose output can't be checked before use (streaming)"""
+        route = self.route(stage)
+        self._record(stage, route)
+        return self.client(route)
+
+    def invoke(self, stage: str, messages: list, parse: Callable[[str], Any],
+               confidence: Optional[Callable[[str], Optional[float]]] = None):
+        """parse(content) of the stage model's answer, or of the strong model's when that answer is rejected"""
+        route = self.route(stage)
+        content = self.client(route).invoke(messages).content
+        result, accepted = self._review(stage, route, content, parse, confidence)
+        if accepted:
+            return result
+        return parse(self.client(self.strong).invoke(messages).content)
+
+    async def ainvoke(self, stage: str, messages: list, parse: Callable[[str], Any],
+                      confidence: Optional[Callable[[str], Optional[float]]] = None):
+        route = self.route(stage)
+        content = (await self.client(route).ainvoke(messages)).content
+        result, accepted = self._review(stage, route, content, parse, confidence)
+        if accepted:
+            return result
+        return parse((await self.client(self.strong).ainvoke(messages)).content)
+
+    def _review(self, stage: str, route: Route, content: str, parse: Callable[[str], Any],
+                confidence: Optional[Callable[[str], Optional[float]]]) -> Tuple[Any, bool]:
+        """(parsed answer, True) if it can be used; (None, False) after recording an escalation"""
+        self._record(stage, route)
+        can_escalate = route != self.strong
+        try:
+            result = parse(content)
+        except (ValueError, KeyError, TypeError):
+            if not can_escalate:
+                raise
+            self._record(stage, self.strong, "invalid_output")
+            return None, False
+        if can_escalate and confidence is not None and route.min_confidence is not None:
+            score = confidence(content)
+            if score is not None and score < route.min_confidence:
+                self._record(stage, self.strong, "low_confidence")
+                return None, False
+        return result, True
+
+    def _record(self, stage: str, route: Route, escalation: Optional[str] = None):
+        record_route(stage, route.model, escalation)
+        span = current_span()
+        if span is not None:
+            span.set(model=route.model)
+            if escalation:
+                span.set(escalated=escalation)
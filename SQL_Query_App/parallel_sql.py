@@ -0,0 +1,118 @@
+import os
+import time
+import uuid
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+import pandas as pd
+
+from query_control import StatementRegistry
+
+# Parallel candidate settings
+SQL_CANDIDATES = int(os.getenv("SQL_CANDIDATES", "1"))
+# After the first success, how long to wait for other candidates to agree with it
+AGREEMENT_WINDOW_SECONDS = float(os.getenv("AGREEMENT_WINDOW_SECONDS", "0.5"))
+
+
+@dataclass
+class CandidateResult:
+    index: int
+    query: str
+    df: Optional[pd.DataFrame] = None
+    error: Optional[str] = None
+    elapsed: float = 0.0
+    fingerprint: Optional[str] = None
+    agreement: int = 0
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None and self.df is not None and not self.df.empty
+
+
+def result_fingerprint(df: pd.DataFrame) -> str:
+    """Order- and column-name-insensitive hash of a result set, used to compare candidates"""
+    rows = sorted(tuple("" if pd.isna(v) else str(v) for v in row) for row in df.itertuples(index=False))
+    return hashlib.sha256(repr((df.shape, rows)).encode("utf-8")).hexdigest()
+
+
+class CandidateRunner:
+    """Runs candidate queries concurrently and cancels the losers.
+
+    execute(query, token) runs one query the way a single query would run (statement
+    timeout, replica, key rewrites) and registers its cursor in registry under token.
+    """
+
+    def __init__(self, execute: Callable[[str, str], Optional[pd.DataFrame]], registry: StatementRegistry,
+                 agreement_window: float = AGREEMENT_WINDOW_SECONDS):
+        self.execute = execute
+        self.registry = registry
+        self.agreement_window = agreement_window
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+
+    def _execute(self, index: int, query: str) -> CandidateResult:
+        result = CandidateResult(index=index, query=query)
+        start = time.perf_counter()
+        token = uuid.uuid4().hex
+        try:
+            with self._lock:
+                if self._cancelled.is_set():
+                    raise RuntimeError("Cancelled before execution")
+                self._tokens[index] = token
+            result.df = self.execute(query, token)
+            if result.df is not None:
+                result.fingerprint = result_fingerprint(result.df)
+        except Exception as e:
+            result.error = str(e)
+        finally:
+            with self._lock:
+                self._tokens.pop(index, None)
+            result.elapsed = time.perf_counter() - start
+        return result
+
+    def cancel_running(self):
+        """Cancel every statement still executing server-side"""
+        self._cancelled.set()
+        with self._lock:
+            tokens = list(self._tokens.values())
+        for token in tokens:
+            self.registry.cancel(token)
+
+    def run(self, queries: List[str]) -> List[CandidateResult]:
+        """Execute all queries; returns finished results ranked best first"""
+        self._cancelled.clear()
+        executor = ThreadPoolExecutor(max_workers=max(1, len(queries)), thread_name_prefix="sql-candidate")
+        futures = {executor.submit(self._execute, i, q): i for i, q in enumerate(queries)}
+        finished: List[CandidateResult] = []
+        pending = set(futures)
+        deadline = None
+        try:
+            while pending:
+                timeout = None if deadline is None else max(0.0, deadline - time.perf_counter())
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    break  # agreement window elapsed
+                for future in done:
+                    result = future.result()
+                    finished.append(result)
+                    if result.succeeded and deadline is None:
+                        deadline = time.perf_counter() + self.agreement_window
+        finally:
+            if pending:
+                self.cancel_running()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return rank_candidates(finished)
+
+
+def rank_candidates(results: List[CandidateResult]) -> List[CandidateResult]:
+    """Successful results first, by how many other candidates returned the same rows, then speed"""
+    successes = [r for r in results if r.succeeded]
+    for result in successes:
+        result.agreement = sum(1 for other in successes if other is not result and other.fingerprint == result.fingerprint)
+    failures = [r for r in results if not r.succeeded]
+    return sorted(successes, key=lambda r: (-r.agreement, r.elapsed, r.index)) + failures
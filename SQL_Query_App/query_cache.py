@@ -0,0 +1,152 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+from contextlib import contextmanager
+from typing import Optional
+
+# Cache location and eviction settings
+CACHE_DIR = os.getenv("APP_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+QUERY_CACHE_ENABLED = os.getenv("QUERY_CACHE_ENABLED", "true").lower() == "true"
+QUERY_CACHE_PATH = os.getenv("QUERY_CACHE_PATH", os.path.join(CACHE_DIR, "query_cache.sqlite"))
+QUERY_CACHE_TTL_SECONDS = int(os.getenv("QUERY_CACHE_TTL_SECONDS", "86400"))
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "5000"))
+
+
+def normalize_question(question: str) -> str:
+    """Normalize question text so trivially different phrasings share a cache key"""
+    text = question.lower().replace("’", "'")
+    text = re.sub(r"[^\w\s']", " ", text)
+    return " ".join(text.split())
+
+
+def schema_fingerprint(schema: str) -> str:
+    """Hash of the schema text, so a schema change invalidates every cached plan"""
+    return hashlib.sha256(schema.encode("utf-8")).hexdigest()
+
+
+class QueryCache:
+    """On-disk question -> (triage, schema analysis, SQL) cache shared by all workers"""
+
+    def __init__(self, path: str = QUERY_CACHE_PATH, ttl_seconds: int = QUERY_CACHE_TTL_SECONDS,
+                 max_entries: int = QUERY_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    cache_key TEXT PRIMARY KEY,
+                    question TEXT NOT NULL,
+                    query_type TEXT NOT NULL,
+                    schema_analysis TEXT,
+                    sql_query TEXT,
+                    created_at REAL NOT NULL,
+                    last_accessed REAL NOT NULL,
+                    hit_count INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_accessed ON entries (last_accessed)")
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO counters (name, value) VALUES ('hits', 0), ('misses', 0), ('evictions', 0)")
+
+    @contextmanager
+    def _connect(self):
+        # A short-lived connection per call keeps this safe across threads and
+        # Streamlit worker processes; WAL lets readers proceed during writes.
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(question: str, schema: str) -> str:
+        normalized = normalize_question(question)
+        return hashlib.sha256(f"{schema_fingerprint(schema)}:{normalized}".encode("utf-8")).hexdigest()
+
+    def _bump(self, conn: sqlite3.Connection, name: str, amount: int = 1):
+        conn.execute("UPDATE counters SET value = value + ? WHERE name = ?", (amount, name))
+
+    def get(self, question: str, schema: str) -> Optional[dict]:
+        """Return the cached plan for a question, or None on a miss"""
+        key = self.make_key(question, schema)
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT query_type, schema_analysis, sql_query, created_at FROM entries WHERE cache_key = ?",
+                (key,)
+            ).fetchone()
+
+            if row is None or now - row[3] > self.ttl_seconds:
+                if row is not None:
+                    conn.execute("DELETE FROM entries WHERE cache_key = ?", (key,))
+                    self._bump(conn, "evictions")
+                self._bump(conn, "misses")
+                return None
+
+            conn.execute(
+                "UPDATE entries SET last_accessed = ?, hit_count = hit_count + 1 WHERE cache_key = ?",
+                (now, key)
+            )
+            self._bump(conn, "hits")
+
+        return {
+            "query_type": row[0],
+            "schema_analysis": json.loads(row[1]) if row[1] else None,
+            "sql_query": row[2],
+        }
+
+    def put(self, question: str, schema: str, query_type: str,
+            schema_analysis: Optional[dict] = None, sql_query: Optional[str] = None):
+        """Store the plan for a question and evict expired / least recently used entries"""
+        key = self.make_key(question, schema)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries "
+                "(cache_key, question, query_type, schema_analysis, sql_query, created_at, last_accessed, hit_count) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                (key, normalize_question(question), query_type,
+                 json.dumps(schema_analysis) if schema_analysis is not None else None,
+                 sql_query, now, now)
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        expired = conn.execute("DELETE FROM entries WHERE created_at < ?", (now - self.ttl_seconds,)).rowcount
+        overflow = conn.execute(
+            "DELETE FROM entries WHERE cache_key IN ("
+            "  SELECT cache_key FROM entries ORDER BY last_accessed DESC LIMIT -1 OFFSET ?"
+            ")",
+            (self.max_entries,)
+        ).rowcount
+        if expired + overflow:
+            self._bump(conn, "evictions", expired + overflow)
+
+    def invalidate(self, question: str, schema: str):
+        """Drop the cached plan for a question, e.g. when its SQL stops working"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries WHERE cache_key = ?", (self.make_key(question, schema),))
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries")
+            conn.execute("UPDATE counters SET value = 0")
+
+    def stats(self) -> dict:
+        """Hit/miss counters shared by every process using this cache file"""
+        with self._connect() as conn:
+            counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+            entries = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        lookups = counters.get("hits", 0) + counters.get("misses", 0)
+        return {
+            **counters,
+            "entries": entries,
+            "hit_rate": counters.get("hits", 0) / lookups if lookups else 0.0,
+        }
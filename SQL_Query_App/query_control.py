@@ -0,0 +1,144 @@
+import os
+import re
+import threading
+import uuid
+from typing import Dict, Optional
+
+import pandas as pd
+
+from result_fetch import fetch_frame
+
+# Statement timeouts (seconds) per query class; see classify_query
+QUERY_TIMEOUTS = {
+    name: int(seconds) for name, seconds in (
+        item.split(":") for item in os.getenv(
+            "QUERY_TIMEOUTS", "lookup:15,aggregate:60,analytical:120"
+        ).split(",") if item
+    )
+}
+DEFAULT_QUERY_TIMEOUT = int(os.getenv("QUERY_TIMEOUT_SECONDS", "60"))
+
+AGGREGATE_PATTERN = re.compile(r'\b(group\s+by|count|sum|avg|min|max|distinct)\b', re.IGNORECASE)
+ANALYTICAL_PATTERN = re.compile(r'\b(over\s*\(|with\s+\w+\s+as|union|intersect|except)\b', re.IGNORECASE)
+JOIN_PATTERN = re.compile(r'\bjoin\b', re.IGNORECASE)
+TIMEOUT_MARKERS = ("hyt00", "timeout expired", "query timeout", "timed out")
+
+
+class QueryTimeoutError(Exception):
+    """The statement ran longer than its timeout and was stopped by the driver"""
+
+
+class QueryCancelledError(Exception):
+    """The statement was cancelled on request (e.g. the UI's Cancel button)"""
+
+
+def classify_query(query: str) -> str:
+    """lookup, aggregate or analytical, judged from the SQL text"""
+    joins = len(JOIN_PATTERN.findall(query))
+    if ANALYTICAL_PATTERN.search(query) or joins >= 3:
+        return "analytical"
+    if AGGREGATE_PATTERN.search(query) or joins:
+        return "aggregate"
+    return "lookup"
+
+
+def timeout_for(query: str, query_class: Optional[str] = None) -> int:
+    return QUERY_TIMEOUTS.get(query_class or classify_query(query), DEFAULT_QUERY_TIMEOUT)
+
+
+def is_timeout_error(error: Exception) -> bool:
+    message = str(error).lower()
+    return isinstance(error, QueryTimeoutError) or any(marker in message for marker in TIMEOUT_MARKERS)
+
+
+class StatementRegistry:
+    """Cursors of running statements by token, so another thread can cancel them"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cursors: Dict[str, object] = {}
+        self._cancelled = set()
+
+    def register(self, token: str, cursor):
+        with self._lock:
+            self._cursors[token] = cursor
+
+    def unregister(self, token: str) -> bool:
+        """Forget the statement; True when it had been cancelled"""
+        with self._lock:
+            self._cursors.pop(token, None)
+            if token in self._cancelled:
+                self._cancelled.discard(token)
+                return True
+            return False
+
+    def cancel(self, token: str) -> bool:
+        with self._lock:
+            cursor = self._cursors.get(token)
+            if cursor is None:
+                return False
+            self._cancelled.add(token)
+        try:
+            cursor.cancel()  # SQLCancel: stops the statement on the server
+        except Exception as e:
+            print(f"Failed to cancel statement: {str(e)}")
+        return True
+
+    def cancel_all(self) -> int:
+        with self._lock:
+            tokens = list(self._cursors)
+        return sum(self.cancel(token) for token in tokens)
+
+    def running(self) -> int:
+        with self._lock:
+            return len(self._cursors)
+
+
+def run_statement(connection, query: str, timeout: Optional[int] = None,
+                  registry: Optional[StatementRegistry] = None, token: Optional[str] = None) -> pd.DataFrame:
+    """Execute a query on a pooled DBAPI connection with a statement timeout.
+
+    Raises QueryTimeoutError or QueryCancelledError instead of the driver's error. The
+    caller still owns the connection and must close() it to return it to the pool.
+    """
+    token = token or uuid.uuid4().hex
+    timeout = timeout if timeout is not None else timeout_for(query)
+    driver_connection = getattr(connection, "driver_connection", None) or getattr(connection, "dbapi_connection", connection)
+    previous_timeout = getattr(driver_connection, "timeout", None)
+    if previous_timeout is not None:
+        driver_connection.timeout = timeout
+
+    cursor = connection.cursor()
+    if registry:
+        registry.register(token, cursor)
+    cancelled = False
+    interrupted = False
+    try:
+        cursor.execute(query)
+        return fetch_frame(cursor)
+    except Exception as e:
+        cancelled = registry.unregister(token) if registry else False
+        registry = None
+        interrupted = cancelled or is_timeout_error(e)
+        if cancelled:
+            raise QueryCancelledError("Query was cancelled") from e
+        if interrupted:
+            raise QueryTimeoutError(f"Query timeout expired after {timeout}s (HYT00)") from e
+        raise
+    finally:
+        if registry:
+            registry.unregister(token)
+        try:
+            cursor.close()
+        except Exception:
+            pass
+        if previous_timeout is not None:
+            driver_connection.timeout = previous_timeout
+        if interrupted:
+            # Discard whatever the stopped statement left behind before reuse
+            try:
+                connection.rollback()
+            except Exception:
+                invalidate = getattr(connection, "invalidate", None)
+                if invalidate:
+                    invalidate()
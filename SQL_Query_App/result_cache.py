@@ -0,0 +1,250 @@
+import io
+import os
+import re
+import time
+import shutil
+import hashlib
+import pickle
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import pandas as pd
+
+from query_cache import CACHE_DIR
+
+try:
+    import pyarrow  # noqa: F401  (enables Parquet serialization in pandas)
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+# Result cache settings
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+RESULT_CACHE_MEMORY_MB = float(os.getenv("RESULT_CACHE_MEMORY_MB", "256"))
+RESULT_CACHE_DISK_MB = float(os.getenv("RESULT_CACHE_DISK_MB", "2048"))
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.join(CACHE_DIR, "results"))
+# How long a probed table version is trusted before asking the database again
+RESULT_CACHE_VERSION_CHECK_SECONDS = float(os.getenv("RESULT_CACHE_VERSION_CHECK_SECONDS", "30"))
+
+# Tables whose data version is max(<column>); every other table falls back to a checksum
+VERSION_COLUMNS = dict(
+    item.split(":") for item in os.getenv(
+        "RESULT_CACHE_VERSION_COLUMNS",
+        "account:modifiedon,contact:modifiedon,lead:modifiedon,opportunity:modifiedon,"
+        "email:modifiedon,annotation:modifiedon,appointment:modifiedon,phonecall:modifiedon,task:modifiedon"
+    ).split(",") if item
+)
+
+TABLE_REFERENCE_PATTERN = re.compile(
+    r'\b(?:from|join)\s+((?:\[?\w+\]?\.){0,2}\[?(\w+)\]?)',
+    re.IGNORECASE
+)
+CTE_NAME_PATTERN = re.compile(r'(?:\bwith|,)\s*\[?(\w+)\]?\s*(?:\([^)]*\))?\s+as\s*\(', re.IGNORECASE)
+
+
+def canonicalize_sql(query: str) -> str:
+    """Canonical form of a query: no comments, single spaces, lowercase outside string literals"""
+    query = re.sub(r'--[^\n]*', ' ', query)
+    query = re.sub(r'/\*.*?\*/', ' ', query, flags=re.DOTALL)
+
+    # Split on string literals so their contents keep case and spacing
+    parts = re.split(r"('(?:[^']|'')*')", query)
+    canonical = []
+    for i, part in enumerate(parts):
+        if i % 2:
+            canonical.append(part)
+        else:
+            canonical.append(" ".join(part.lower().split()))
+    return " ".join(p for p in canonical if p).strip().rstrip(";").strip()
+
+
+def referenced_tables(query: str) -> set:
+    """Short names of the tables a query reads from (CTE names excluded)"""
+    ctes = {match.group(1).lower() for match in CTE_NAME_PATTERN.finditer(query)}
+    tables = {match.group(2).lower() for match in TABLE_REFERENCE_PATTERN.finditer(query)}
+    return tables - ctes
+
+
+def table_version_sql(table: str, database: str = "DynamicsShortlisted", schema: str = "dbo") -> str:
+    """SQL returning a value that changes whenever the table's data changes"""
+    column = VERSION_COLUMNS.get(table)
+    if column:
+        return f"SELECT CONVERT(VARCHAR(33), MAX({column}), 126) FROM {database}.{schema}.{table}"
+    return f"SELECT CONCAT(COUNT_BIG(*), ':', CHECKSUM_AGG(BINARY_CHECKSUM(*))) FROM {database}.{schema}.{table}"
+
+
+def serialize_frame(df: pd.DataFrame) -> bytes:
+    """Compact columnar serialization (Parquet when pyarrow is installed)"""
+    buffer = io.BytesIO()
+    if PARQUET_AVAILABLE:
+        df.to_parquet(buffer, engine="pyarrow", compression="zstd", index=False)
+    else:
+        pickle.dump(df, buffer, protocol=pickle.HIGHEST_PROTOCOL)
+    return buffer.getvalue()
+
+
+def deserialize_frame(payload: bytes) -> pd.DataFrame:
+    if PARQUET_AVAILABLE:
+        return pd.read_parquet(io.BytesIO(payload), engine="pyarrow")
+    return pickle.loads(payload)
+
+
+class ResultCache:
+    """SQL result cache with a memory limit, spill-to-disk and per-table version invalidation"""
+
+    def __init__(self, run_scalar: Callable[[str], Any],
+                 memory_limit_mb: float = RESULT_CACHE_MEMORY_MB,
+                 disk_limit_mb: float = RESULT_CACHE_DISK_MB,
+                 spill_dir: str = RESULT_CACHE_DIR,
+                 version_check_seconds: float = RESULT_CACHE_VERSION_CHECK_SECONDS):
+        self.run_scalar = run_scalar
+        self.memory_limit = int(memory_limit_mb * 1024 * 1024)
+        self.disk_limit = int(disk_limit_mb * 1024 * 1024)
+        self.version_check_seconds = version_check_seconds
+        # Spilled files are indexed in memory, so each process owns its own directory
+        self.spill_dir = os.path.join(spill_dir, str(os.getpid()))
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+        os.makedirs(self.spill_dir, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._memory: "OrderedDict[str, dict]" = OrderedDict()
+        self._disk: "OrderedDict[str, dict]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._versions: Dict[str, tuple] = {}
+        self.counters = {"hits": 0, "misses": 0, "invalidations": 0, "spills": 0, "disk_evictions": 0}
+
+    @staticmethod
+    def make_key(query: str) -> str:
+        return hashlib.sha256(canonicalize_sql(query).encode("utf-8")).hexdigest()
+
+    def table_version(self, table: str) -> Any:
+        """Current data version of a table, probed at most once per check interval"""
+        now = time.time()
+        with self._lock:
+            cached = self._versions.get(table)
+            if cached and now - cached[1] < self.version_check_seconds:
+                return cached[0]
+        version = self.run_scalar(table_version_sql(table))
+        with self._lock:
+            self._versions[table] = (version, now)
+        return version
+
+    def _current_versions(self, tables) -> Optional[dict]:
+        try:
+            return {table: self.table_version(table) for table in sorted(tables)}
+        except Exception as e:
+            print(f"Result cache version probe failed: {str(e)}")
+            return None
+
+    def get(self, query: str) -> Tuple[Optional[pd.DataFrame], Optional[dict]]:
+        """(cached result, table versions) for the query
+
+        The result is None unless none of its tables changed since it was stored. Pass the
+        versions on to put(): they are probed before execution, so a change that lands while
+        the query runs cannot be hidden by the cache.
+        """
+        key = self.make_key(query)
+        with self._lock:
+            entry = self._memory.get(key) or self._disk.get(key)
+        tables = entry["versions"].keys() if entry else referenced_tables(query)
+        versions = self._current_versions(tables)
+
+        with self._lock:
+            # Look again: another thread may have spilled, evicted or replaced it while probing
+            entry = self._memory.get(key) or self._disk.get(key)
+            if entry is not None and (versions is None or versions != entry["versions"]):
+                self._drop(key)
+                self.counters["invalidations"] += 1
+                entry = None
+            if entry is None:
+                self.counters["misses"] += 1
+                return None, versions
+
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                payload = entry["payload"]
+            else:
+                # Promote spilled entries back into memory on access
+                with open(entry["path"], "rb") as f:
+                    payload = f.read()
+                self._drop(key)
+                self._store(key, payload, entry["versions"])
+            self.counters["hits"] += 1
+
+        df = deserialize_frame(payload)
+        df.attrs["from_cache"] = True
+        return df, versions
+
+    def put(self, query: str, df: pd.DataFrame, versions: Optional[dict]):
+        """Cache a query result together with the table versions get() probed before it ran"""
+        if not versions:
+            return
+        try:
+            payload = serialize_frame(df)
+        except Exception as e:
+            print(f"Result cache could not serialize result: {str(e)}")
+            return
+        with self._lock:
+            key = self.make_key(query)
+            self._drop(key)
+            self._store(key, payload, versions)
+
+    def invalidate_table(self, table: str):
+        """Drop every cached result that read from the given table"""
+        table = table.lower()
+        with self._lock:
+            self._versions.pop(table, None)
+            stale = [key for key, entry in list(self._memory.items()) + list(self._disk.items())
+                     if table in entry["versions"]]
+            for key in stale:
+                self._drop(key)
+            self.counters["invalidations"] += len(stale)
+
+    def _store(self, key: str, payload: bytes, versions: dict):
+        self._memory[key] = {"payload": payload, "versions": versions, "size": len(payload)}
+        self._memory_bytes += len(payload)
+
+        while self._memory_bytes > self.memory_limit and self._memory:
+            spilled_key, spilled = self._memory.popitem(last=False)
+            self._memory_bytes -= spilled["size"]
+            self._spill(spilled_key, spilled)
+
+    def _spill(self, key: str, entry: dict):
+        if entry["size"] > self.disk_limit:
+            return
+        path = os.path.join(self.spill_dir, f"{key}.bin")
+        with open(path, "wb") as f:
+            f.write(entry["payload"])
+        self._disk[key] = {"path": path, "versions": entry["versions"], "size": entry["size"]}
+        self._disk_bytes += entry["size"]
+        self.counters["spills"] += 1
+
+        while self._disk_bytes > self.disk_limit and self._disk:
+            evicted_key, _ = next(iter(self._disk.items()))
+            self._drop(evicted_key)
+            self.counters["disk_evictions"] += 1
+
+    def _drop(self, key: str):
+        with self._lock:
+            entry = self._memory.pop(key, None)
+            if entry:
+                self._memory_bytes -= entry["size"]
+            entry = self._disk.pop(key, None)
+            if entry:
+                self._disk_bytes -= entry["size"]
+                try:
+                    os.remove(entry["path"])
+                except OSError:
+                    pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.counters,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
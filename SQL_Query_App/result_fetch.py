@@ -0,0 +1,156 @@
+import os
+from typing import List, Optional
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    ARROW_AVAILABLE = True
+except ImportError:
+    ARROW_AVAILABLE = False
+
+# Limits for a single result set; whichever is hit first truncates it
+RESULT_MAX_ROWS = int(os.getenv("RESULT_MAX_ROWS", "100000"))
+RESULT_MAX_BYTES = int(os.getenv("RESULT_MAX_MB", "128")) * 1024 * 1024
+FETCH_BATCH_ROWS = int(os.getenv("FETCH_BATCH_ROWS", "5000"))
+# String columns with at most this share of distinct values become categoricals
+CATEGORY_MAX_UNIQUE_RATIO = float(os.getenv("CATEGORY_MAX_UNIQUE_RATIO", "0.5"))
+
+INTEGER_TYPES = ("int8", "int16", "int32", "int64")
+
+
+def _column_array(values: list):
+    """Arrow array for one fetched column; mixed-type columns fall back to strings"""
+    try:
+        return pa.array(values, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array([None if v is None else str(v) for v in values], type=pa.string())
+
+
+def _batch_table(columns: List[str], rows: list):
+    values = list(zip(*rows)) if rows else [[] for _ in columns]
+    return pa.Table.from_arrays([_column_array(list(v)) for v in values], names=columns)
+
+
+def _concat(tables: list):
+    # Later batches may settle a type the first one left as null (or a wider decimal)
+    try:
+        return pa.concat_tables(tables, promote_options="permissive")
+    except TypeError:
+        return pa.concat_tables(tables, promote=True)
+
+
+def compact_table(table):
+    """Downcast integers and dictionary-encode low-cardinality strings"""
+    columns = []
+    for name, column in zip(table.column_names, table.columns):
+        type_ = column.type
+        if pa.types.is_integer(type_) and column.null_count < len(column):
+            bounds = pc.min_max(column)
+            low, high = bounds["min"].as_py(), bounds["max"].as_py()
+            for candidate in INTEGER_TYPES:
+                target = pa.from_numpy_dtype(candidate)
+                limit = 2 ** (target.bit_width - 1)
+                if -limit <= low and high < limit:
+                    column = column.cast(target)
+                    break
+        elif (pa.types.is_string(type_) or pa.types.is_large_string(type_)) and len(column) > 1:
+            unique = len(pc.unique(column))
+            if unique <= len(column) * CATEGORY_MAX_UNIQUE_RATIO:
+                column = pc.dictionary_encode(column)
+        columns.append(column)
+    return pa.Table.from_arrays(columns, names=table.column_names)
+
+
+def _to_pandas(table) -> pd.DataFrame:
+    # Arrow-backed columns; dictionary columns become pandas categoricals
+    def types_mapper(type_):
+        return None if pa.types.is_dictionary(type_) else pd.ArrowDtype(type_)
+    return table.to_pandas(types_mapper=types_mapper)
+
+
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """pandas-only compaction when pyarrow is unavailable"""
+    for name in df.columns:
+        column = df[name]
+        if pd.api.types.is_integer_dtype(column):
+            df[name] = pd.to_numeric(column, downcast="integer")
+        elif column.dtype == object and len(column) > 1:
+            if column.map(lambda v: v is None or isinstance(v, str)).all() \
+                    and column.nunique() <= len(column) * CATEGORY_MAX_UNIQUE_RATIO:
+                df[name] = column.astype("category")
+    return df
+
+
+def fetch_frame(cursor, max_rows: int = RESULT_MAX_ROWS, max_bytes: int = RESULT_MAX_BYTES,
+                batch_rows: int = FETCH_BATCH_ROWS) -> pd.DataFrame:
+    """Build a compact DataFrame from an executed DBAPI cursor, fetching in batches.
+
+    Stops at max_rows or max_bytes; df.attrs["truncated"] tells whether rows were left behind.
+    """
+    columns = [column[0] for column in cursor.description]
+    batches = []
+    fetched = 0
+    size = 0
+    truncated = False
+
+    while True:
+        # One extra row tells a result of exactly max_rows from a truncated one
+        rows = cursor.fetchmany(min(batch_rows, max_rows + 1 - fetched))
+        if not rows:
+            break
+        if fetched + len(rows) > max_rows:
+            rows = rows[:max_rows - fetched]
+            truncated = True
+            if not rows:
+                break
+        if ARROW_AVAILABLE:
+            batch = _batch_table(columns, rows)
+            batch_size = batch.nbytes
+        else:
+            batch = pd.DataFrame.from_records(rows, columns=columns)
+            batch_size = int(batch.memory_usage(deep=True).sum())
+        if batches and size + batch_size > max_bytes:
+            truncated = True
+            break
+        batches.append(batch)
+        fetched += len(rows)
+        size += batch_size
+        if truncated:
+            break
+
+    if truncated:
+        # Stop the server from producing rows nobody will read
+        try:
+            cursor.cancel()
+        except Exception:
+            pass
+
+    if ARROW_AVAILABLE:
+        table = _concat(batches) if batches else _batch_table(columns, [])
+        df = _to_pandas(compact_table(table))
+    else:
+        df = pd.concat(batches, ignore_index=True) if batches else pd.DataFrame(columns=columns)
+        df = compact_frame(df)
+
+    df.attrs["truncated"] = truncated
+    df.attrs["row_limit"] = max_rows
+    if truncated:
+        print(f"Result truncated at {len(df)} rows ({size / 1024 / 1024:.1f} MB)")
+    return df
+
+
+def read_sql_bounded(query: str, connection, max_rows: Optional[int] = None,
+                     max_bytes: Optional[int] = None) -> pd.DataFrame:
+    """pd.read_sql replacement for a DBAPI connection with row/byte limits"""
+    cursor = connection.cursor()
+    try:
+        cursor.execute(query)
+        return fetch_frame(cursor, max_rows or RESULT_MAX_ROWS, max_bytes or RESULT_MAX_BYTES)
+    finally:
+        cursor.close()
+
+
+def is_truncated(df: Optional[pd.DataFrame]) -> bool:
+    return df is not None and bool(df.attrs.get("truncated"))
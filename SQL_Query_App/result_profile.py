@@ -0,0 +1,191 @@
+import os
+import threading
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from result_fetch import is_truncated
+
+# Size of the result summary sent to the LLM in place of raw rows
+PROFILE_TOKEN_BUDGET = int(os.getenv("PROFILE_TOKEN_BUDGET", "1500"))
+PROFILE_TOP_K = int(os.getenv("PROFILE_TOP_K", "5"))
+PROFILE_SAMPLE_ROWS = int(os.getenv("PROFILE_SAMPLE_ROWS", "12"))
+# Columns with at most this many distinct values can stratify the sample
+STRATIFY_MAX_GROUPS = 12
+# Results up to this many rows are sent whole when they fit the budget
+FULL_RESULT_MAX_ROWS = 200
+MAX_VALUE_CHARS = 60
+QUANTILES = [0.25, 0.5, 0.75]
+
+_encoder = None
+_encoder_lock = threading.Lock()
+
+
+def count_tokens(text: str) -> int:
+    """Tokens in text for the chat model; ~4 characters per token when tiktoken is unavailable"""
+    global _encoder
+    with _encoder_lock:
+        if _encoder is None:
+            try:
+                import tiktoken
+                _encoder = tiktoken.get_encoding("cl100k_base")
+            except Exception:
+                # Not installed, or the encoding can't be downloaded (offline hosts)
+                _encoder = False
+    if _encoder:
+        return len(_encoder.encode(text))
+    return len(text) // 4 + 1
+
+
+def _clip(value) -> str:
+    text = str(value)
+    return text if len(text) <= MAX_VALUE_CHARS else text[:MAX_VALUE_CHARS - 3] + "..."
+
+
+def _number(value: float) -> str:
+    if pd.isna(value):
+        return "null"
+    if float(value).is_integer() and abs(value) < 1e15:
+        return f"{int(value):,}"
+    return f"{value:,.0f}" if abs(value) >= 100 else f"{value:.4g}"
+
+
+def _kind(column: pd.Series) -> str:
+    if pd.api.types.is_bool_dtype(column):
+        return "boolean"
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return "datetime"
+    if pd.api.types.is_numeric_dtype(column):
+        return "number"
+    if isinstance(column.dtype, pd.ArrowDtype) and str(column.dtype.pyarrow_dtype).startswith("decimal"):
+        return "number"
+    return "text"
+
+
+def _describe_columns(df: pd.DataFrame) -> List[str]:
+    """One line per column: type, null rate, range/quantiles or top categories"""
+    null_rates = df.isna().mean()
+    kinds = {name: _kind(df[name]) for name in df.columns}
+    numeric = [name for name, kind in kinds.items() if kind == "number"]
+    stats = None
+    if numeric:
+        values = df[numeric].astype("float64")
+        stats = values.quantile([0.0] + QUANTILES + [1.0]).T
+        stats["mean"] = values.mean()
+
+    lines = []
+    for name in df.columns:
+        kind = kinds[name]
+        column = df[name]
+        parts = [f"nulls {null_rates[name]:.0%}"]
+        if kind == "number":
+            low, p25, p50, p75, high, mean = stats.loc[name]
+            parts.append(f"min {_number(low)}, p25 {_number(p25)}, median {_number(p50)}, "
+                         f"p75 {_number(p75)}, max {_number(high)}, mean {_number(mean)}")
+        elif kind == "datetime":
+            parts.append(f"min {column.min()}, max {column.max()}")
+        else:
+            counts = column.astype("string").value_counts(dropna=True)
+            parts.append(f"{len(counts):,} distinct")
+            if kind == "boolean" or len(counts) < len(column.dropna()):
+                # Top categories only say something when values repeat
+                top = ", ".join(f"{_clip(value)} ({count:,})" for value, count in counts.head(PROFILE_TOP_K).items())
+                parts.append(f"top: {top}")
+        lines.append(f"- {name} ({kind}): " + "; ".join(parts))
+    return lines
+
+
+def _stratify_column(df: pd.DataFrame) -> Optional[str]:
+    """Lowest-cardinality text column with 2..STRATIFY_MAX_GROUPS groups, if any"""
+    best = None
+    for name in df.columns:
+        if _kind(df[name]) not in ("text", "boolean"):
+            continue
+        groups = df[name].nunique(dropna=True)
+        if 2 <= groups <= STRATIFY_MAX_GROUPS and (best is None or groups < best[1]):
+            best = (name, groups)
+    return best[0] if best else None
+
+
+def _round_robin_quota(sizes: List[int], n: int) -> List[int]:
+    """Rows to take from each group: an equal share, with what small groups can't fill handed on"""
+    quota = [0] * len(sizes)
+    while n > 0:
+        open_groups = [i for i, size in enumerate(sizes) if quota[i] < size]
+        share = max(n // len(open_groups), 1)
+        for i in open_groups:
+            take = min(share, sizes[i] - quota[i], n)
+            quota[i] += take
+            n -= take
+            if not n:
+                break
+    return quota
+
+
+def _spread(positions: np.ndarray, n: int) -> np.ndarray:
+    """n evenly spaced entries of positions (always the first and last when n > 1)"""
+    return positions[np.unique(np.linspace(0, len(positions) - 1, n).round().astype(int))]
+
+
+def stratified_sample(df: pd.DataFrame, n: int) -> pd.DataFrame:
+    """Up to n rows spread across the frame: an equal share of each group of a categorical
+    column when there is one, otherwise evenly spaced positions; within a group the rows are
+    evenly spaced too, so the sample is never just the head of the frame"""
+    if len(df) <= n:
+        return df
+    column = _stratify_column(df)
+    if column:
+        members = list(df.groupby(column, dropna=False, observed=True, sort=False).indices.values())
+        quota = _round_robin_quota([len(positions) for positions in members], n)
+        picks = [_spread(positions, k) for positions, k in zip(members, quota) if k]
+        return df.iloc[np.sort(np.concatenate(picks))]
+    return df.iloc[_spread(np.arange(len(df)), n)]
+
+
+def _rows_csv(df: pd.DataFrame) -> str:
+    clipped = df.copy()
+    for name in df.columns:
+        if _kind(df[name]) == "text":
+            clipped[name] = df[name].map(lambda v: v if pd.isna(v) else _clip(v))
+    return clipped.to_csv(index=False).strip()
+
+
+def profile_frame(df: pd.DataFrame, token_budget: int = PROFILE_TOKEN_BUDGET) -> str:
+    """Compact text summary of a result for an LLM prompt, kept within token_budget.
+
+    Small results are sent whole as CSV. Larger ones become a per-column profile plus
+    a stratified sample, shrunk until they fit.
+    """
+    total = f"more than {len(df):,} (result was truncated)" if is_truncated(df) else f"{len(df):,}"
+    header = f"Rows: {total}; columns: {len(df.columns)}"
+    if df.empty:
+        return header
+
+    if len(df) <= FULL_RESULT_MAX_ROWS:
+        text = f"{header}\nAll rows (CSV):\n{_rows_csv(df)}"
+        if count_tokens(text) <= token_budget:
+            return text
+
+    column_lines = _describe_columns(df)
+    profiled = len(column_lines)
+    sample_rows = PROFILE_SAMPLE_ROWS
+    while True:
+        lines = [header, "Columns:", *column_lines[:profiled]]
+        if profiled < len(column_lines):
+            lines.append(f"- ... {len(column_lines) - profiled} more columns not profiled")
+        if sample_rows:
+            sample = stratified_sample(df, sample_rows)
+            stratified_by = _stratify_column(df) if len(sample) < len(df) else None
+            spread = f", spread over {stratified_by}" if stratified_by else ""
+            lines += [f"Sample rows ({len(sample)} of {len(df):,}{spread}, CSV):", _rows_csv(sample)]
+        text = "\n".join(lines)
+        if count_tokens(text) <= token_budget:
+            return text
+        # Shrink the sample first, then drop column profiles (wide results)
+        if sample_rows:
+            sample_rows //= 2
+        elif profiled > 1:
+            profiled //= 2
+        else:
+            return text
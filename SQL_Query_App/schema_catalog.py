@@ -0,0 +1,218 @@
+import os
+import re
+import pickle
+import hashlib
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from db_schema import DB_SCHEMA
+from query_cache import CACHE_DIR
+
+# Bump when the parsed structure changes so stale on-disk catalogs are ignored
+CATALOG_FORMAT_VERSION = "1"
+CATALOG_CACHE_DIR = os.getenv("CATALOG_CACHE_DIR", os.path.join(CACHE_DIR, "catalog"))
+
+TABLE_HEADER_PATTERN = re.compile(r'^\s*General Table name:\s*(\S+)\s*$')
+TABLE_DESCRIPTION_PATTERN = re.compile(r'^\s*Description:\s*(.*?)\s*$')
+COLUMN_PATTERN = re.compile(r'^\s*(\w+)\s*\(([^)]*)\)\s*Description\s*:\s*"(.*)"\s*$')
+FOREIGN_KEY_PATTERN = re.compile(r'Foreign key to ([\w.]+)\.(\w+)$')
+
+# Lookup tables joined by convention in the prompts rather than a declared foreign key:
+# column name -> (target table short name, target column)
+IMPLICIT_FOREIGN_KEYS = {
+    "ownerid": ("owner", "ownerid"),
+    "new_dropoutreason": ("dropout_reason", "DropoutReasonID"),
+    "xt_leadsource": ("source", "Value"),
+}
+
+
+@dataclass(slots=True)
+class Column:
+    name: str
+    data_type: str
+    description: str = ""
+    is_primary_key: bool = False
+    references: Optional[tuple] = None  # (table full name, column) for single-target foreign keys
+    is_polymorphic: bool = False  # "Foreign key to multiple tables"
+
+
+@dataclass(slots=True)
+class ForeignKey:
+    table: str
+    column: str
+    ref_table: str
+    ref_column: str
+    implicit: bool = False
+
+
+@dataclass(slots=True)
+class Table:
+    full_name: str
+    name: str
+    description: str = ""
+    columns: Dict[str, Column] = field(default_factory=dict)  # keyed by lowercase column name
+    primary_key: Optional[str] = None
+    foreign_keys: List[ForeignKey] = field(default_factory=list)
+    schema_text: str = ""  # the table's block of the original schema text, for prompts
+
+    def column(self, name: str) -> Optional[Column]:
+        return self.columns.get(name.lower())
+
+
+class SchemaCatalog:
+    """Tables, typed columns, keys and the foreign-key graph parsed from schema text"""
+
+    def __init__(self, tables: List[Table], schema_hash: str):
+        self.schema_hash = schema_hash
+        self.tables: Dict[str, Table] = {}
+        for table in tables:
+            self.tables[table.name.lower()] = table
+            self.tables[table.full_name.lower()] = table
+        self.table_list = tables
+
+        # column name -> tables having it
+        self.column_index: Dict[str, List[str]] = {}
+        for table in tables:
+            for column in table.columns.values():
+                self.column_index.setdefault(column.name.lower(), []).append(table.full_name)
+
+        # Undirected adjacency: table full name -> {neighbour full name: [ForeignKey, ...]}
+        self.graph: Dict[str, Dict[str, List[ForeignKey]]] = {table.full_name: {} for table in tables}
+        for table in tables:
+            for fk in table.foreign_keys:
+                self.graph[fk.table].setdefault(fk.ref_table, []).append(fk)
+                self.graph[fk.ref_table].setdefault(fk.table, []).append(fk)
+
+    def table(self, name: str) -> Optional[Table]:
+        """Look up a table by short or fully qualified name (case-insensitive, brackets allowed)"""
+        return self.tables.get(name.replace("[", "").replace("]", "").lower())
+
+    def column(self, table_name: str, column_name: str) -> Optional[Column]:
+        table = self.table(table_name)
+        return table.column(column_name) if table else None
+
+    def tables_with_column(self, column_name: str) -> List[str]:
+        return self.column_index.get(column_name.lower(), [])
+
+    def neighbours(self, table_name: str) -> List[str]:
+        table = self.table(table_name)
+        return list(self.graph[table.full_name]) if table else []
+
+    def table_names(self) -> List[str]:
+        return [table.full_name for table in self.table_list]
+
+
+def _parse_column(line: str) -> Optional[Column]:
+    match = COLUMN_PATTERN.match(line)
+    if not match:
+        return None
+    name, annotation, description = match.groups()
+    annotation = annotation.strip()
+    column = Column(name=name, data_type=annotation, description=description)
+
+    if annotation == "Primary Key":
+        column.data_type = "String"
+        column.is_primary_key = True
+    elif annotation.startswith("Foreign key to"):
+        column.data_type = "String"
+        fk_match = FOREIGN_KEY_PATTERN.match(annotation)
+        if fk_match:
+            column.references = (fk_match.group(1), fk_match.group(2))
+        else:
+            column.is_polymorphic = True
+    return column
+
+
+def parse_schema(schema_text: str) -> List[Table]:
+    """Parse the free-text schema into tables; commented-out (#) tables are skipped"""
+    tables = []
+    current = None
+    block_lines = []
+
+    def finish():
+        if current is not None:
+            current.schema_text = "\n".join(block_lines).strip()
+            tables.append(current)
+
+    for line in schema_text.splitlines():
+        if line.lstrip().startswith("#"):
+            continue
+        header = TABLE_HEADER_PATTERN.match(line)
+        if header:
+            finish()
+            full_name = header.group(1)
+            current = Table(full_name=full_name, name=full_name.split(".")[-1])
+            block_lines = [line.rstrip()]
+            continue
+        if current is None:
+            continue
+        block_lines.append(line.rstrip())
+
+        description = TABLE_DESCRIPTION_PATTERN.match(line)
+        if description and not current.columns:
+            current.description = description.group(1)
+            continue
+        column = _parse_column(line)
+        if column:
+            current.columns[column.name.lower()] = column
+            if column.is_primary_key and current.primary_key is None:
+                current.primary_key = column.name
+    finish()
+
+    by_name = {table.name.lower(): table for table in tables}
+    by_full_name = {table.full_name.lower(): table for table in tables}
+    for table in tables:
+        for column in table.columns.values():
+            if column.references:
+                target = by_full_name.get(column.references[0].lower())
+                if target:
+                    ref_column = target.column(column.references[1])
+                    table.foreign_keys.append(ForeignKey(
+                        table.full_name, column.name, target.full_name,
+                        ref_column.name if ref_column else column.references[1]
+                    ))
+                continue
+            implicit = IMPLICIT_FOREIGN_KEYS.get(column.name.lower())
+            if implicit and implicit[0] in by_name and by_name[implicit[0]] is not table:
+                target = by_name[implicit[0]]
+                ref_column = target.column(implicit[1])
+                if ref_column:
+                    table.foreign_keys.append(ForeignKey(
+                        table.full_name, column.name, target.full_name, ref_column.name, implicit=True
+                    ))
+    return tables
+
+
+_catalogs: Dict[str, SchemaCatalog] = {}
+_catalogs_lock = threading.Lock()
+
+
+def load_catalog(schema_text: str = DB_SCHEMA, cache_dir: str = CATALOG_CACHE_DIR) -> SchemaCatalog:
+    """Parsed catalog for the schema text, memoized in-process and on disk by content hash"""
+    schema_hash = hashlib.sha256(f"{CATALOG_FORMAT_VERSION}:{schema_text}".encode("utf-8")).hexdigest()
+    with _catalogs_lock:
+        if schema_hash in _catalogs:
+            return _catalogs[schema_hash]
+
+        path = os.path.join(cache_dir, f"{schema_hash}.pkl")
+        catalog = None
+        try:
+            with open(path, "rb") as f:
+                catalog = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            pass
+
+        if catalog is None:
+            catalog = SchemaCatalog(parse_schema(schema_text), schema_hash)
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    pickle.dump(catalog, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"Could not write schema catalog cache: {str(e)}")
+
+        _catalogs[schema_hash] = catalog
+        return catalog
@@ -0,0 +1,149 @@
+import os
+import re
+import math
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+from schema_catalog import load_catalog
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _ENCODING = None
+
+# Schema pruning settings
+SCHEMA_PRUNING_ENABLED = os.getenv("SCHEMA_PRUNING_ENABLED", "true").lower() == "true"
+SCHEMA_TOKEN_BUDGET = int(os.getenv("SCHEMA_TOKEN_BUDGET", "3500"))
+SCHEMA_TOP_TABLES = int(os.getenv("SCHEMA_TOP_TABLES", "3"))
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "based", "by", "can", "do", "does", "for", "from", "has", "have",
+    "how", "i", "id", "in", "is", "it", "its", "many", "me", "of", "on", "or", "our", "show", "that", "the",
+    "their", "them", "there", "this", "to", "us", "was", "we", "were", "what", "when", "which", "who",
+    "why", "with", "description", "string", "integer", "decimal", "date", "boolean", "dynamicsshortlisted", "dbo",
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Token count for prompt budgeting (tiktoken when available, ~4 chars/token otherwise)"""
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return len(text) // 4 + 1
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens with identifiers split on underscores and a light plural stemmer"""
+    words = re.findall(r'[a-z0-9]+', re.sub(r'([a-z])([A-Z])', r'\1 \2', text).lower().replace("_", " "))
+    tokens = []
+    for word in words:
+        if word in STOPWORDS or len(word) < 2:
+            continue
+        if len(word) > 4 and word.endswith("ies"):
+            word = word[:-3] + "y"
+        elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+class SchemaIndex:
+    """BM25 index over schema tables (name, columns and descriptions) with foreign-key expansion"""
+
+    def __init__(self, schema: str, k1: float = 1.5, b: float = 0.75):
+        self.schema = schema
+        self.k1 = k1
+        self.b = b
+        catalog = load_catalog(schema)
+        self.blocks = {table.full_name: table.schema_text for table in catalog.table_list}
+        self.block_tokens = {table: estimate_tokens(block) for table, block in self.blocks.items()}
+
+        # Table names are repeated so a direct mention outweighs a column description
+        self.documents: Dict[str, Counter] = {}
+        for table, block in self.blocks.items():
+            short_name = table.split(".")[-1]
+            self.documents[table] = Counter(tokenize(block) + tokenize(short_name) * 3)
+        self.doc_lengths = {table: sum(doc.values()) for table, doc in self.documents.items()}
+        self.avg_doc_length = (sum(self.doc_lengths.values()) / len(self.doc_lengths)) if self.doc_lengths else 0.0
+
+        document_frequency = Counter()
+        for doc in self.documents.values():
+            document_frequency.update(doc.keys())
+        n = len(self.documents)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in document_frequency.items()}
+
+        # Foreign-key (declared and lookup) neighbours from the catalog graph
+        self.neighbours: Dict[str, set] = {
+            table: set(catalog.neighbours(table)) - {table} for table in self.blocks
+        }
+
+    def score(self, question: str) -> List[Tuple[str, float]]:
+        """BM25 score of every table for the question, best first"""
+        terms = tokenize(question)
+        scores = []
+        for table, doc in self.documents.items():
+            length_norm = 1 - self.b + self.b * self.doc_lengths[table] / self.avg_doc_length
+            score = 0.0
+            for term in terms:
+                tf = doc.get(term, 0)
+                if tf:
+                    score += self.idf[term] * tf * (self.k1 + 1) / (tf + self.k1 * length_norm)
+            scores.append((table, score))
+        return sorted(scores, key=lambda item: item[1], reverse=True)
+
+    def named_tables(self, question: str) -> List[str]:
+        """Tables the question mentions by name ("leads", "dropout reasons"), in schema order"""
+        terms = set(tokenize(question))
+        return [table for table in self.blocks
+                if set(tokenize(table.split(".")[-1])) <= terms]
+
+    def required_tables(self, question: str, top_k: int = SCHEMA_TOP_TABLES) -> List[str]:
+        """Tables named in the question followed by the other top scoring ones"""
+        named = self.named_tables(question)
+        ranked = [table for table, score in self.score(question) if score > 0]
+        return named + [table for table in ranked[:top_k] if table not in named]
+
+    def select_tables(self, question: str, top_k: int = SCHEMA_TOP_TABLES) -> List[str]:
+        """Named and top scoring tables followed by their foreign-key neighbours, in priority order"""
+        top = self.required_tables(question, top_k)
+        score_of = dict(self.score(question))
+        # Ties broken by name: set order varies between processes, and the prompt shouldn't
+        neighbours = sorted(
+            {n for table in top for n in self.neighbours[table]} - set(top),
+            key=lambda table: (-score_of.get(table, 0.0), table)
+        )
+        return top + neighbours
+
+    def build_context(self, question: str, token_budget: int = SCHEMA_TOKEN_BUDGET,
+                      top_k: int = SCHEMA_TOP_TABLES) -> str:
+        """Schema slice relevant to the question within the token budget, or the full schema
+
+        Named and top scoring tables are never dropped: when they don't all fit, the full schema
+        is sent. Neighbours only fill the space that is left.
+        """
+        required = self.required_tables(question, top_k)
+        used = sum(self.block_tokens[table] for table in required)
+        if not required or used > token_budget:
+            return self.schema
+
+        selected = list(required)
+        for table in self.select_tables(question, top_k)[len(required):]:
+            cost = self.block_tokens[table]
+            if used + cost > token_budget:
+                continue
+            selected.append(table)
+            used += cost
+        return "\n\n".join(self.blocks[table] for table in selected)
+
+
+@lru_cache(maxsize=8)
+def get_schema_index(schema: str) -> SchemaIndex:
+    return SchemaIndex(schema)
+
+
+def select_schema_context(question: str, schema: str, token_budget: int = SCHEMA_TOKEN_BUDGET) -> str:
+    """Schema text to put in a prompt for this question (full schema when pruning is disabled)"""
+    if not SCHEMA_PRUNING_ENABLED:
+        return schema
+    return get_schema_index(schema).build_context(question, token_budget)
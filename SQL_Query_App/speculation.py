@@ -0,0 +1,85 @@
+import os
+import threading
+from collections import deque
+
+# Speculative schema analysis: "auto" (speculate while the recent DATA_QUESTION rate is high enough),
+# "on" (always) or "off"
+SPECULATIVE_ANALYSIS = os.getenv("SPECULATIVE_ANALYSIS", "auto").lower()
+SPECULATION_MIN_HIT_RATE = float(os.getenv("SPECULATION_MIN_HIT_RATE", "0.7"))
+SPECULATION_WINDOW = int(os.getenv("SPECULATION_WINDOW", "200"))
+# Below this many observed questions "auto" speculates, assuming mostly data questions
+SPECULATION_MIN_SAMPLES = int(os.getenv("SPECULATION_MIN_SAMPLES", "20"))
+
+
+class SpeculationTracker:
+    """Learns how often triage says DATA_QUESTION and accounts for speculation's cost and benefit"""
+
+    def __init__(self, mode: str = SPECULATIVE_ANALYSIS, min_hit_rate: float = SPECULATION_MIN_HIT_RATE,
+                 window: int = SPECULATION_WINDOW, min_samples: int = SPECULATION_MIN_SAMPLES):
+        self.mode = mode
+        self.min_hit_rate = min_hit_rate
+        self.min_samples = min_samples
+        self._outcomes = deque(maxlen=window)  # True when triage returned DATA_QUESTION
+        self._lock = threading.Lock()
+        self._counters = {
+            "speculated": 0,
+            "hits": 0,
+            "misses": 0,
+            "latency_saved_s": 0.0,
+            "wasted_tokens": 0,
+            "wasted_cost_usd": 0.0,
+        }
+
+    def hit_rate(self) -> float:
+        with self._lock:
+            if not self._outcomes:
+                return 1.0
+            return sum(self._outcomes) / len(self._outcomes)
+
+    def should_speculate(self) -> bool:
+        if self.mode == "on":
+            return True
+        if self.mode != "auto":
+            return False
+        with self._lock:
+            if len(self._outcomes) < self.min_samples:
+                return True
+        return self.hit_rate() >= self.min_hit_rate
+
+    def record_triage(self, query_type: str):
+        """Every triage result feeds the hit rate, whether or not we speculated"""
+        with self._lock:
+            self._outcomes.append(query_type == "DATA_QUESTION")
+
+    def record_hit(self, triage_seconds: float, analysis_seconds: float):
+        # Sequential would take triage + analysis; overlapped takes the longer of the two
+        with self._lock:
+            self._counters["speculated"] += 1
+            self._counters["hits"] += 1
+            self._counters["latency_saved_s"] += min(triage_seconds, analysis_seconds)
+
+    def record_miss(self):
+        with self._lock:
+            self._counters["speculated"] += 1
+            self._counters["misses"] += 1
+
+    def record_waste(self, tokens: int, cost: float):
+        """Token usage of a speculative analysis whose result was thrown away"""
+        with self._lock:
+            self._counters["wasted_tokens"] += tokens
+            self._counters["wasted_cost_usd"] += cost
+
+    def report(self) -> dict:
+        hit_rate = self.hit_rate()
+        with self._lock:
+            report = dict(self._counters)
+            samples = len(self._outcomes)
+        report.update({
+            "mode": self.mode,
+            "recent_hit_rate": round(hit_rate, 3),
+            "samples": samples,
+            "min_hit_rate": self.min_hit_rate,
+            "latency_saved_s": round(report["latency_saved_s"], 3),
+            "wasted_cost_usd": round(report["wasted_cost_usd"], 6),
+        })
+        return report
@@ -1,14 +1,41 @@
 import os
+import sys
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage
+from langchain_community.callbacks import get_openai_callback
 import json
 import re
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import pyodbc
-from typing import Optional, Any, Tuple
+from typing import Optional, Any, Tuple, List, Iterator, Callable
 import pandas as pd
-from sqlalchemy import create_engine
-import urllib
+from query_cache import QueryCache, QUERY_CACHE_ENABLED
+from result_cache import ResultCache, RESULT_CACHE_ENABLED, canonicalize_sql
+from schema_index import select_schema_context
+from db_schema import DB_SCHEMA
+from schema_catalog import load_catalog
+from join_planner import plan_joins_for_analysis
+from sql_validator import check_sql, validate_sql
+from sql_repair import repair_sql, record as record_repair
+from parallel_sql import CandidateRunner, SQL_CANDIDATES
+from speculation import SpeculationTracker
+from streaming import stream_llm, stream_json_field
+from db_pool import get_pool, pool_stats, DB_POOL_SIZE
+from result_profile import profile_frame
+from query_control import run_statement, StatementRegistry, QueryTimeoutError, QueryCancelledError
+from cost_gate import CostGate, ShowplanProvider, QueryTooExpensiveError, COST_GATE_ENABLED
+from id_keys import IdKeyRewriter, SARGABLE_ID_KEYS
+from local_replica import LocalReplica, LOCAL_REPLICA_ENABLED, DUCKDB_AVAILABLE
+from model_router import ModelRouter, Route
+from follow_up import (
+    Conversation, FollowUp, match_follow_up, needs_planner, build_follow_up_prompt, parse_follow_up_plan,
+    run_follow_up, describe_steps, FOLLOW_UP_ENABLED
+)
+from triage_classifier import load_triage_classifier, TriageLabelLog, TRIAGE_CLASSIFIER_ENABLED, TRIAGE_CLASSIFIER_THRESHOLD
+from tracing import span, traced, traced_stream, current_span, in_context, record_route, register_counters, TracingCallback, start_metrics_server, TRACE_LOG_PATH, TRACING_ENABLED
 
 # Load environment variables
 load_dotenv()
@@ -16,323 +43,67 @@ load_dotenv()
 # Initialize API key
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-# Initialize the language model
-llm = ChatOpenAI(
-    api_key=OPENAI_API_KEY,
-    model="gpt-4",
-    temperature=0.0
-)
+# Initialize the language models, one per distinct stage route (model_router.DEFAULT_ROUTES)
+def make_chat_model(route: Route) -> ChatOpenAI:
+    return ChatOpenAI(
+        api_key=OPENAI_API_KEY,
+        model=route.model,
+        temperature=route.temperature,
+        max_tokens=route.max_tokens,
+        # Token usage and cost of every call go to the current trace span
+        callbacks=[TracingCallback()]
+    )
 
-# Database schema
-DB_SCHEMA = """
-General Table name: DynamicsShortlisted.dbo.account
-Description: 
-Columns: 
-  accountid (Primary Key) Description : "ID of account. Account is the organization willing to make a purchase."
-  address1_line1 (String) Description : "Account's address line one"
-  address1_line2 (String) Description : "Account's Address line two"
-  address1_postalcode (String) Description : "Account's postal code"
-  address2_country (String) Description : "Account's country"
-  address2_stateorprovince (String) Description : "Account's state or province name"
-  cr93b_accounttype (Integer) Description : "Type of account"
-  createdby (String) Description : "ID of the user who created the account"
-  createdon (Date) Description : "Date on which the account was created"
-  emailaddress1 (String) Description : "Account's email address"
-  new_activeinactive (Boolean) Description : "Account's active or inactive status"
-  new_outreach (String) Description : "The method of account's signing up, such as Outbound, Referral, etc"
-  new_totallicenseaddons (Integer) Description : "License addons bought by account"
-  numberofemployees (Integer) Description : "The number of employees account organization has"
-  originatingleadid (Foreign key to DynamicsShortlisted.dbo.lead.leadid) Description : "The lead through which this account was created"
-  ownerid (String) Description : "Owner or the creator of this account in the system"
-  owninguser (String) Description : "The current owner of the account"
-  primarycontactid (Foreign key to DynamicsShortlisted.dbo.contact.contactid) Description : "Primary contact person for the account"
-  revenue (Decimal) Description : "Telephone number of the account"
-  telephone1 (String) Description : "Telephone number of the account"
-  versionnumber (Integer) Description : "Account's version number"
-  websiteurl (String) Description : "Website URL of the account's organization"
-  xt_accountproduct (Integer) Description : "Product ID in which the account is interested in"
-  xt_accountrecordtype (Integer) Description : "Record type of account"
-  xt_accountsource (Integer) Description : "Source of account"
-  xt_adcampaign (String) Description : "The name of the add campaign which led the account's lead signed up"
-  xt_additionalclientlicenses (Decimal) Description : "Number of additional client licenses requested"
-  xt_additionaldevserverlicenses (Decimal) Description : "Number of additional developer server licenses requested"
-  xt_additionalprodserverlicenses (Decimal) Description : "Number of additional production server licenses requested"
-  xt_adgroup (String) Description : "The add group in which the add campaign was run"
-  xt_attribution (Integer) Description : ""
-  xt_clientlicenses (Decimal) Description : "Total number of client licenses"
-  xt_comments (String) Description : "Comments by sales person"
-  xt_country (String) Description : "Country of the account"
-  xt_devserverlicenses (Decimal) Description : "Total number of developer licenses"
-  xt_enddate (Date) Description : "Expiration date of the license"
-  xt_industry (Integer) Description : "Industry of the account"
-  xt_iscustomer (Integer) Description : "Is customer, can have a value of 206220000 if it is a customer or 206220001 if it is a partner or opportunity"
-  xt_isdeleted (Boolean) Description : "Is the account deleted"
-  xt_keywords (String) Description : "Key words used in add campaigns"
-  xt_landingpage (String) Description : "Landing page of the add campaign"
-  xt_lastactivitydate (Date) Description : "Last activity on account's information"
-  xt_lastmodifieddate (Date) Description : "Last modified date of account's information"
-  xt_primarycontact (String) Description : "Name of the primary contact person for this account"
-  xt_productname (String) Description : "Name and tier of the product bought by the account"
-  xt_productnameis (String) Description : "Name of the product bought by the account"
-  xt_purchasetype (Integer) Description : "Purchase type of the account"
-  xt_rating (Integer) Description : "Account rating"
-  xt_sendrenewalinvoicedate (Date) Description : "License renewal alert date"
-  xt_serverlicenses (Decimal) Description : "Total number of server licenses"
-  xt_startdate (Date) Description : "License start date"
-  xt_type (Integer) Description : "Type of account"
-
-# General Table name: DynamicsShortlisted.dbo.annotation
-# Description: 
-# Columns: 
-#   annotationid (Primary Key) Description : "ID of the annotation (note) object"
-#   createdby (String) Description : "Sales Person/Presales engineer's ID who created this note"
-#   createdbyname (String) Description : "Name of the Sales person/Presales engineer who created this note"
-#   createdon (Date) Description : "Date on which this note was created"
-#   documentbody (String) Description : "If the note has a document, this field contains the body of the document"
-#   filename (String) Description : "Name of the file added in the note"
-#   filesize (Integer) Description : "Size of the file added in the note"
-#   isdocument (Boolean) Description : "true if the note is a document"
-#   mimetype (String) Description : ""
-#   modifiedon (Date) Description : "Modified date of the note"
-#   notetext (String) Description : "Text in the note"
-#   objectid (Foreign key to multiple tables) Description : "Object on which this note was created on. It can be an email, lead, phone call, contact, account, opportunity, appointment, or task"
-#   overriddencreatedon (Date) Description : "If created on is overridden by the system, this field will contain its date of override"
-#   ownerid (String) Description : "The Sales person/Presales Engineer's ID who created this note"
-#   owneridname (String) Description : "Name of the Sales person/Presales engineer who created this note"
-#   owninguser (String) Description : "Name of the current Sales person/Presales engineer who owns this note"
-#   subject (String) Description : "Subject of the note"
-
-# General Table name: DynamicsShortlisted.dbo.appointment
-# Description: 
-# Columns: 
-#   activityid (Primary Key) Description : "Appointment ID"
-#   actualend (Date) Description : "Actual end datetime of the appointment"
-#   createdby (String) Description : "Sales person/Presales engineer who created the appointment"
-#   createdon (Date) Description : "Date time on which the appointment was created"
-#   description (String) Description : "Description of the appointment"
-#   globalobjectid (String) Description : "Global object ID of the appointment"
-#   location (String) Description : "Location or platform of the appointment"
-#   ownerid (String) Description : "Sales person/Presales engineer who is assigned the appointment"
-#   owninguser (String) Description : "Sales person/Presales engineer who is assigned the appointment"
-#   regardingobjectid (Foreign key to multiple tables) Description : "Account, lead or item for which the appointment is created"
-#   scheduleddurationminutes (Integer) Description : "Scheduled duration in minutes"
-#   scheduledend (Date) Description : "Scheduled end time of the appointment"
-#   scheduledstart (Date) Description : "Scheduled start time of the appointment"
-#   subject (String) Description : "Subject or objective of the appointment"
-#   xt_addteamsmeetinglink (Boolean) Description : "Added teams meeting link or not"
-#   xt_recordinglink (String) Description : "Recording link of the meeting"
-#   xt_teamsmeetingurl (String) Description : "Microsoft teams meeting URL"
-
-General Table name: DynamicsShortlisted.dbo.contact
-Description: 
-Columns: 
-  address1_city (String) Description : "Contact person's city"
-  address1_line1 (String) Description : "Contact person's address"
-  contactid (Primary Key) Description : "ID of the contact person"
-  createdby (String) Description : "Sales person/Presales engineer's ID who created the contact person in system"
-  createdon (Date) Description : "Date time on which the contact record was created in the system"
-  description (String) Description : "Description of the contact person, or notes from the contact person"
-  emailaddress1 (String) Description : "Email address of the contact person"
-  firstname (String) Description : "First name of the contact person"
-  jobtitle (String) Description : "Job title of the contact person"
-  lastname (String) Description : "Last name of the contact person"
-  leadsourcecode (Integer) Description : "Code of the source of this Contact person"
-  mobilephone (String) Description : "Mobile number of the contact person"
-  ownerid (String) Description : "Sales person/Presales engineer's ID who created the contact person in system"
-  owninguser (String) Description : "Sales person/Presales engineer's ID who created the contact person in system"
-  parent_contactid (Foreign key to DynamicsShortlisted.dbo.contact.contactid) Description : "ID of the contact person who refferred this contact person"
-  parentcustomerid (Foreign key to multiple tables) Description : "ID of the customer who's contact person this is"
-  telephone1 (String) Description : "Telephone number of the contact person"
-  xt_adgroup (String) Description : "Add group of the add due to which this contact person signed up"
-  xt_attribution (Integer) Description : ""
-  xt_comments (String) Description : "Comments by the sales person"
-  xt_contactrecordtype (Integer) Description : ""
-  xt_contactsource (Integer) Description : "Source from where this contact person originated"
-  xt_doyouwantthe (Integer) Description : ""
-  xt_hasoptedoutofemail (Boolean) Description : "If the contact has opted out from sending marketing emails, this field will be 1"
-  xt_industry (Integer) Description : "Industry of the contact person"
-  xt_inferredcity (String) Description : "City of the contact person"
-  xt_inferredcountry (String) Description : "Country of the contact person"
-  xt_isemailbounced (Boolean) Description : "True if emails sent to the email address of the contact person have bounced"
-  xt_keywords (String) Description : "Key words used in add to attract this contact"
-  xt_landingpage (String) Description : "Landing page URL of the add campaign"
-  xt_leadsource (Integer) Description : "Source of the contact person's lead"
-  xt_licensekey (String) Description : "License key provided to the contact person for trial or demo"
-  xt_marketingsuspended (Boolean) Description : "If marketing to this customer has been suspended or not"
-  xt_notes (String) Description : "Notes from Sales engineer about the contact person"
-  xt_otherphone (String) Description : "Any other phone number to reach to this contact person"
-  xt_product (String) Description : "Product and tier in which the contact person is interested in"
-  xt_productname (String) Description : "Product and tier in which the contact person is interested in"
-  xt_productnameis (String) Description : "Product name in which the contact person is interested in"
-  xt_referringsite (String) Description : "The site from which the customer navigated to Astera's website"
-  xt_referrred_employee_size (Integer) Description : "Employee size of the contact person's organization"
-  xt_type (Integer) Description : "Type of contact person"
-  xt_unsubscribed (Boolean) Description : "True if contact person has unsubscribed to any sort of communication"
-
-General Table name: DynamicsShortlisted.dbo.email
-Description: 
-Columns: 
-  activityid (Primary Key) Description : "ID of the email"
-  actualend (Date) Description : "End time of the email"
-  correlatedactivityid (Foreign key to DynamicsShortlisted.dbo.email.activityid) Description : "Activity due to which this email was sent, for example it can be a marketing email or a follow-up email"
-  createdby (String) Description : "Sales Person/Presales Engineer who created this email"
-  createdon (Date) Description : "Date time on which the email was created on"
-  description (String) Description : "Description of the email"
-  emailsender (Foreign key to multiple tables) Description : "ID of the sender of the email. It can be a lead, contact or an account"
-  lastopenedtime (Date) Description : "Opened date time of the email"
-  modifiedon (Date) Description : "Modified date time of the email information"
-  opencount (Integer) Description : "Count of how many times email was opened"
-  ownerid (String) Description : "Sales Person/Presales Engineer who created this email"
-  owninguser (String) Description : "Sales Person/Presales Engineer who created this email"
-  parentactivityid (Foreign key to DynamicsShortlisted.dbo.email.activityid) Description : "Activity due to which this email was send, it can be a follow up email to a parent activity"
-  regardingobjectid (Foreign key to multiple tables) Description : "Object ID due to which this email was sent. It can be an account, contact, lead or opportunity"
-  sendermailboxid (String) Description : "Email sender's mail box ID"
-  sendersaccount (Foreign key to DynamicsShortlisted.dbo.account.accountid) Description : "Email sender's account ID"
-  subject (String) Description : "Subject of the email"
-
-General Table name: DynamicsShortlisted.dbo.lead
-Description: 
-Columns: 
-  address1_city (String) Description : "Lead's city"
-  address1_telephone1 (String) Description : "Telephone number of the lead"
-  budgetamount (Decimal) Description : "Lead's budget amount"
-  companyname (String) Description : "Company name of the lead"
-  cr93b_sdr (String) Description : ""
-  createdby (String) Description : "Sales Person/Presales Engineer who created this lead"
-  createdon (Date) Description : "Date time on which this lead was created in the system"
-  emailaddress1 (String) Description : "Email address of the lead"
-  firstname (String) Description : "First name of the lead"
-  jobtitle (String) Description : "Job title of the lead"
-  lastname (String) Description : "Last name of the lead"
-  msdyncrm_industry (String) Description : "Lead's industry"
-  new_businessregion (String) Description : "Business region of the lead"
-  new_ipbusinessregion (String) Description : "Business region IP address of the lead"
-  new_originalsource (String) Description : "Source of the lead"
-  new_outreach (String) Description : "Whether the lead was Inbound, outbound, or refferral"
-  ownerid (String) Description : "Sales Person/Presales Engineer who created this lead"
-  owninguser (String) Description : "Sales Person/Presales Engineer who is assigned this lead"
-  parentaccountid (Foreign key to DynamicsShortlisted.dbo.account.accountid) Description : "Account ID of the lead"
-  parentcontactid (Foreign key to DynamicsShortlisted.dbo.contact.contactid) Description : "Contact person's ID of the lead"
-  subject (String) Description : "The product about which the lead sent the query for"
-  telephone1 (String) Description : "Telephone number of the lead"
-  websiteurl (String) Description : "Website URL of the lead's organization"
-  xt_adcampaign (String) Description : "Add campaign that led to the lead signing up"
-  xt_adgroup (String) Description : "Add group under which the add campaign was placed"
-  xt_comments (String) Description : "Comments on how this lead was captured"
-  xt_countrytext (String) Description : "Country of the lead"
-  xt_description (String) Description : "Description of the lead capture"
-  xt_emailvalidationstatus (String) Description : "Checks if lead's email is a valid email address"
-  xt_falloutdetail (String) Description : "Details about why the lead was rejected or lost"
-  xt_falloutreasons (Integer) Description : "Reasons about why the lead was rejected or lost"
-  xt_firstconversion (String) Description : "First conversion event, article, campaign or video for this lead"
-  xt_firstconversiondate (Date) Description : "First conversion's date time for this lead"
-  xt_firstpageseen (String) Description : "Campaign or website's first pages seen by this lead"
-  xt_firstreferringsite (String) Description : "The first site through which the lead navigated to Astera's Website"
-  xt_industry (Integer) Description : "Industry of the lead"
-  xt_inferredareacode (String) Description : "Area code of the lead"
-  xt_inferredcountry2 (String) Description : "Country of the lead"
-  xt_inferredstateregion (String) Description : "State or region of the lead"
-  xt_ipcountry (String) Description : "Country of the IP address of the lead"
-  xt_lastreferringsite (String) Description : "The site which refferred the lead to navigate to Astera's website"
-  xt_leadproduct (Integer) Description : "Product in which the lead is interested in"
-  xt_leadsource (Integer) Description : "Source of the lead"
-  xt_leadstatus (Integer) Description : "Lead's status"
-  xt_needdetails (String) Description : "Details about the needs of the lead"
-  xt_notes (String) Description : "Notes about the lead's organization"
-  xt_originalsearchengine (String) Description : "Search engine where the lead was browsing"
-  xt_originalsearchphrase (String) Description : "Search Phrase due to which Astera's website URL showed up"
-  xt_originalsource (Integer) Description : "Original source of the lead"
-  xt_originalsourcedrilldown1 (String) Description : "Drill down information of the original source of the lead first part"
-  xt_originalsourcedrilldown2 (String) Description : "Drill down information of the original source of the lead second part"
-  xt_phonecode (Decimal) Description : "Phone code of the lead"
-  xt_primarycontact (String) Description : "Primary contact person name of the lead"
-  xt_primarycontactemail (String) Description : "Primary contact person's email address of the lead"
-  xt_productnameis (Integer) Description : "Product name for which the lead is interested in"
-  xt_referingdomain (String) Description : "Domain of the website which reffered Astera"
-  xt_referingsite (String) Description : "Website of the referrer"
-  xt_status (Integer) Description : "Status of the lead"
-  xt_timeline (Integer) Description : "Timeline qouted by the lead"
-  xt_utm_campaign (String) Description : "Campaign information that led to this lead's signup"
-  xt_utm_content (String) Description : "Content information that lead to this lead's signup"
-  xt_utm_medium (String) Description : "Medium where the add or content was posted"
-  xt_utm_source (String) Description : "Source of the lead"
-  xt_utm_term (String) Description : "Termsincluded in the add campaign"
-  leadid (Primary Key) Description : "Lead ID"
-
-General Table name: DynamicsShortlisted.dbo.opportunity
-Description: 
-Columns: 
-  actualclosedate (Date) Description : "Actual closing date of the opportunity"
-  actualvalue (Decimal) Description : "Actual value of the order placed by the opportunity"
-  budgetamount (Decimal) Description : "Budget amount of the opportunity"
-  cr93b_additionalrenewallicenserevenue (Decimal) Description : "Additional revenue generated by renewing license"
-  cr93b_additionalrenewallicenserevenue_base (Decimal) Description : "Additional revenue generated by renewing license"
-  cr93b_opportunityageindays (Integer) Description : "Days since the opportunity was created"
-  cr93b_productmanagerforthisopportunity (String) Description : "Product manager who is looking after this opportunity. It depends on which product the opportunity is interested in."
-  cr93b_sdr (String) Description : ""
-  createdby (String) Description : "Sales Person/Presales Engineer who created this Opportunity"
-  createdon (Date) Description : "Date time when this opportunity was created in the system"
-  customerneed (String) Description : "Need of the opportunity, or use case notes"
-  description (String) Description : "Query, description or notes on the opportunity"
-  emailaddress (String) Description : "Email address of the opportunity"
-  estimatedclosedate (Date) Description : "Estimated closing date of the opportunity"
-  msdyn_forecastcategory (Integer) Description : "Forecast category"
-  name (String) Description : "Name of the opportunity"
-  new_commentsbypresales (String) Description : "Presales engineer's comments on the opportunity"
-  new_democallrecordinglinks (String) Description : "Demo call recording links"
-  new_demoprovided (Boolean) Description : "True if the demo is provided"
-  new_discoverynotes (String) Description : "Discovery notes for this opportunity"
-  new_dropoutexplanation (String) Description : "Explaination about why the opportunity dropped out"
-  new_dropoutreason (Integer) Description : "Reason about why the opportunity dropped out"
-  new_firstpageseen (String) Description : "The first page displayed to the opportunity"
-  new_forecastedlicenserevenue (Decimal) Description : "Forecasted revenue from opportunity"
-  new_forecastedlicenserevenue_base (Decimal) Description : "Forecasted revenue from opportunity"
-  new_forecastedservicesrevenue (Decimal) Description : "Forecasted revenue from professional services with this opportunity"
-  new_ipcountry (String) Description : "Country of the IP address of the Opportunity"
-  new_lastcallbeforedropout (Integer) Description : "Last call before drop out ID"
-  new_opportunityindustry (Integer) Description : "Industry of the opportunity"
-  new_opportunitysecondaryproduct (Integer) Description : "If more than one products are considered, second product is mentioned here"
-  new_originalsource (String) Description : "Source of this opportunity"
-  new_supportingpressalesengineer (String) Description : "Presales engineer who is supporting or backing up the main presales engineer"
-  opportunityid (Primary Key) Description : "ID of the opportunity"
-  ownerid (String) Description : "Sales Person/Presales Engineer who created this Opportunity"
-  owninguser (String) Description : "Sales Person/Presales Engineer whom this Opportunity is assigned to"
-  parentaccountid (Foreign key to DynamicsShortlisted.dbo.account.accountid) Description : "Account ID for this opportunity"
-  parentcontactid (Foreign key to DynamicsShortlisted.dbo.contact.contactid) Description : "Contact person for this opportunity"
-  purchaseprocess (Integer) Description : "Purchase process for this opportunity"
-  timeline (Integer) Description : "Timeline identified by the opportunity"
-  xt_accounttype (Integer) Description : "Account type of the opportunity"
-  xt_adcampaign (String) Description : "Add campaign that led to this opportunity signing up"
-  xt_adgroup (String) Description : "Add group under which the add was ran to get this opportunity"
-  xt_keywords (String) Description : "keywords used in the add"
-  xt_lead (Foreign key to DynamicsShortlisted.dbo.lead.leadid) Description : "Lead ID of this opportunity"
-  xt_leadsource (Integer) Description : "Lead source for this opportunity"
-  xt_leadstatus (Integer) Description : "Lead status of this opportunity"
-  xt_notes (String) Description : "Notes for this opportunity"
-  xt_poccompleted (Boolean) Description : "Is Proof of concept (POC) complete for this opportunity"
-  xt_pocprovidedby (String) Description : "Presales engineer who provided the POC"
-  xt_productnameis (String) Description : "Product name in which the opportunity is interested in"
-
-General Table name: DynamicsShortlisted.dbo.source
-Description: Source table representing logical name details.
-Columns:
-  LogicalName (String) Description : "The logical name for source is: xt_leadsource"
-  Value (Integer) Description : "The integer value representing the source"
-  Label (String) Description : "The label describing the source value"
-
-General Table name: DynamicsShortlisted.dbo.owner  
-Description: Owner table representing details of system users and their roles.  
-Columns:  
-  fullname (String) Description: "The full name of the owner/sales rep."  
-  ownerid (Integer) Description: "The unique identifier for the owner."  
-
-
-General Table name: DynamicsShortlisted.dbo.dropout_reason
-Description: Dropout Reason table representing logical name details.
-Columns:
-  DropoutReasonID (Integer) Description : "The identifier for the dropout reason"
-  DropoutReason (String) Description : "The dropout reason"
-"""
+router = ModelRouter(make_chat_model)
+
+# Local triage model (python triage_classifier.py train); every LLM triage label is logged to retrain it
+triage_classifier = load_triage_classifier() if TRIAGE_CLASSIFIER_ENABLED else None
+triage_labels = TriageLabelLog()
+
+# Planning mode: "staged" (triage -> schema analysis -> SQL generation) or
+# "fused" (one structured call, falling back to staged on invalid output)
+PLANNING_MODE = os.getenv("PLANNING_MODE", "staged").lower()
+
+# Async pipeline: blocking database work runs on this many threads, shared by all questions
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "8"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="sql-db")
+
+# Optional pre-flight check of the estimated plan (SET SHOWPLAN_XML) before running a query
+cost_gate = CostGate(ShowplanProvider(lambda: DatabaseConnection().raw_connection())) if COST_GATE_ENABLED else None
+
+# Statements currently executing, so they can be cancelled from another thread
+running_statements = StatementRegistry()
+
+# Schema analysis started alongside triage while most recent traffic is DATA_QUESTION
+speculation = SpeculationTracker()
+speculation_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="speculative-analysis")
+_speculative_tasks = set()
+
+# Persistent question -> plan cache, shared by every worker on this host
+query_cache = QueryCache() if QUERY_CACHE_ENABLED else None
+register_counters("query_cache", "Question-to-SQL cache hits, misses, evictions and entries",
+                  lambda: query_cache.stats() if query_cache else {})
+
+# Query results, invalidated per table when its data version changes
+result_cache = ResultCache(lambda sql: DatabaseConnection().execute_scalar(sql)) if RESULT_CACHE_ENABLED else None
+register_counters("result_cache", "Result cache hits, misses, invalidations and memory/disk usage",
+                  lambda: result_cache.stats() if result_cache else {})
+
+# Structured catalog (tables, columns, keys, foreign-key graph) parsed once at import
+CATALOG = load_catalog(DB_SCHEMA)
+
+# Brace-stripped ID comparisons run against indexed normalized key columns where those exist
+id_keys = IdKeyRewriter(CATALOG, lambda: DatabaseConnection().raw_connection()) if SARGABLE_ID_KEYS != "off" else None
+
+# Optional DuckDB copy of the tables; aggregations run there while it is fresh enough
+if LOCAL_REPLICA_ENABLED and not DUCKDB_AVAILABLE:
+    print("LOCAL_REPLICA_ENABLED is set but duckdb is not installed; all queries go to SQL Server")
+replica = LocalReplica(CATALOG, lambda: DatabaseConnection().raw_connection()) if LOCAL_REPLICA_ENABLED and DUCKDB_AVAILABLE else None
+
+def executable_sql(query: str) -> str:
+    """The query as sent to the server, with ID comparisons moved onto key columns"""
+    return id_keys.rewrite(query) if id_keys else query
 
 # Updated triage prompt template
 TRIAGE_PROMPT = """You are a query classifier for a CRM database system. You have access to the following database schema:
@@ -363,8 +134,8 @@ Important: If a question requires analyzing data from the database FIRST (even i
 
 Question: {question}
 
-Return ONLY a valid JSON object in this exact format:
-{{"queryType": "DATA_QUESTION" | "GENERAL_QUESTION" | "OUT_OF_SCOPE"}}"""
+Return ONLY a valid JSON object in this exact format, with your confidence in the label from 0 to 1:
+{{"queryType": "DATA_QUESTION" | "GENERAL_QUESTION" | "OUT_OF_SCOPE", "confidence": 0.0-1.0}}"""
 
 # Update the schema analysis prompt to be more explicit
 SCHEMA_ANALYSIS_PROMPT = """You are a database expert. Analyze if the question can be answered using the available tables and fields.
@@ -446,6 +217,48 @@ User Question: {question}
 Generate only the SQL query without any explanation or markdown. The query should be valid SQL Server syntax.
 """
 
+# Single-call planning prompt combining triage, schema analysis and SQL generation
+FUSED_PLANNING_PROMPT = """You are a query planner for a CRM database running on SQL Server. You have access to the following database schema:
+
+{schema}
+
+In ONE step, classify the question, decide if the schema can answer it, pick the tables and write the SQL.
+
+Question types:
+1. DATA_QUESTION: Requires querying the database, including questions that need data analysis after querying
+2. GENERAL_QUESTION: About CRM concepts that cannot be answered even partially from the database
+3. OUT_OF_SCOPE: Unrelated to CRM or data analysis
+If a question requires analyzing data from the database FIRST, classify it as DATA_QUESTION.
+
+SQL rules (only for answerable DATA_QUESTION):
+1. Only SELECT statements, never INSERT, UPDATE, DELETE or DROP
+2. Use proper table aliases and full table names (DynamicsShortlisted.dbo.<table>)
+3. For ID joins remove curly braces: REPLACE(REPLACE(field_name, '{{', ''), '}}', '')
+4. For "most" or "top" questions show ALL records ordered by the metric unless a limit is asked for
+5. Use COUNT(DISTINCT), CAST AS FLOAT and NULLIF for ratios
+
+Question: {question}
+
+Return ONLY a valid JSON object with EXACTLY this structure:
+{{
+    "queryType": "DATA_QUESTION" | "GENERAL_QUESTION" | "OUT_OF_SCOPE",
+    "isAnswerable": true or false (null unless DATA_QUESTION),
+    "outOfScopeReason": "Reason if not answerable, null otherwise",
+    "relevantTables": [
+        {{
+            "tableName": "Full table name including schema",
+            "fields": ["field1", "field2"],
+            "reason": "Why this table is needed"
+        }}
+    ],
+    "relationships": ["table1.field1 → table2.field2"],
+    "conditions": ["Any WHERE conditions needed"],
+    "query": "SQL query if answerable DATA_QUESTION, null otherwise",
+    "explanation": "Brief explanation of the query"
+}}"""
+
+QUERY_TYPES = ("DATA_QUESTION", "GENERAL_QUESTION", "OUT_OF_SCOPE")
+
 def clean_json_response(response: str) -> str:
     """Clean and validate JSON response from LLM"""
     # Remove code block markers
@@ -462,40 +275,96 @@ def clean_json_response(response: str) -> str:
         print(f"Invalid JSON: {cleaned}")  # Debug print
         raise e
 
+def response_confidence(content: str) -> Optional[float]:
+    """The "confidence" a JSON answer reports for itself, if any"""
+    try:
+        value = json.loads(clean_json_response(content)).get("confidence")
+        return None if value is None else float(value)
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+def get_schema_context(question: str) -> str:
+    """Slice of DB_SCHEMA relevant to the question, within the prompt token budget"""
+    return select_schema_context(question, DB_SCHEMA)
+
+@traced("local_triage")
+def classify_locally(question: str) -> Optional[str]:
+    """The local classifier's query type when it is confident enough, else None"""
+    if triage_classifier is None:
+        return None
+    query_type, confidence = triage_classifier.predict(question)
+    current_span().set(label=query_type, confidence=round(confidence, 4))
+    if confidence < TRIAGE_CLASSIFIER_THRESHOLD:
+        return None
+    record_route("triage", "local")
+    return query_type
+
+@traced("triage")
 def triage_query(question: str) -> str:
     """Determine the type of query"""
-    prompt = TRIAGE_PROMPT.format(schema=DB_SCHEMA, question=question)
-    response = llm.invoke([HumanMessage(content=prompt)])
-    cleaned_response = clean_json_response(response.content)
+    prompt = TRIAGE_PROMPT.format(schema=get_schema_context(question), question=question)
+    query_type = router.invoke("triage", [HumanMessage(content=prompt)], parse_triage_response, response_confidence)
+    triage_labels.record(question, query_type, "triage")
+    return query_type
+
+@traced("triage")
+async def triage_query_async(question: str) -> str:
+    prompt = TRIAGE_PROMPT.format(schema=get_schema_context(question), question=question)
+    query_type = await router.ainvoke("triage", [HumanMessage(content=prompt)], parse_triage_response, response_confidence)
+    triage_labels.record(question, query_type, "triage")
+    return query_type
+
+def parse_triage_response(content: str) -> str:
+    cleaned_response = clean_json_response(content)
     result = json.loads(cleaned_response.strip())
+    if result["queryType"] not in QUERY_TYPES:
+        raise ValueError(f"Invalid queryType: {result['queryType']}")
     return result["queryType"]
 
-def generate_general_response(question: str) -> str:
-    """Generate a response for general CRM questions"""
-    prompt = """You are a CRM expert. Generate a helpful response to this general CRM question. 
+GENERAL_RESPONSE_PROMPT = """You are a CRM expert. Generate a helpful response to this general CRM question. 
     Focus on best practices and industry knowledge. Keep the response concise and practical.
     
     Question: {question}
     """
-    
-    response = llm.invoke([HumanMessage(content=prompt.format(question=question))])
-    return response.content
+
+@traced("general_response")
+def generate_general_response(question: str) -> str:
+    """Generate a response for general CRM questions"""
+    messages = [HumanMessage(content=GENERAL_RESPONSE_PROMPT.format(question=question))]
+    return router.invoke("general_response", messages, lambda content: content)
+
+@traced("general_response")
+async def generate_general_response_async(question: str) -> str:
+    messages = [HumanMessage(content=GENERAL_RESPONSE_PROMPT.format(question=question))]
+    return await router.ainvoke("general_response", messages, lambda content: content)
+
+def generate_general_response_stream(question: str) -> Iterator[str]:
+    """generate_general_response, yielding text as the model produces it"""
+    chunks = stream_llm(router.model("general_response"), GENERAL_RESPONSE_PROMPT.format(question=question), "general_response")
+    return traced_stream("general_response", chunks)
 
 def handle_out_of_scope(question: str) -> str:
     """Handle out of scope questions with a polite response"""
     return ("I apologize, but this question is outside the scope of our CRM system. "
             "I can help you with questions about sales, opportunities, leads, and other CRM-related topics.")
 
+@traced("schema_analysis")
 def analyze_schema(question: str, schema: str) -> tuple[bool, str, dict]:
     """Analyze which tables and fields are needed to answer the question"""
     prompt = SCHEMA_ANALYSIS_PROMPT.format(schema=schema, question=question)
-    response = llm.invoke([HumanMessage(content=prompt)])
-    
+    return router.invoke("schema_analysis", [HumanMessage(content=prompt)], parse_schema_analysis)
+
+@traced("schema_analysis")
+async def analyze_schema_async(question: str, schema: str) -> tuple[bool, str, dict]:
+    prompt = SCHEMA_ANALYSIS_PROMPT.format(schema=schema, question=question)
+    return await router.ainvoke("schema_analysis", [HumanMessage(content=prompt)], parse_schema_analysis)
+
+def parse_schema_analysis(content: str) -> tuple[bool, str, dict]:
     # Debug print
     print("\nSchema Analysis Response:")
-    print(response.content)
+    print(content)
     
-    cleaned_response = clean_json_response(response.content)
+    cleaned_response = clean_json_response(content)
     analysis = json.loads(cleaned_response.strip())
     
     # Verify required fields exist
@@ -521,9 +390,25 @@ def validate_and_clean_sql(query: str) -> str:
     
     return query
 
-def generate_sql_query(question: str, schema_analysis: dict) -> tuple[str, str]:
-    """Generate SQL query based on schema analysis"""
-    prompt = f"""
+def get_join_instructions(schema_analysis: dict) -> str:
+    """Prompt section with the FROM/JOIN clauses planned from the foreign-key graph"""
+    # Joins are computed from the foreign-key graph instead of left to the LLM
+    join_plan = plan_joins_for_analysis(CATALOG, schema_analysis)
+    if not join_plan:
+        return ""
+    join_instructions = (
+        "REQUIRED JOINS: Use exactly these FROM/JOIN clauses and aliases (computed from the schema's "
+        "foreign keys). You may change LEFT JOIN to JOIN when only matching rows are wanted.\n"
+        + join_plan.render()
+    )
+    if join_plan.unreachable:
+        join_instructions += f"\nNo foreign-key path exists to: {', '.join(join_plan.unreachable)}"
+    return join_instructions
+
+def build_sql_generation_prompt(question: str, schema_analysis: dict) -> str:
+    join_instructions = get_join_instructions(schema_analysis)
+    
+    return f"""
     You are an expert SQL query generator for a CRM database. Given a user question, create a syntactically correct SQL Server query.
     
     IMPORTANT: For questions about "most" or "top", show ALL records ordered by the metric unless specifically asked for a limit.
@@ -531,15 +416,17 @@ def generate_sql_query(question: str, schema_analysis: dict) -> tuple[str, str]:
     Example:
     For "Which sales rep generated the most leads?", use:
     SELECT 
-        o.fullname as sales_rep_name,
+        ow.fullname as sales_rep_name,
         COUNT(l.leadid) AS total_leads,
         COUNT(DISTINCT l.leadid) AS unique_leads
     FROM DynamicsShortlisted.dbo.lead l 
-    JOIN DynamicsShortlisted.dbo.owner o 
-        ON REPLACE(REPLACE(l.createdby, '{{', ''), '}}', '') = REPLACE(REPLACE(o.ownerid, '{{', ''), '}}', '')
-    GROUP BY o.fullname
+    JOIN DynamicsShortlisted.dbo.owner ow 
+        ON REPLACE(REPLACE(l.createdby, '{{', ''), '}}', '') = REPLACE(REPLACE(ow.ownerid, '{{', ''), '}}', '')
+    GROUP BY ow.fullname
     ORDER BY total_leads DESC;
 
+    {join_instructions}
+
     Schema Analysis: {json.dumps(schema_analysis, indent=2)}
     Question: {question}
 
@@ -549,13 +436,68 @@ def generate_sql_query(question: str, schema_analysis: dict) -> tuple[str, str]:
         "explanation": "Brief explanation of the query"
     }}
     """
-    
-    response = llm.invoke([HumanMessage(content=prompt)])
-    cleaned_response = clean_json_response(response.content)
-    result = json.loads(cleaned_response)
-    
+
+@traced("sql_generation")
+def generate_sql_query(question: str, schema_analysis: dict) -> tuple[str, str]:
+    """Generate SQL query based on schema analysis"""
+    messages = [HumanMessage(content=build_sql_generation_prompt(question, schema_analysis))]
+    return router.invoke("sql_generation", messages, parse_sql_generation)
+
+@traced("sql_generation")
+async def generate_sql_query_async(question: str, schema_analysis: dict) -> tuple[str, str]:
+    messages = [HumanMessage(content=build_sql_generation_prompt(question, schema_analysis))]
+    return await router.ainvoke("sql_generation", messages, parse_sql_generation)
+
+def parse_sql_generation(content: str) -> tuple[str, str]:
+    result = json.loads(clean_json_response(content))
     return result["query"], result.get("explanation", "")
 
+def build_sql_candidates_prompt(question: str, schema_analysis: dict, k: int) -> str:
+    return f"""
+    You are an expert SQL query generator for a CRM database. Given a user question, create {k} different,
+    syntactically correct SQL Server queries that each answer it. Vary the approach (join types, filters,
+    aggregation or subqueries) so that at least one of them is likely to run correctly.
+    
+    IMPORTANT: For questions about "most" or "top", show ALL records ordered by the metric unless specifically asked for a limit.
+
+    {get_join_instructions(schema_analysis)}
+
+    Schema Analysis: {json.dumps(schema_analysis, indent=2)}
+    Question: {question}
+
+    Return ONLY a valid JSON object with this exact structure, best candidate first:
+    {{
+        "candidates": [
+            {{"query": "SQL QUERY", "explanation": "Brief explanation of the query"}}
+        ]
+    }}
+    """
+
+@traced("sql_generation")
+def generate_sql_candidates(question: str, schema_analysis: dict, k: int = SQL_CANDIDATES) -> List[str]:
+    """Generate k alternative SQL queries for the same question in a single LLM call"""
+    messages = [HumanMessage(content=build_sql_candidates_prompt(question, schema_analysis, k))]
+    return router.invoke("sql_generation", messages, lambda content: parse_sql_candidates(content, k))
+
+@traced("sql_generation")
+async def generate_sql_candidates_async(question: str, schema_analysis: dict, k: int = SQL_CANDIDATES) -> List[str]:
+    messages = [HumanMessage(content=build_sql_candidates_prompt(question, schema_analysis, k))]
+    return await router.ainvoke("sql_generation", messages, lambda content: parse_sql_candidates(content, k))
+
+def parse_sql_candidates(content: str, k: int) -> List[str]:
+    result = json.loads(clean_json_response(content))
+    candidates = []
+    seen = set()
+    for candidate in result.get("candidates") or []:
+        query = candidate.get("query") if isinstance(candidate, dict) else None
+        if isinstance(query, str) and query.strip() and canonicalize_sql(query) not in seen:
+            seen.add(canonicalize_sql(query))
+            candidates.append(query.strip())
+    if not candidates:
+        raise ValueError("SQL candidate generation returned no queries")
+    return candidates[:k]
+
+@traced("sql_regeneration")
 def generate_alternative_query(original_query: str, error_message: str, user_query: str, schema: str) -> str:
     """Generate alternative SQL query based on error message"""
     prompt = SQL_GENERATION_PROMPT.format(
@@ -564,36 +506,118 @@ def generate_alternative_query(original_query: str, error_message: str, user_que
         previous_query=original_query,
         error_message=error_message
     )
-    response = llm.invoke([HumanMessage(content=prompt)])
-    return response.content.strip().strip('`').strip()
+    return router.invoke("sql_regeneration", [HumanMessage(content=prompt)], parse_sql_text)
+
+def parse_sql_text(content: str) -> str:
+    return content.strip().strip('`').strip()
+
+CHEAPER_QUERY_PROMPT = """The following SQL Server query is too expensive ({problem}). Rewrite it so it answers the same
+question with much less work on the database.
+
+Ways to make it cheaper:
+1. Add a TOP clause and a selective WHERE filter (for example a recent date range on createdon)
+2. Remove joins and columns that aren't needed to answer the question
+3. Aggregate before joining large tables, and avoid functions on columns in JOIN/WHERE conditions
+4. Avoid SELECT * and correlated subqueries
+
+Query that timed out:
+{query}
+
+Database Schema:
+{schema}
+
+User Question: {question}
+
+Return only the rewritten SQL query without any explanation or markdown.
+"""
+
+@traced("sql_regeneration")
+def generate_cheaper_query(query: str, user_query: str, schema: str, problem: str) -> str:
+    """Ask for a lighter rewrite of a query that timed out or failed the cost gate"""
+    prompt = CHEAPER_QUERY_PROMPT.format(query=query, question=user_query, schema=schema, problem=problem)
+    return router.invoke("sql_regeneration", [HumanMessage(content=prompt)], parse_sql_text)
+
+@traced("sql_regeneration")
+async def generate_cheaper_query_async(query: str, user_query: str, schema: str, problem: str) -> str:
+    prompt = CHEAPER_QUERY_PROMPT.format(query=query, question=user_query, schema=schema, problem=problem)
+    return await router.ainvoke("sql_regeneration", [HumanMessage(content=prompt)], parse_sql_text)
+
+@traced("sql_regeneration")
+async def generate_alternative_query_async(original_query: str, error_message: str, user_query: str, schema: str) -> str:
+    prompt = SQL_GENERATION_PROMPT.format(
+        schema=schema,
+        question=user_query,
+        previous_query=original_query,
+        error_message=error_message
+    )
+    return await router.ainvoke("sql_regeneration", [HumanMessage(content=prompt)], parse_sql_text)
 
-def execute_with_retry(query: str, user_query: str, schema: str, max_attempts: int = 3) -> Tuple[bool, Optional[pd.DataFrame], str]:
-    """Execute query with intelligent retry logic"""
+def execute_with_retry(query: str, user_query: str, schema: str, max_attempts: int = 3) -> Tuple[bool, Optional[pd.DataFrame], str, str]:
+    """Execute query with intelligent retry logic, returning the query that finally succeeded"""
     db = DatabaseConnection()
     attempt = 0
     current_query = query
     last_error = ""
+    repaired_locally = False
+    trace = current_span()
     
     while attempt < max_attempts:
+        too_expensive = False
+        if trace:
+            trace.set(retries=attempt)
         try:
             print(f"\nAttempt {attempt + 1} - Executing query:")
             print(current_query)
             
-            df = db.execute_query(current_query)
+            with span("execute", attempt=attempt + 1, retries=attempt) as attempt_span:
+                # Unknown tables/columns and write statements fail here, without a DB round-trip
+                check_sql(current_query, CATALOG)
+                # Aggregations over recently synced tables are answered locally
+                df = replica.query(current_query) if replica else None
+                if df is None or df.empty:
+                    attempt_span.set(source="server")
+                    # Cross joins and huge scans are caught from the estimated plan, unless cached
+                    df = db.execute_query(current_query, check_cost=True)
+                else:
+                    attempt_span.set(source="replica")
+                attempt_span.set(rows=0 if df is None else len(df))
             
             # Verify results make sense
             if df is not None and not df.empty:
-                return True, df, "Success"
+                if repaired_locally:
+                    # A rule-based fix succeeded where an LLM regeneration would have been needed
+                    record_repair("llm_retries_saved")
+                return True, df, "Success", current_query
             else:
                 last_error = "Query returned no results"
                 
+        except QueryCancelledError as e:
+            return False, None, str(e), current_query
+        except (QueryTimeoutError, QueryTooExpensiveError) as e:
+            last_error = str(e)
+            too_expensive = True
+            print(f"Error: {last_error}")
         except Exception as e:
             last_error = str(e)
             print(f"Error: {last_error}")
             
         # Generate alternative query based on error
         attempt += 1
-        if attempt < max_attempts:
+        if attempt < max_attempts and too_expensive:
+            # Regenerating blindly tends to produce an equally slow query; ask for a cheaper one
+            record_repair("cheaper_rewrites")
+            print(f"\nGenerating a cheaper query...")
+            current_query = generate_cheaper_query(current_query, user_query, schema, last_error)
+            repaired_locally = False
+        elif attempt < max_attempts:
+            # Cheap deterministic fixes first; the LLM only when no rule applies
+            repair = repair_sql(current_query, last_error, CATALOG)
+            repaired_locally = repair is not None
+            if repair:
+                print(f"\nApplied local repair rules: {', '.join(repair.rules)}")
+                current_query = repair.sql
+                continue
+            record_repair("llm_fallbacks")
             print(f"\nGenerating alternative query based on error...")
             current_query = generate_alternative_query(
                 original_query=current_query,
@@ -603,20 +627,93 @@ def execute_with_retry(query: str, user_query: str, schema: str, max_attempts: i
             )
             continue
     
-    return False, None, f"Failed after {max_attempts} attempts. Last error: {last_error}"
+    return False, None, f"Failed after {max_attempts} attempts. Last error: {last_error}", current_query
 
-def generate_data_response(df: pd.DataFrame, user_query: str) -> str:
-    """Generate a direct answer to the user's question using query results"""
-    # Limit the data to top 20 rows to avoid context length issues
-    sample_data = df.head(20).to_dict('records')
+@traced("execute_candidates")
+def race_candidates(candidates: List[str]) -> Tuple[Optional[str], Optional[pd.DataFrame], str]:
+    """Run locally valid candidates in parallel; returns (winning query, its rows, query to retry from)"""
+    runnable = []
+    for query in candidates:
+        errors = validate_sql(query, CATALOG)
+        if errors:
+            repair = repair_sql(query, "; ".join(errors), CATALOG)
+            if repair is None or validate_sql(repair.sql, CATALOG):
+                print(f"\nDropping invalid candidate: {'; '.join(errors)}")
+                continue
+            query = repair.sql
+        if any(canonicalize_sql(query) == canonicalize_sql(other) for other in runnable):
+            continue
+        runnable.append(query)
+
+    if not runnable:
+        return None, None, candidates[0]
+
+    versions = {}
+    if result_cache:
+        for query in runnable:
+            cached, versions[query] = result_cache.get(query)
+            if cached is not None and not cached.empty:
+                print("Result cache hit")
+                return query, cached, query
+
+    # Only queries that will actually run pay for an estimated plan
+    affordable = []
+    for query in runnable:
+        decision = cost_gate.check(executable_sql(query)) if cost_gate else None
+        if decision and not decision.allowed:
+            print(f"\nDropping expensive candidate: {decision.reason}")
+            continue
+        affordable.append(query)
+    if not affordable:
+        return None, None, runnable[0]
+    runnable = affordable
+
+    db = DatabaseConnection()
+    if not db.connect():
+        return None, None, runnable[0]
+
+    def run_candidate(query: str, token: str) -> Optional[pd.DataFrame]:
+        # Same path as a single query: replica first, then the server with its statement timeout
+        df = replica.query(query) if replica else None
+        if df is None or df.empty:
+            df = db.execute_query(query, use_cache=False, token=token)
+        return df
+
+    print(f"\nExecuting {len(runnable)} candidate queries in parallel")
+    ranked = CandidateRunner(run_candidate, running_statements).run(runnable)
+    for result in ranked:
+        result.query = runnable[result.index]
+        status = "ok" if result.succeeded else (result.error or "no rows")
+        print(f"Candidate {result.index + 1}: {result.elapsed:.2f}s, agreement {result.agreement}, {status}")
+
+    best = ranked[0] if ranked else None
+    current_span().set(candidates=len(runnable), rows=len(best.df) if best and best.succeeded else 0)
+    if best and best.succeeded:
+        if result_cache:
+            result_cache.put(best.query, best.df, versions.get(best.query))
+        return best.query, best.df, best.query
+    # Every candidate failed: repair/regenerate starting from the best-ranked one
+    return None, None, best.query if best else runnable[0]
+
+def execute_candidates(candidates: List[str], user_query: str, schema: str) -> Tuple[bool, Optional[pd.DataFrame], str, str]:
+    """Race locally valid candidates on pooled connections; fall back to execute_with_retry"""
+    winner, df, retry_query = race_candidates(candidates)
+    if winner:
+        return True, df, "Success", winner
+    return execute_with_retry(retry_query, user_query, schema, max_attempts=3)
+
+def build_data_response_prompt(df: pd.DataFrame, user_query: str) -> str:
+    # Whole result when small, otherwise column statistics and a stratified sample, within a token budget
+    results = profile_frame(df)
     
-    prompt = f"""
+    return f"""
     You are the AskAstera assistant, a database expert that explains query results in clear, natural language.
     Provide a concise answer that directly addresses the user's question based on the query results.
+    If the results are summarized (column profile plus sample rows), take counts and totals from the summary, not the sample.
 
     User Question: {user_query}
-    Total Records Found: {len(df)}
-    Sample Data: {sample_data}
+    Query Results:
+    {results}
     
     Respond in JSON format matching this schema:
     {{
@@ -624,15 +721,28 @@ def generate_data_response(df: pd.DataFrame, user_query: str) -> str:
         "answer": "string"
     }}
     """
-    
-    response = llm.invoke([HumanMessage(content=prompt)])
-    cleaned_response = clean_json_response(response.content)
-    result = json.loads(cleaned_response)
-    return result["answer"]
 
-def validate_answer(question: str, answer: str) -> tuple[bool, str]:
-    """Validate if the answer is reasonable for the given question"""
-    prompt = f"""
+@traced("answer_generation")
+def generate_data_response(df: pd.DataFrame, user_query: str) -> str:
+    """Generate a direct answer to the user's question using query results"""
+    messages = [HumanMessage(content=build_data_response_prompt(df, user_query))]
+    return router.invoke("answer_generation", messages, parse_data_response)
+
+@traced("answer_generation")
+async def generate_data_response_async(df: pd.DataFrame, user_query: str) -> str:
+    messages = [HumanMessage(content=build_data_response_prompt(df, user_query))]
+    return await router.ainvoke("answer_generation", messages, parse_data_response)
+
+def parse_data_response(content: str) -> str:
+    return json.loads(clean_json_response(content))["answer"]
+
+def generate_data_response_stream(df: pd.DataFrame, user_query: str) -> Iterator[str]:
+    """generate_data_response, yielding the "answer" field before the JSON object is complete"""
+    chunks = stream_llm(router.model("answer_generation"), build_data_response_prompt(df, user_query), "data_response")
+    return traced_stream("answer_generation", stream_json_field(chunks, "answer", fallback=lambda text: text.strip()))
+
+def build_answer_validation_prompt(question: str, answer: str) -> str:
+    return f"""
     You are the final step of a data analysis pipeline - a final quality check if you will.
     Determine if the provided answer is reasonable for the given question.
     Most of the time, the answer will be adequate - even if the contents are fictional or made up.
@@ -645,57 +755,305 @@ def validate_answer(question: str, answer: str) -> tuple[bool, str]:
     {{
         "isValid": true/false,
         "reason": "string explaining why the answer is valid or invalid",
-        "suggestedFix": "string with suggestion if invalid, null if valid"
+        "suggestedFix": "string with suggestion if invalid, null if valid",
+        "confidence": number from 0 to 1, how sure you are of isValid
     }}
     """
-    
-    response = llm.invoke([HumanMessage(content=prompt)])
-    result = json.loads(clean_json_response(response.content))
-    
+
+@traced("validation")
+def validate_answer(question: str, answer: str) -> tuple[bool, str]:
+    """Validate if the answer is reasonable for the given question"""
+    messages = [HumanMessage(content=build_answer_validation_prompt(question, answer))]
+    return router.invoke("validation", messages, parse_answer_validation, response_confidence)
+
+@traced("validation")
+async def validate_answer_async(question: str, answer: str) -> tuple[bool, str]:
+    messages = [HumanMessage(content=build_answer_validation_prompt(question, answer))]
+    return await router.ainvoke("validation", messages, parse_answer_validation, response_confidence)
+
+def parse_answer_validation(content: str) -> tuple[bool, str]:
+    result = json.loads(clean_json_response(content))
+    if not isinstance(result["isValid"], bool):
+        raise ValueError("Answer validation missing boolean 'isValid'")
     return result["isValid"], result.get("reason", ""), result.get("suggestedFix")
 
-def process_query(user_query: str) -> tuple[str, Optional[pd.DataFrame], str]:
-    """Process a user query through the complete pipeline"""
+def validate_fused_plan(plan: dict) -> None:
+    """Raise ValueError if a fused planning response is not usable as-is"""
+    if plan.get("queryType") not in QUERY_TYPES:
+        raise ValueError(f"Invalid queryType: {plan.get('queryType')}")
+    if plan["queryType"] != "DATA_QUESTION":
+        return
+    if not isinstance(plan.get("isAnswerable"), bool):
+        raise ValueError("Fused plan missing boolean 'isAnswerable'")
+    if not plan["isAnswerable"]:
+        return
+    if not isinstance(plan.get("relevantTables"), list) or not plan["relevantTables"]:
+        raise ValueError("Fused plan has no relevantTables")
+    query = plan.get("query")
+    if not isinstance(query, str) or not re.match(r'\s*(SELECT|WITH)\b', query, re.IGNORECASE):
+        raise ValueError("Fused plan query must be a SELECT statement")
+
+@traced("fused_plan")
+def plan_query_fused(question: str) -> dict:
+    """Classify, analyze and generate SQL for a question in a single LLM call"""
+    prompt = FUSED_PLANNING_PROMPT.format(schema=get_schema_context(question), question=question)
+    plan = router.invoke("fused_plan", [HumanMessage(content=prompt)], parse_fused_plan)
+    triage_labels.record(question, plan["query_type"], "fused_plan")
+    return plan
+
+@traced("fused_plan")
+async def plan_query_fused_async(question: str) -> dict:
+    prompt = FUSED_PLANNING_PROMPT.format(schema=get_schema_context(question), question=question)
+    plan = await router.ainvoke("fused_plan", [HumanMessage(content=prompt)], parse_fused_plan)
+    triage_labels.record(question, plan["query_type"], "fused_plan")
+    return plan
+
+def parse_fused_plan(content: str) -> dict:
+    plan = json.loads(clean_json_response(content))
+    validate_fused_plan(plan)
+
+    schema_analysis = None
+    if plan["queryType"] == "DATA_QUESTION":
+        schema_analysis = {
+            "isAnswerable": plan["isAnswerable"],
+            "outOfScopeReason": plan.get("outOfScopeReason"),
+            "relevantTables": plan.get("relevantTables") or [],
+            "relationships": plan.get("relationships") or [],
+            "conditions": plan.get("conditions") or [],
+        }
+    return {
+        "query_type": plan["queryType"],
+        "schema_analysis": schema_analysis,
+        "sql_query": plan.get("query") if schema_analysis and schema_analysis["isAnswerable"] else None,
+        "planning_mode": "fused",
+    }
+
+def timed_analysis(question: str) -> tuple:
+    """analyze_schema plus its latency, tokens and cost, for speculative runs"""
+    with get_openai_callback() as cb:
+        start = time.perf_counter()
+        result = analyze_schema(question, get_schema_context(question))
+        elapsed = time.perf_counter() - start
+    return result, elapsed, cb.total_tokens, cb.total_cost
+
+async def timed_analysis_async(question: str) -> tuple:
+    with get_openai_callback() as cb:
+        start = time.perf_counter()
+        result = await analyze_schema_async(question, get_schema_context(question))
+        elapsed = time.perf_counter() - start
+    return result, elapsed, cb.total_tokens, cb.total_cost
+
+def record_wasted_analysis(future):
+    """Done-callback for a speculative analysis that triage made unnecessary"""
+    if not future.cancelled() and future.exception() is None:
+        _, _, tokens, cost = future.result()
+        speculation.record_waste(tokens, cost)
+
+def use_speculative_analysis(speculative, triage_seconds: float) -> Optional[tuple]:
+    """Result of a finished speculative analysis, or None to run it normally"""
+    try:
+        result, analysis_seconds, _, _ = speculative.result()
+        speculation.record_hit(triage_seconds, analysis_seconds)
+        return result
+    except Exception as e:
+        print(f"\nSpeculative schema analysis failed, rerunning: {str(e)}")
+        return None
+
+def plan_query_staged(question: str) -> dict:
+    """Plan a question with separate triage, schema analysis and SQL generation calls"""
+    local_type = classify_locally(question)
+    # Schema analysis doesn't depend on triage, so start it first when it usually pays off
+    # (not when the local classifier already answered triage)
+    speculate = local_type is None and speculation.should_speculate()
+    speculative = speculation_executor.submit(in_context(timed_analysis), question) if speculate else None
+    start = time.perf_counter()
+    try:
+        query_type = local_type or triage_query(question)
+    except Exception:
+        if speculative:
+            speculative.cancel()
+        raise
+    plan = {"query_type": query_type, "schema_analysis": None, "sql_query": None, "planning_mode": "staged"}
+    triage_seconds = time.perf_counter() - start
+    speculation.record_triage(plan["query_type"])
+    if plan["query_type"] != "DATA_QUESTION":
+        if speculative:
+            speculation.record_miss()
+            speculative.add_done_callback(record_wasted_analysis)
+        return plan
+
+    analysis = use_speculative_analysis(speculative, triage_seconds) if speculative else None
+    is_answerable, _, plan["schema_analysis"] = analysis or analyze_schema(question, get_schema_context(question))
+    if is_answerable and SQL_CANDIDATES > 1:
+        plan["sql_candidates"] = generate_sql_candidates(question, plan["schema_analysis"])
+        plan["sql_query"] = plan["sql_candidates"][0]
+    elif is_answerable:
+        plan["sql_query"], _ = generate_sql_query(question, plan["schema_analysis"])
+    return plan
+
+def plan_query(question: str, planning_mode: str = PLANNING_MODE) -> dict:
+    """Produce the query type, schema analysis and SQL for a question"""
+    if planning_mode == "fused":
+        try:
+            return plan_query_fused(question)
+        except Exception as e:
+            print(f"\nFused planning failed validation, falling back to staged: {str(e)}")
+            plan = plan_query_staged(question)
+            plan["planning_mode"] = "staged_fallback"
+            return plan
+    return plan_query_staged(question)
+
+@traced("follow_up")
+def plan_follow_up(question: str, conversation: Conversation) -> Optional[FollowUp]:
+    """Steps that turn a cached result into the answer, or None when the question needs a new query"""
+    follow_up = match_follow_up(question, conversation)
+    if follow_up is None and needs_planner(question, conversation):
+        messages = [HumanMessage(content=build_follow_up_prompt(question, conversation))]
+        follow_up = router.invoke("follow_up", messages, lambda content: parse_follow_up_plan(content, conversation))
+    if follow_up:
+        current_span().set(planner=follow_up.planner, steps=describe_steps(follow_up.steps))
+    return follow_up
+
+@traced("follow_up")
+async def plan_follow_up_async(question: str, conversation: Conversation) -> Optional[FollowUp]:
+    follow_up = match_follow_up(question, conversation)
+    if follow_up is None and needs_planner(question, conversation):
+        messages = [HumanMessage(content=build_follow_up_prompt(question, conversation))]
+        follow_up = await router.ainvoke("follow_up", messages, lambda content: parse_follow_up_plan(content, conversation))
+    if follow_up:
+        current_span().set(planner=follow_up.planner, steps=describe_steps(follow_up.steps))
+    return follow_up
+
+def run_cached_follow_up(follow_up: Optional[FollowUp], user_query: str, conversation: Conversation) -> Optional[pd.DataFrame]:
+    """The follow-up's rows computed from the cached frame, or None to answer it with a new query"""
+    if follow_up is None:
+        return None
+    try:
+        results = run_follow_up(follow_up, user_query, conversation)
+    except ValueError as e:
+        print(f"\nFollow-up doesn't fit the cached result, running a new query: {str(e)}")
+        return None
+    print(f"\nAnswered from the cached result of: {follow_up.source.question}")
+    print(describe_steps(follow_up.steps))
+    current_span().set(follow_up=follow_up.planner)
+    return results
+
+def process_query(user_query: str, planning_mode: str = PLANNING_MODE,
+                  conversation: Optional[Conversation] = None,
+                  on_text: Optional[Callable[[str], None]] = None) -> tuple[str, Optional[pd.DataFrame], str]:
+    """Process a user query through the complete pipeline; with a conversation, follow-ups can reuse earlier results.
+
+    With on_text, the general or data answer is streamed to it as the model writes it; the
+    returned response is the final one (it differs when validation asked for a revision).
+    """
+    with span("question", planning_mode=planning_mode) as question:
+        response, results, query_type = _process_query(user_query, planning_mode, conversation, on_text)
+        question.set(query_type=query_type, rows=None if results is None else len(results))
+        return response, results, query_type
+
+def stream_to(chunks: Iterator[str], on_text: Callable[[str], None]) -> str:
+    """Pass each chunk to on_text as it arrives; returns the whole text"""
+    parts = []
+    for chunk in chunks:
+        on_text(chunk)
+        parts.append(chunk)
+    return "".join(parts)
+
+def answer_general(question: str, on_text: Optional[Callable[[str], None]] = None) -> str:
+    if on_text is None:
+        return generate_general_response(question)
+    return stream_to(generate_general_response_stream(question), on_text)
+
+def answer_data(results: pd.DataFrame, question: str, on_text: Optional[Callable[[str], None]] = None) -> str:
+    if on_text is None:
+        return generate_data_response(results, question)
+    return stream_to(generate_data_response_stream(results, question), on_text)
+
+def _process_query(user_query: str, planning_mode: str, conversation: Optional[Conversation] = None,
+                   on_text: Optional[Callable[[str], None]] = None) -> tuple[str, Optional[pd.DataFrame], str]:
     try:
-        # Step 1: Initial Triage
-        query_type = triage_query(user_query)
+        # Step 0: A follow-up that only sorts, filters or regroups an earlier result runs on the cached frame
+        if conversation is not None and FOLLOW_UP_ENABLED:
+            try:
+                follow_up = plan_follow_up(user_query, conversation)
+            except Exception as e:
+                print(f"\nFollow-up planning failed, running a new query: {str(e)}")
+                follow_up = None
+            results = run_cached_follow_up(follow_up, user_query, conversation)
+            if results is not None:
+                if results.empty:
+                    return "No data found for your query.", None, "DATA_QUESTION"
+                return answer_data(results, user_query, on_text), results, "DATA_QUESTION"
+
+        # Repeat questions skip triage, schema analysis and SQL generation
+        cached = query_cache.get(user_query, DB_SCHEMA) if query_cache else None
+        current_span().set(query_cache_hit=bool(cached))
+        if cached:
+            print(f"\nQuery cache hit ({cached['query_type']})")
+
+        # Step 1: Plan the question (triage, schema analysis, SQL) unless cached
+        plan = cached or plan_query(user_query, planning_mode)
+        query_type = plan["query_type"]
         print(f"\nTriage Result: {query_type}")
         
         # Handle non-data questions
         if query_type == "GENERAL_QUESTION":
-            return generate_general_response(user_query), None, "GENERAL_QUESTION"
+            if query_cache and not cached:
+                query_cache.put(user_query, DB_SCHEMA, query_type)
+            return answer_general(user_query, on_text), None, "GENERAL_QUESTION"
         
         if query_type == "OUT_OF_SCOPE":
+            if query_cache and not cached:
+                query_cache.put(user_query, DB_SCHEMA, query_type)
             return handle_out_of_scope(user_query), None, "OUT_OF_SCOPE"
         
         # Step 2: Schema Analysis for Data Questions
         try:
-            is_answerable, out_of_scope_reason, schema_analysis = analyze_schema(user_query, DB_SCHEMA)
+            schema_analysis = plan["schema_analysis"]
+            is_answerable = schema_analysis.get("isAnswerable", True)
+            out_of_scope_reason = schema_analysis.get("outOfScopeReason")
             
             if not is_answerable:
+                if query_cache and not cached:
+                    query_cache.put(user_query, DB_SCHEMA, query_type, schema_analysis)
                 return f"This question cannot be answered using the available data: {out_of_scope_reason}", None, "OUT_OF_SCOPE"
             
-            # Step 3: Generate initial SQL Query
-            sql_query, _ = generate_sql_query(user_query, schema_analysis)
-            print("\nInitial SQL Query:")
+            # Step 3: Initial SQL Query from the plan
+            sql_query = plan["sql_query"]
+            print("\nCached SQL Query:" if cached else "\nInitial SQL Query:")
             print(sql_query)
             
-            # Step 4: Execute Query with intelligent retry
-            success, results, message = execute_with_retry(
-                query=sql_query,
-                user_query=user_query,
-                schema=DB_SCHEMA,
-                max_attempts=3
-            )
+            # Step 4: Execute Query with intelligent retry (racing candidates when there are several)
+            candidates = plan.get("sql_candidates") or []
+            if len(candidates) > 1:
+                success, results, message, final_query = execute_candidates(
+                    candidates, user_query, get_schema_context(user_query)
+                )
+            else:
+                success, results, message, final_query = execute_with_retry(
+                    query=sql_query,
+                    user_query=user_query,
+                    schema=get_schema_context(user_query),
+                    max_attempts=3
+                )
+            current_span().set(sql=final_query)
             
             if not success:
+                if query_cache and cached:
+                    query_cache.invalidate(user_query, DB_SCHEMA)
                 return f"Failed to execute query: {message}", None, "ERROR"
             
+            # Only SQL that actually ran successfully is worth caching
+            if query_cache and final_query != (cached or {}).get("sql_query"):
+                query_cache.put(user_query, DB_SCHEMA, query_type, schema_analysis, final_query)
+            
             if results is None or results.empty:
                 return "No data found for your query.", None, "DATA_QUESTION"
+            if conversation is not None:
+                conversation.remember(user_query, final_query, results)
                 
             # Generate initial response
-            response = generate_data_response(results, user_query)
+            response = answer_data(results, user_query, on_text)
             
             # Validate the response
             print("\n🔍 Generated Initial Response:")
@@ -723,58 +1081,349 @@ def process_query(user_query: str) -> tuple[str, Optional[pd.DataFrame], str]:
     except Exception as e:
         return f"Error processing query: {str(e)}", None, "ERROR"
 
+async def run_db(func, *args):
+    """Run blocking database work on the bounded executor"""
+    loop = asyncio.get_running_loop()
+    # Copy the context so spans opened on the executor join the caller's trace
+    return await loop.run_in_executor(db_executor, in_context(func), *args)
+
+async def plan_query_staged_async(question: str) -> dict:
+    local_type = classify_locally(question)
+    speculate = local_type is None and speculation.should_speculate()
+    speculative = asyncio.create_task(timed_analysis_async(question)) if speculate else None
+    start = time.perf_counter()
+    try:
+        query_type = local_type or await triage_query_async(question)
+    except Exception:
+        if speculative:
+            speculative.cancel()
+        raise
+    plan = {"query_type": query_type, "schema_analysis": None, "sql_query": None, "planning_mode": "staged"}
+    triage_seconds = time.perf_counter() - start
+    speculation.record_triage(plan["query_type"])
+    if plan["query_type"] != "DATA_QUESTION":
+        if speculative:
+            speculation.record_miss()
+            # Let it finish in the background so its tokens are accounted for
+            _speculative_tasks.add(speculative)
+            speculative.add_done_callback(_speculative_tasks.discard)
+            speculative.add_done_callback(record_wasted_analysis)
+        return plan
+
+    analysis = None
+    if speculative:
+        await asyncio.wait([speculative])
+        analysis = use_speculative_analysis(speculative, triage_seconds)
+    is_answerable, _, plan["schema_analysis"] = analysis or await analyze_schema_async(question, get_schema_context(question))
+    if is_answerable and SQL_CANDIDATES > 1:
+        plan["sql_candidates"] = await generate_sql_candidates_async(question, plan["schema_analysis"])
+        plan["sql_query"] = plan["sql_candidates"][0]
+    elif is_answerable:
+        plan["sql_query"], _ = await generate_sql_query_async(question, plan["schema_analysis"])
+    return plan
+
+async def plan_query_async(question: str, planning_mode: str = PLANNING_MODE) -> dict:
+    if planning_mode == "fused":
+        try:
+            return await plan_query_fused_async(question)
+        except Exception as e:
+            print(f"\nFused planning failed validation, falling back to staged: {str(e)}")
+            plan = await plan_query_staged_async(question)
+            plan["planning_mode"] = "staged_fallback"
+            return plan
+    return await plan_query_staged_async(question)
+
+async def execute_with_retry_async(query: str, user_query: str, schema: str, max_attempts: int = 3) -> Tuple[bool, Optional[pd.DataFrame], str, str]:
+    """execute_with_retry with the query on the database executor and regeneration on the async client"""
+    db = DatabaseConnection()
+    attempt = 0
+    current_query = query
+    last_error = ""
+    repaired_locally = False
+    trace = current_span()
+    
+    while attempt < max_attempts:
+        too_expensive = False
+        if trace:
+            trace.set(retries=attempt)
+        try:
+            with span("execute", attempt=attempt + 1, retries=attempt) as attempt_span:
+                check_sql(current_query, CATALOG)
+                df = await run_db(replica.query, current_query) if replica else None
+                if df is None or df.empty:
+                    attempt_span.set(source="server")
+                    df = await run_db(lambda: db.execute_query(current_query, check_cost=True))
+                else:
+                    attempt_span.set(source="replica")
+                attempt_span.set(rows=0 if df is None else len(df))
+            if df is not None and not df.empty:
+                if repaired_locally:
+                    record_repair("llm_retries_saved")
+                return True, df, "Success", current_query
+            last_error = "Query returned no results"
+        except QueryCancelledError as e:
+            return False, None, str(e), current_query
+        except (QueryTimeoutError, QueryTooExpensiveError) as e:
+            last_error = str(e)
+            too_expensive = True
+        except Exception as e:
+            last_error = str(e)
+            print(f"Error: {last_error}")
+        
+        attempt += 1
+        if attempt < max_attempts and too_expensive:
+            record_repair("cheaper_rewrites")
+            current_query = await generate_cheaper_query_async(current_query, user_query, schema, last_error)
+            repaired_locally = False
+        elif attempt < max_attempts:
+            repair = repair_sql(current_query, last_error, CATALOG)
+            repaired_locally = repair is not None
+            if repair:
+                current_query = repair.sql
+                continue
+            record_repair("llm_fallbacks")
+            current_query = await generate_alternative_query_async(current_query, last_error, user_query, schema)
+    
+    return False, None, f"Failed after {max_attempts} attempts. Last error: {last_error}", current_query
+
+async def process_query_async(user_query: str, planning_mode: str = PLANNING_MODE,
+                              conversation: Optional[Conversation] = None) -> tuple[str, Optional[pd.DataFrame], str]:
+    """Async process_query: LLM calls on the async client, database work on the bounded executor"""
+    with span("question", planning_mode=planning_mode) as question:
+        response, results, query_type = await _process_query_async(user_query, planning_mode, conversation)
+        question.set(query_type=query_type, rows=None if results is None else len(results))
+        return response, results, query_type
+
+async def _process_query_async(user_query: str, planning_mode: str, conversation: Optional[Conversation] = None) -> tuple[str, Optional[pd.DataFrame], str]:
+    try:
+        if conversation is not None and FOLLOW_UP_ENABLED:
+            try:
+                follow_up = await plan_follow_up_async(user_query, conversation)
+            except Exception as e:
+                print(f"\nFollow-up planning failed, running a new query: {str(e)}")
+                follow_up = None
+            results = run_cached_follow_up(follow_up, user_query, conversation)
+            if results is not None:
+                if results.empty:
+                    return "No data found for your query.", None, "DATA_QUESTION"
+                return await generate_data_response_async(results, user_query), results, "DATA_QUESTION"
+
+        cached = query_cache.get(user_query, DB_SCHEMA) if query_cache else None
+        current_span().set(query_cache_hit=bool(cached))
+        plan = cached or await plan_query_async(user_query, planning_mode)
+        query_type = plan["query_type"]
+        
+        if query_type == "GENERAL_QUESTION":
+            if query_cache and not cached:
+                query_cache.put(user_query, DB_SCHEMA, query_type)
+            return await generate_general_response_async(user_query), None, "GENERAL_QUESTION"
+        
+        if query_type == "OUT_OF_SCOPE":
+            if query_cache and not cached:
+                query_cache.put(user_query, DB_SCHEMA, query_type)
+            return handle_out_of_scope(user_query), None, "OUT_OF_SCOPE"
+        
+        schema_analysis = plan["schema_analysis"]
+        if not schema_analysis.get("isAnswerable", True):
+            if query_cache and not cached:
+                query_cache.put(user_query, DB_SCHEMA, query_type, schema_analysis)
+            return f"This question cannot be answered using the available data: {schema_analysis.get('outOfScopeReason')}", None, "OUT_OF_SCOPE"
+        
+        schema = get_schema_context(user_query)
+        candidates = plan.get("sql_candidates") or []
+        if len(candidates) > 1:
+            winner, results, retry_query = await run_db(race_candidates, candidates)
+            if winner:
+                success, message, final_query = True, "Success", winner
+            else:
+                success, results, message, final_query = await execute_with_retry_async(retry_query, user_query, schema)
+        else:
+            success, results, message, final_query = await execute_with_retry_async(plan["sql_query"], user_query, schema)
+        current_span().set(sql=final_query)
+        
+        if not success:
+            if query_cache and cached:
+                query_cache.invalidate(user_query, DB_SCHEMA)
+            return f"Failed to execute query: {message}", None, "ERROR"
+        
+        if query_cache and final_query != (cached or {}).get("sql_query"):
+            query_cache.put(user_query, DB_SCHEMA, query_type, schema_analysis, final_query)
+        if conversation is not None:
+            conversation.remember(user_query, final_query, results)
+        
+        response = await generate_data_response_async(results, user_query)
+        is_valid, reason, suggested_fix = await validate_answer_async(user_query, response)
+        if not is_valid and suggested_fix:
+            response = await generate_data_response_async(results, user_query + " " + suggested_fix)
+        return response, results, "DATA_QUESTION"
+    
+    except Exception as e:
+        return f"Error processing query: {str(e)}", None, "ERROR"
+
+async def process_many(questions: List[str], concurrency: int = BATCH_CONCURRENCY,
+                       planning_mode: str = PLANNING_MODE) -> List[tuple[str, Optional[pd.DataFrame], str]]:
+    """Process questions concurrently; results keep the input order and one failure never affects the others"""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    
+    async def run_one(question: str):
+        async with semaphore:
+            try:
+                return await process_query_async(question, planning_mode)
+            except Exception as e:
+                return f"Error processing query: {str(e)}", None, "ERROR"
+    
+    return list(await asyncio.gather(*(run_one(question) for question in questions)))
+
 class DatabaseConnection:
     def __init__(self):
         self.server = os.getenv("SQL_SERVER")
         self.database = os.getenv("SQL_DATABASE")
         self.username = os.getenv("SQL_USERNAME")
         self.password = os.getenv("SQL_PASSWORD")
+        self.pool = None
         self.engine = None
         
+    def connection_string(self) -> str:
+        return (
+            f'DRIVER={{ODBC Driver 17 for SQL Server}};'
+            f'SERVER={self.server};'
+            f'DATABASE={self.database};'
+            f'UID={self.username};'
+            f'PWD={self.password}'
+        )
+        
     def connect(self):
         try:
-            params = urllib.parse.quote_plus(
-                f'DRIVER={{ODBC Driver 17 for SQL Server}};'
-                f'SERVER={self.server};'
-                f'DATABASE={self.database};'
-                f'UID={self.username};'
-                f'PWD={self.password}'
-            )
-            
-            connection_url = f'mssql+pyodbc:///?odbc_connect={params}'
-            self.engine = create_engine(connection_url)
+            # Every DatabaseConnection shares one pool per process; only the first call creates it.
+            # Room for every parallel SQL candidate to hold its own connection
+            self.pool = get_pool(self.connection_string(), pool_size=max(DB_POOL_SIZE, SQL_CANDIDATES))
+            self.engine = self.pool.engine
             return True
         except Exception as e:
             print(f"Database connection error: {str(e)}")
             return False
             
-    def execute_query(self, query: str) -> Optional[pd.DataFrame]:
+    def execute_query(self, query: str, use_cache: bool = True, timeout: Optional[int] = None,
+                      check_cost: bool = False, token: Optional[str] = None) -> Optional[pd.DataFrame]:
         try:
-            if not self.engine:
+            versions = None
+            if use_cache and result_cache:
+                cached, versions = result_cache.get(query)
+                if cached is not None:
+                    print("Result cache hit")
+                    return cached
+            if not self.pool:
                 if not self.connect():
                     raise Exception("Failed to establish database connection")
-            return pd.read_sql_query(query, self.engine)
+            # Statement timeout by query class; batched fetch with row/byte limits
+            executed = executable_sql(query)
+            if check_cost and cost_gate:
+                # Raises QueryTooExpensiveError from the estimated plan; cache hits never get here
+                cost_gate.enforce(executed)
+            connection = self.pool.raw_connection()
+            try:
+                try:
+                    df = run_statement(connection, executed, timeout, running_statements, token)
+                except Exception as e:
+                    if executed == query or not IdKeyRewriter.is_missing_key_error(e):
+                        raise
+                    # A key column was dropped since it was looked up; run the original comparison
+                    id_keys.reset()
+                    df = run_statement(connection, query, timeout, running_statements, token)
+            finally:
+                connection.close()
+            if use_cache and result_cache:
+                result_cache.put(query, df, versions)
+            return df
         except Exception as e:
             print(f"Query execution error: {str(e)}")
             raise
 
+    def raw_connection(self):
+        """Pooled DBAPI connection; close() returns it to the pool"""
+        if not self.pool and not self.connect():
+            raise Exception("Failed to establish database connection")
+        return self.pool.raw_connection()
+
+    def execute_scalar(self, query: str) -> Any:
+        """Run a query returning a single value, bypassing the result cache"""
+        df = self.execute_query(query, use_cache=False)
+        return None if df is None or df.empty else df.iat[0, 0]
+
+def warm_up_database():
+    """Create the shared pool, pre-open connections and start the replica sync in the background"""
+    db = DatabaseConnection()
+    if db.connect():
+        db.pool.start_warmup()
+        if replica:
+            replica.start_background_sync()
+    # No-op unless METRICS_PORT is set
+    start_metrics_server()
+
 # Test examples including validation failures
+TEST_QUESTIONS = [
+    "For the opportunities that dropped out because the product 'Doesn't Accomplish the Task', identify from the use case which product was missing.",
+    "Looking at the dropout reasons and explanations, suggest actionable strategies to reduce our dropout rates.",
+    "Analyze the opportunities that dropped out based on sales reps’ performance. Include their opportunities-to-leads ratio.",
+    "How many leads were created last month?",  # if response talks about opportunities instead
+    "What are the top reasons for opportunity dropouts and their counts?"  # if response only lists reasons without counts
+]
+
+def chat(planning_mode: str = PLANNING_MODE):
+    """Answer questions typed on stdin as one conversation, so follow-ups can reuse earlier results"""
+    conversation = Conversation()
+    while True:
+        try:
+            user_query = input("\nQuestion (blank to quit): ").strip()
+        except EOFError:
+            break
+        if not user_query:
+            break
+        streamed = []
+
+        def show(text: str):
+            if not streamed:
+                print("\nAnswer: ", end="")
+            streamed.append(text)
+            print(text, end="", flush=True)
+
+        response, results, query_type = process_query(user_query, planning_mode, conversation, show)
+        # The answer was printed as it streamed in; show it again only when validation revised it
+        if response != "".join(streamed):
+            print(f"\nFinal Response ({query_type}):")
+            print(response)
+        if results is not None:
+            print(results.head(20).to_string())
+
 if __name__ == "__main__":
-    test_questions = [
-        "For the opportunities that dropped out because the product 'Doesn't Accomplish the Task', identify from the use case which product was missing.",
-        "Looking at the dropout reasons and explanations, suggest actionable strategies to reduce our dropout rates.",
-        "Analyze the opportunities that dropped out based on sales reps’ performance. Include their opportunities-to-leads ratio.",
-        "How many leads were created last month?",  # if response talks about opportunities instead
-        "What are the top reasons for opportunity dropouts and their counts?"  # if response only lists reasons without counts
-    ]
-
-    for i, question in enumerate(test_questions, 1):
+    test_questions = TEST_QUESTIONS
+
+    warm_up_database()
+
+    # python sql_complex_app.py chat: interactive session with follow-up questions
+    if sys.argv[1:] == ["chat"]:
+        chat()
+        sys.exit(0)
+
+    # Questions run concurrently; results are reported in the original order
+    try:
+        outcomes = asyncio.run(process_many(test_questions))
+    except KeyboardInterrupt:
+        # Don't leave statements running on the server after Ctrl+C
+        running_statements.cancel_all()
+        raise
+    for i, (question, (response, results, query_type)) in enumerate(zip(test_questions, outcomes), 1):
         print(f"\n{'='*50}")
         print(f"Test {i}:")
         print(f"Question: {question}")
-        try:
-            response, results, query_type = process_query(question)
-            print(f"\nFinal Response:")
-            print(response)
-        except Exception as e:
-            print(f"Error: {str(e)}")
\ No newline at end of file
+        print(f"\nFinal Response ({query_type}):")
+        print(response)
+
+    print(f"\nSpeculative schema analysis: {json.dumps(speculation.report())}")
+    print(f"Connection pool: {json.dumps(pool_stats())}")
+    if id_keys:
+        print(f"ID comparisons moved onto key columns: {id_keys.rewrites}")
+    if replica:
+        print(f"Local replica: {json.dumps(replica.report())}")
+    if TRACING_ENABLED:
+        print(f"Stage spans written to {TRACE_LOG_PATH} (python tracing.py summary)")
\ No newline at end of file
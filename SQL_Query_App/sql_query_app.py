@@ -1,4 +1,6 @@
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 import streamlit as st
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
@@ -7,6 +9,26 @@ from langchain_core.messages import HumanMessage
 from langchain_community.utilities import SQLDatabase
 import pyodbc
 import pandas as pd
+from sqlalchemy.exc import DBAPIError
+from result_cache import ResultCache, RESULT_CACHE_ENABLED
+from schema_index import select_schema_context
+from db_schema import DB_SCHEMA
+from schema_catalog import load_catalog
+from sql_validator import validate_sql
+from streaming import stream_llm
+from db_pool import get_pool, DB_POOL_SIZE
+from result_fetch import is_truncated
+from result_profile import profile_frame
+from query_control import (
+    run_statement, timeout_for, StatementRegistry, QueryTimeoutError, QueryCancelledError
+)
+from cost_gate import CostGate, ShowplanProvider, COST_GATE_ENABLED
+from id_keys import IdKeyRewriter, SARGABLE_ID_KEYS
+from tracing import span, traced, traced_stream, register_counters, start_metrics_server, TracingCallback
+from follow_up import (
+    Conversation, match_follow_up, needs_planner, build_follow_up_prompt, parse_follow_up_plan,
+    run_follow_up, describe_steps, FOLLOW_UP_ENABLED
+)
 
 # Load environment variables
 load_dotenv()
@@ -22,361 +44,17 @@ SQL_PASSWORD = os.getenv("SQL_PASSWORD")
 llm = ChatOpenAI(
     api_key=OPENAI_API_KEY,
     model="gpt-4o-mini",  # Fixed model name
-    temperature=0.0  # Setting temperature to 0 for more precise SQL generation
+    temperature=0.0,  # Setting temperature to 0 for more precise SQL generation
+    callbacks=[TracingCallback()]  # Token usage and cost per traced stage
 )
 
+# Structured catalog (tables, columns, keys, foreign-key graph) parsed once at import
+CATALOG = load_catalog(DB_SCHEMA)
+
 def get_database_schema():
     """Return the hardcoded database schema"""
-    schema = """
-General Table name: DynamicsShortlisted.dbo.account
-Description: 
-Columns: 
-  accountid (Primary Key) Description : "ID of account. Account is the organization willing to make a purchase."
-  address1_line1 (String) Description : "Account's address line one"
-  address1_line2 (String) Description : "Account's Address line two"
-  address1_postalcode (String) Description : "Account's postal code"
-  address2_country (String) Description : "Account's country"
-  address2_stateorprovince (String) Description : "Account's state or province name"
-  cr93b_accounttype (Integer) Description : "Type of account"
-  createdby (String) Description : "ID of the user who created the account"
-  createdon (Date) Description : "Date on which the account was created"
-  emailaddress1 (String) Description : "Account's email address"
-  new_activeinactive (Boolean) Description : "Account's active or inactive status"
-  new_outreach (String) Description : "The method of account's signing up, such as Outbound, Referral, etc"
-  new_totallicenseaddons (Integer) Description : "License addons bought by account"
-  numberofemployees (Integer) Description : "The number of employees account organization has"
-  originatingleadid (Foreign key to DynamicsShortlisted.dbo.lead.leadid) Description : "The lead through which this account was created"
-  ownerid (String) Description : "Owner or the creator of this account in the system"
-  owninguser (String) Description : "The current owner of the account"
-  primarycontactid (Foreign key to DynamicsShortlisted.dbo.contact.contactid) Description : "Primary contact person for the account"
-  revenue (Decimal) Description : "Telephone number of the account"
-  telephone1 (String) Description : "Telephone number of the account"
-  versionnumber (Integer) Description : "Account's version number"
-  websiteurl (String) Description : "Website URL of the account's organization"
-  xt_accountproduct (Integer) Description : "Product ID in which the account is interested in"
-  xt_accountrecordtype (Integer) Description : "Record type of account"
-  xt_accountsource (Integer) Description : "Source of account"
-  xt_adcampaign (String) Description : "The name of the add campaign which led the account's lead signed up"
-  xt_additionalclientlicenses (Decimal) Description : "Number of additional client licenses requested"
-  xt_additionaldevserverlicenses (Decimal) Description : "Number of additional developer server licenses requested"
-  xt_additionalprodserverlicenses (Decimal) Description : "Number of additional production server licenses requested"
-  xt_adgroup (String) Description : "The add group in which the add campaign was run"
-  xt_attribution (Integer) Description : ""
-  xt_clientlicenses (Decimal) Description : "Total number of client licenses"
-  xt_comments (String) Description : "Comments by sales person"
-  xt_country (String) Description : "Country of the account"
-  xt_devserverlicenses (Decimal) Description : "Total number of developer licenses"
-  xt_enddate (Date) Description : "Expiration date of the license"
-  xt_industry (Integer) Description : "Industry of the account"
-  xt_iscustomer (Integer) Description : "Is customer, can have a value of 206220000 if it is a customer or 206220001 if it is a partner or opportunity"
-  xt_isdeleted (Boolean) Description : "Is the account deleted"
-  xt_keywords (String) Description : "Key words used in add campaigns"
-  xt_landingpage (String) Description : "Landing page of the add campaign"
-  xt_lastactivitydate (Date) Description : "Last activity on account's information"
-  xt_lastmodifieddate (Date) Description : "Last modified date of account's information"
-  xt_primarycontact (String) Description : "Name of the primary contact person for this account"
-  xt_productname (String) Description : "Name and tier of the product bought by the account"
-  xt_productnameis (String) Description : "Name of the product bought by the account"
-  xt_purchasetype (Integer) Description : "Purchase type of the account"
-  xt_rating (Integer) Description : "Account rating"
-  xt_sendrenewalinvoicedate (Date) Description : "License renewal alert date"
-  xt_serverlicenses (Decimal) Description : "Total number of server licenses"
-  xt_startdate (Date) Description : "License start date"
-  xt_type (Integer) Description : "Type of account"
-
-General Table name: DynamicsShortlisted.dbo.annotation
-Description: 
-Columns: 
-  annotationid (Primary Key) Description : "ID of the annotation (note) object"
-  createdby (String) Description : "Sales Person/Presales engineer's ID who created this note"
-  createdbyname (String) Description : "Name of the Sales person/Presales engineer who created this note"
-  createdon (Date) Description : "Date on which this note was created"
-  documentbody (String) Description : "If the note has a document, this field contains the body of the document"
-  filename (String) Description : "Name of the file added in the note"
-  filesize (Integer) Description : "Size of the file added in the note"
-  isdocument (Boolean) Description : "true if the note is a document"
-  mimetype (String) Description : ""
-  modifiedon (Date) Description : "Modified date of the note"
-  notetext (String) Description : "Text in the note"
-  objectid (Foreign key to multiple tables) Description : "Object on which this note was created on. It can be an email, lead, phone call, contact, account, opportunity, appointment, or task"
-  overriddencreatedon (Date) Description : "If created on is overridden by the system, this field will contain its date of override"
-  ownerid (String) Description : "The Sales person/Presales Engineer's ID who created this note"
-  owneridname (String) Description : "Name of the Sales person/Presales engineer who created this note"
-  owninguser (String) Description : "Name of the current Sales person/Presales engineer who owns this note"
-  subject (String) Description : "Subject of the note"
-
-General Table name: DynamicsShortlisted.dbo.appointment
-Description: 
-Columns: 
-  activityid (Primary Key) Description : "Appointment ID"
-  actualend (Date) Description : "Actual end datetime of the appointment"
-  createdby (String) Description : "Sales person/Presales engineer who created the appointment"
-  createdon (Date) Description : "Date time on which the appointment was created"
-  description (String) Description : "Description of the appointment"
-  globalobjectid (String) Description : "Global object ID of the appointment"
-  location (String) Description : "Location or platform of the appointment"
-  ownerid (String) Description : "Sales person/Presales engineer who is assigned the appointment"
-  owninguser (String) Description : "Sales person/Presales engineer who is assigned the appointment"
-  regardingobjectid (Foreign key to multiple tables) Description : "Account, lead or item for which the appointment is created"
-  scheduleddurationminutes (Integer) Description : "Scheduled duration in minutes"
-  scheduledend (Date) Description : "Scheduled end time of the appointment"
-  scheduledstart (Date) Description : "Scheduled start time of the appointment"
-  subject (String) Description : "Subject or objective of the appointment"
-  xt_addteamsmeetinglink (Boolean) Description : "Added teams meeting link or not"
-  xt_recordinglink (String) Description : "Recording link of the meeting"
-  xt_teamsmeetingurl (String) Description : "Microsoft teams meeting URL"
-
-General Table name: DynamicsShortlisted.dbo.contact
-Description: 
-Columns: 
-  address1_city (String) Description : "Contact person's city"
-  address1_line1 (String) Description : "Contact person's address"
-  contactid (Primary Key) Description : "ID of the contact person"
-  createdby (String) Description : "Sales person/Presales engineer's ID who created the contact person in system"
-  createdon (Date) Description : "Date time on which the contact record was created in the system"
-  description (String) Description : "Description of the contact person, or notes from the contact person"
-  emailaddress1 (String) Description : "Email address of the contact person"
-  firstname (String) Description : "First name of the contact person"
-  jobtitle (String) Description : "Job title of the contact person"
-  lastname (String) Description : "Last name of the contact person"
-  leadsourcecode (Integer) Description : "Code of the source of this Contact person"
-  mobilephone (String) Description : "Mobile number of the contact person"
-  ownerid (String) Description : "Sales person/Presales engineer's ID who created the contact person in system"
-  owninguser (String) Description : "Sales person/Presales engineer's ID who created the contact person in system"
-  parent_contactid (Foreign key to DynamicsShortlisted.dbo.contact.contactid) Description : "ID of the contact person who refferred this contact person"
-  parentcustomerid (Foreign key to multiple tables) Description : "ID of the customer who's contact person this is"
-  telephone1 (String) Description : "Telephone number of the contact person"
-  xt_adgroup (String) Description : "Add group of the add due to which this contact person signed up"
-  xt_attribution (Integer) Description : ""
-  xt_comments (String) Description : "Comments by the sales person"
-  xt_contactrecordtype (Integer) Description : ""
-  xt_contactsource (Integer) Description : "Source from where this contact person originated"
-  xt_doyouwantthe (Integer) Description : ""
-  xt_hasoptedoutofemail (Boolean) Description : "If the contact has opted out from sending marketing emails, this field will be 1"
-  xt_industry (Integer) Description : "Industry of the contact person"
-  xt_inferredcity (String) Description : "City of the contact person"
-  xt_inferredcountry (String) Description : "Country of the contact person"
-  xt_isemailbounced (Boolean) Description : "True if emails sent to the email address of the contact person have bounced"
-  xt_keywords (String) Description : "Key words used in add to attract this contact"
-  xt_landingpage (String) Description : "Landing page URL of the add campaign"
-  xt_leadsource (Integer) Description : "Source of the contact person's lead"
-  xt_licensekey (String) Description : "License key provided to the contact person for trial or demo"
-  xt_marketingsuspended (Boolean) Description : "If marketing to this customer has been suspended or not"
-  xt_notes (String) Description : "Notes from Sales engineer about the contact person"
-  xt_otherphone (String) Description : "Any other phone number to reach to this contact person"
-  xt_product (String) Description : "Product and tier in which the contact person is interested in"
-  xt_productname (String) Description : "Product and tier in which the contact person is interested in"
-  xt_productnameis (String) Description : "Product name in which the contact person is interested in"
-  xt_referringsite (String) Description : "The site from which the customer navigated to Astera's website"
-  xt_referrred_employee_size (Integer) Description : "Employee size of the contact person's organization"
-  xt_type (Integer) Description : "Type of contact person"
-  xt_unsubscribed (Boolean) Description : "True if contact person has unsubscribed to any sort of communication"
-
-General Table name: DynamicsShortlisted.dbo.email
-Description: 
-Columns: 
-  activityid (Primary Key) Description : "ID of the email"
-  actualend (Date) Description : "End time of the email"
-  correlatedactivityid (Foreign key to DynamicsShortlisted.dbo.email.activityid) Description : "Activity due to which this email was sent, for example it can be a marketing email or a follow-up email"
-  createdby (String) Description : "Sales Person/Presales Engineer who created this email"
-  createdon (Date) Description : "Date time on which the email was created on"
-  description (String) Description : "Description of the email"
-  emailsender (Foreign key to multiple tables) Description : "ID of the sender of the email. It can be a lead, contact or an account"
-  lastopenedtime (Date) Description : "Opened date time of the email"
-  modifiedon (Date) Description : "Modified date time of the email information"
-  opencount (Integer) Description : "Count of how many times email was opened"
-  ownerid (String) Description : "Sales Person/Presales Engineer who created this email"
-  owninguser (String) Description : "Sales Person/Presales Engineer who created this email"
-  parentactivityid (Foreign key to DynamicsShortlisted.dbo.email.activityid) Description : "Activity due to which this email was send, it can be a follow up email to a parent activity"
-  regardingobjectid (Foreign key to multiple tables) Description : "Object ID due to which this email was sent. It can be an account, contact, lead or opportunity"
-  sendermailboxid (String) Description : "Email sender's mail box ID"
-  sendersaccount (Foreign key to DynamicsShortlisted.dbo.account.accountid) Description : "Email sender's account ID"
-  subject (String) Description : "Subject of the email"
-
-General Table name: DynamicsShortlisted.dbo.lead
-Description: 
-Columns: 
-  address1_city (String) Description : "Lead's city"
-  address1_telephone1 (String) Description : "Telephone number of the lead"
-  budgetamount (Decimal) Description : "Lead's budget amount"
-  companyname (String) Description : "Company name of the lead"
-  cr93b_sdr (String) Description : ""
-  createdby (String) Description : "Sales Person/Presales Engineer who created this lead"
-  createdon (Date) Description : "Date time on which this lead was created in the system"
-  emailaddress1 (String) Description : "Email address of the lead"
-  firstname (String) Description : "First name of the lead"
-  jobtitle (String) Description : "Job title of the lead"
-  lastname (String) Description : "Last name of the lead"
-  msdyncrm_industry (String) Description : "Lead's industry"
-  new_businessregion (String) Description : "Business region of the lead"
-  new_ipbusinessregion (String) Description : "Business region IP address of the lead"
-  new_originalsource (String) Description : "Source of the lead"
-  new_outreach (String) Description : "Whether the lead was Inbound, outbound, or refferral"
-  ownerid (String) Description : "Sales Person/Presales Engineer who created this lead"
-  owninguser (String) Description : "Sales Person/Presales Engineer who is assigned this lead"
-  parentaccountid (Foreign key to DynamicsShortlisted.dbo.account.accountid) Description : "Account ID of the lead"
-  parentcontactid (Foreign key to DynamicsShortlisted.dbo.contact.contactid) Description : "Contact person's ID of the lead"
-  subject (String) Description : "The product about which the lead sent the query for"
-  telephone1 (String) Description : "Telephone number of the lead"
-  websiteurl (String) Description : "Website URL of the lead's organization"
-  xt_adcampaign (String) Description : "Add campaign that led to the lead signing up"
-  xt_adgroup (String) Description : "Add group under which the add campaign was placed"
-  xt_comments (String) Description : "Comments on how this lead was captured"
-  xt_countrytext (String) Description : "Country of the lead"
-  xt_description (String) Description : "Description of the lead capture"
-  xt_emailvalidationstatus (String) Description : "Checks if lead's email is a valid email address"
-  xt_falloutdetail (String) Description : "Details about why the lead was rejected or lost"
-  xt_falloutreasons (Integer) Description : "Reasons about why the lead was rejected or lost"
-  xt_firstconversion (String) Description : "First conversion event, article, campaign or video for this lead"
-  xt_firstconversiondate (Date) Description : "First conversion's date time for this lead"
-  xt_firstpageseen (String) Description : "Campaign or website's first pages seen by this lead"
-  xt_firstreferringsite (String) Description : "The first site through which the lead navigated to Astera's Website"
-  xt_industry (Integer) Description : "Industry of the lead"
-  xt_inferredareacode (String) Description : "Area code of the lead"
-  xt_inferredcountry2 (String) Description : "Country of the lead"
-  xt_inferredstateregion (String) Description : "State or region of the lead"
-  xt_ipcountry (String) Description : "Country of the IP address of the lead"
-  xt_lastreferringsite (String) Description : "The site which refferred the lead to navigate to Astera's website"
-  xt_leadproduct (Integer) Description : "Product in which the lead is interested in"
-  xt_leadsource (Integer) Description : "Source of the lead"
-  xt_leadstatus (Integer) Description : "Lead's status"
-  xt_needdetails (String) Description : "Details about the needs of the lead"
-  xt_notes (String) Description : "Notes about the lead's organization"
-  xt_originalsearchengine (String) Description : "Search engine where the lead was browsing"
-  xt_originalsearchphrase (String) Description : "Search Phrase due to which Astera's website URL showed up"
-  xt_originalsource (Integer) Description : "Original source of the lead"
-  xt_originalsourcedrilldown1 (String) Description : "Drill down information of the original source of the lead first part"
-  xt_originalsourcedrilldown2 (String) Description : "Drill down information of the original source of the lead second part"
-  xt_phonecode (Decimal) Description : "Phone code of the lead"
-  xt_primarycontact (String) Description : "Primary contact person name of the lead"
-  xt_primarycontactemail (String) Description : "Primary contact person's email address of the lead"
-  xt_productnameis (Integer) Description : "Product name for which the lead is interested in"
-  xt_referingdomain (String) Description : "Domain of the website which reffered Astera"
-  xt_referingsite (String) Description : "Website of the referrer"
-  xt_status (Integer) Description : "Status of the lead"
-  xt_timeline (Integer) Description : "Timeline qouted by the lead"
-  xt_utm_campaign (String) Description : "Campaign information that led to this lead's signup"
-  xt_utm_content (String) Description : "Content information that lead to this lead's signup"
-  xt_utm_medium (String) Description : "Medium where the add or content was posted"
-  xt_utm_source (String) Description : "Source of the lead"
-  xt_utm_term (String) Description : "Termsincluded in the add campaign"
-  leadid (Primary Key) Description : "Lead ID"
-
-General Table name: DynamicsShortlisted.dbo.opportunity
-Description: 
-Columns: 
-  actualclosedate (Date) Description : "Actual closing date of the opportunity"
-  actualvalue (Decimal) Description : "Actual value of the order placed by the opportunity"
-  budgetamount (Decimal) Description : "Budget amount of the opportunity"
-  cr93b_additionalrenewallicenserevenue (Decimal) Description : "Additional revenue generated by renewing license"
-  cr93b_additionalrenewallicenserevenue_base (Decimal) Description : "Additional revenue generated by renewing license"
-  cr93b_opportunityageindays (Integer) Description : "Days since the opportunity was created"
-  cr93b_productmanagerforthisopportunity (String) Description : "Product manager who is looking after this opportunity. It depends on which product the opportunity is interested in."
-  cr93b_sdr (String) Description : ""
-  createdby (String) Description : "Sales Person/Presales Engineer who created this Opportunity"
-  createdon (Date) Description : "Date time when this opportunity was created in the system"
-  customerneed (String) Description : "Need of the opportunity, or use case notes"
-  description (String) Description : "Query, description or notes on the opportunity"
-  emailaddress (String) Description : "Email address of the opportunity"
-  estimatedclosedate (Date) Description : "Estimated closing date of the opportunity"
-  msdyn_forecastcategory (Integer) Description : "Forecast category"
-  name (String) Description : "Name of the opportunity"
-  new_commentsbypresales (String) Description : "Presales engineer's comments on the opportunity"
-  new_democallrecordinglinks (String) Description : "Demo call recording links"
-  new_demoprovided (Boolean) Description : "True if the demo is provided"
-  new_discoverynotes (String) Description : "Discovery notes for this opportunity"
-  new_dropoutexplanation (String) Description : "Explaination about why the opportunity dropped out"
-  new_dropoutreason (Integer) Description : "Reason about why the opportunity dropped out"
-  new_firstpageseen (String) Description : "The first page displayed to the opportunity"
-  new_forecastedlicenserevenue (Decimal) Description : "Forecasted revenue from opportunity"
-  new_forecastedlicenserevenue_base (Decimal) Description : "Forecasted revenue from opportunity"
-  new_forecastedservicesrevenue (Decimal) Description : "Forecasted revenue from professional services with this opportunity"
-  new_ipcountry (String) Description : "Country of the IP address of the Opportunity"
-  new_lastcallbeforedropout (Integer) Description : "Last call before drop out ID"
-  new_opportunityindustry (Integer) Description : "Industry of the opportunity"
-  new_opportunitysecondaryproduct (Integer) Description : "If more than one products are considered, second product is mentioned here"
-  new_originalsource (String) Description : "Source of this opportunity"
-  new_supportingpressalesengineer (String) Description : "Presales engineer who is supporting or backing up the main presales engineer"
-  opportunityid (Primary Key) Description : "ID of the opportunity"
-  ownerid (String) Description : "Sales Person/Presales Engineer who created this Opportunity"
-  owninguser (String) Description : "Sales Person/Presales Engineer whom this Opportunity is assigned to"
-  parentaccountid (Foreign key to DynamicsShortlisted.dbo.account.accountid) Description : "Account ID for this opportunity"
-  parentcontactid (Foreign key to DynamicsShortlisted.dbo.contact.contactid) Description : "Contact person for this opportunity"
-  purchaseprocess (Integer) Description : "Purchase process for this opportunity"
-  timeline (Integer) Description : "Timeline identified by the opportunity"
-  xt_accounttype (Integer) Description : "Account type of the opportunity"
-  xt_adcampaign (String) Description : "Add campaign that led to this opportunity signing up"
-  xt_adgroup (String) Description : "Add group under which the add was ran to get this opportunity"
-  xt_keywords (String) Description : "keywords used in the add"
-  xt_lead (Foreign key to DynamicsShortlisted.dbo.lead.leadid) Description : "Lead ID of this opportunity"
-  xt_leadsource (Integer) Description : "Lead source for this opportunity"
-  xt_leadstatus (Integer) Description : "Lead status of this opportunity"
-  xt_notes (String) Description : "Notes for this opportunity"
-  xt_poccompleted (Boolean) Description : "Is Proof of concept (POC) complete for this opportunity"
-  xt_pocprovidedby (String) Description : "Presales engineer who provided the POC"
-  xt_productnameis (String) Description : "Product name in which the opportunity is interested in"
-
-General Table name: DynamicsShortlisted.dbo.phonecall
-Description: 
-Columns: 
-  activityid (Primary Key) Description : "Phone call ID"
-  actualend (Date) Description : "Actual end date time of the phone call"
-  actualstart (Date) Description : "Actual start date time of the phone call"
-  createdby (String) Description : "The Sales person who made the phone call"
-  createdon (Date) Description : "Date time when this phone call was made"
-  description (String) Description : "Description of the phone call"
-  ownerid (String) Description : "The Sales person who made the phone call"
-  owninguser (String) Description : "The Sales person who made the phone call"
-  phonenumber (String) Description : "The dialed phone number"
-  regardingobjectid (Foreign key to multiple tables) Description : "The account, contact, lead or opportunity for which the phone call was made"
-  scheduleddurationminutes (Integer) Description : "Scheduled time in minutes"
-  scheduledend (Date) Description : "Scheduled end date time of the phone call"
-  scheduledstart (Date) Description : "Scheduled start date time of the phone call"
-  serviceid (String) Description : "Service ID of the phone call"
-  subject (String) Description : "Subject or agenda of the phone call, can be description about the count of phone call too such as second phone call etc."
-
-General Table name: DynamicsShortlisted.dbo.task
-Description: 
-Columns: 
-  activityid (Primary Key) Description : "Task ID"
-  actualend (Date) Description : "Task actual end date time"
-  actualstart (Date) Description : "Task actual start date time"
-  createdby (String) Description : "The Sales person or Presales engineer who created this task"
-  createdon (Date) Description : "The date time when this task was created"
-  description (String) Description : "Description of the task"
-  ownerid (String) Description : "The person who this task is assigned to"
-  owninguser (String) Description : "The person who this task is assigned to"
-  regardingobjectid (Foreign key to multiple tables) Description : "The account, contact, lead or opportunity for which this task is created for"
-  scheduledend (Date) Description : "Scheduled end date time of the task"
-  scheduledstart (Date) Description : "Scheduled start date time of the task"
-  subject (String) Description : "Subject of the task"
-
-General Table name: DynamicsShortlisted.dbo.source
-Description: Source table representing logical name details.
-Columns:
-  LogicalName (String) Description : "The logical name for source is: xt_leadsource"
-  Value (Integer) Description : "The integer value representing the source"
-  Label (String) Description : "The label describing the source value"
-
-General Table name: DynamicsShortlisted.dbo.owner  
-Description: Owner table representing details of system users and their roles.  
-Columns:  
-  fullname (String) Description: "The full name of the owner."  
-  systemuserid (Integer) Description: "The system user ID associated with the owner."  
-  ownerid (Integer) Description: "The unique identifier for the owner."  
-
-
-General Table name: DynamicsShortlisted.dbo.dropout_reason
-Description: Dropout Reason table representing logical name details.
-Columns:
-  DropoutReasonID (Integer) Description : "The identifier for the dropout reason"
-  DropoutReason (String) Description : "The name or description of the dropout reason"
-
-
-"""
-    
     st.success("Successfully loaded database schema")
-    return schema
+    return DB_SCHEMA
 
 def clean_sql_query(query: str) -> str:
     """Clean and format the SQL query"""
@@ -391,6 +69,7 @@ def clean_sql_query(query: str) -> str:
     
     return query
 
+@traced("sql_generation")
 def generate_sql_query(user_query, db_schema):
     """Generate SQL query from natural language using LangChain"""
     prompt_template = """
@@ -431,9 +110,9 @@ def generate_sql_query(user_query, db_schema):
     
     return cleaned_query
 
-def execute_sql_query(query):
-    """Execute SQL query and return results as pandas DataFrame"""
-    conn_str = (
+def get_connection_string():
+    """Build the ODBC connection string from environment settings"""
+    return (
         "DRIVER={ODBC Driver 17 for SQL Server};"
         f"SERVER={SQL_SERVER};"
         f"DATABASE={SQL_DATABASE};"
@@ -441,28 +120,142 @@ def execute_sql_query(query):
         f"PWD={SQL_PASSWORD};"
         "TrustServerCertificate=yes;"
     )
+
+@st.cache_resource
+def get_db_pool():
+    """Process-wide connection pool, pre-opened in the background when the app starts"""
+    pool = get_pool(get_connection_string())
+    pool.start_warmup()
+    return pool
+
+def execute_scalar_query(query):
+    """Execute a query returning a single value"""
+    with get_db_pool().connect() as conn:
+        return conn.exec_driver_sql(query).scalar()
+
+@st.cache_resource
+def get_metrics_server():
+    """/metrics for this Streamlit server process; no-op unless METRICS_PORT is set"""
+    return start_metrics_server()
+
+@st.cache_resource
+def get_query_executor():
+    """Threads that run statements, so the script can keep polling for a Cancel click"""
+    return ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="streamlit-sql")
+
+def get_statement_registry():
+    """This session's running statements, cancelled by the Cancel button"""
+    if "statements" not in st.session_state:
+        st.session_state.statements = StatementRegistry()
+    return st.session_state.statements
+
+def run_cancellable_query(query):
+    """Run a query on the pool with its class timeout; a Cancel click stops it on the server"""
+    pool = get_db_pool()
+    registry = get_statement_registry()
+    timeout = timeout_for(query)
+
+    def work():
+        conn = pool.raw_connection()
+        try:
+            return run_statement(conn, query, timeout, registry)
+        finally:
+            conn.close()  # back to the pool, also after a timeout or cancel
+
+    future = get_query_executor().submit(work)
+    status = st.empty()
+    start = time.monotonic()
+    try:
+        # Returns as soon as the query finishes; the caption update in between is where
+        # Streamlit interrupts this run when Cancel is clicked
+        while not wait([future], timeout=0.25).done:
+            status.caption(f"Running for {time.monotonic() - start:.0f}s (timeout {timeout}s)")
+    except BaseException:
+        if registry.cancel_all():
+            st.session_state.query_interrupted = True
+        raise
+    status.empty()
+    return future.result()
+
+@st.cache_resource
+def get_cost_gate():
+    """Estimated-plan check run before each query, when COST_GATE_ENABLED is set"""
+    return CostGate(ShowplanProvider(get_db_pool().raw_connection)) if COST_GATE_ENABLED else None
+
+@st.cache_resource
+def get_id_keys():
+    """Rewrites brace-stripped ID joins onto indexed key columns, when they are deployed"""
+    return IdKeyRewriter(CATALOG, get_db_pool().raw_connection) if SARGABLE_ID_KEYS != "off" else None
+
+@st.cache_resource
+def get_result_cache():
+    """Process-wide result cache shared by all Streamlit sessions"""
+    cache = ResultCache(execute_scalar_query) if RESULT_CACHE_ENABLED else None
+    register_counters("result_cache", "Result cache hits, misses, invalidations and memory/disk usage",
+                      lambda: cache.stats() if cache else {})
+    return cache
+
+@traced("execute")
+def execute_sql_query(query):
+    """Execute SQL query and return results as pandas DataFrame"""
+    result_cache = get_result_cache()
+    
+    # Resolve every table and column against the catalog before touching the database
+    errors = validate_sql(query, CATALOG)
+    if errors:
+        st.code(query, language="sql")
+        st.error("Query failed validation:\n" + "\n".join(f"- {error}" for error in errors))
+        return None
     
     try:
-        st.info("Connecting to database...")
-        conn = pyodbc.connect(conn_str)
+        versions = None
+        if result_cache:
+            cached, versions = result_cache.get(query)
+            if cached is not None:
+                st.info("Using cached results (source tables unchanged)")
+                st.code(query, language="sql")
+                return cached
+        
+        id_keys = get_id_keys()
+        executed = id_keys.rewrite(query) if id_keys else query
+        
+        cost_gate = get_cost_gate()
+        if cost_gate:
+            decision = cost_gate.check(executed)
+            if not decision.allowed:
+                st.code(query, language="sql")
+                st.error(f"Query not run, it looks too expensive: {decision.reason}")
+                return None
+        
         st.info("Executing query...")
-        st.code(query, language="sql")  # Display the actual query being executed
-        return pd.read_sql(query, conn)
-    except pyodbc.Error as e:
+        st.code(executed, language="sql")  # Display the actual query being executed
+        try:
+            results = run_cancellable_query(executed)
+        except Exception as e:
+            if executed == query or not IdKeyRewriter.is_missing_key_error(e):
+                raise
+            id_keys.reset()
+            results = run_cancellable_query(query)
+        if is_truncated(results):
+            st.warning(f"Showing the first {len(results):,} rows; the full result was too large to load.")
+        if result_cache:
+            result_cache.put(query, results, versions)
+        return results
+    except QueryTimeoutError as e:
+        st.error(f"{str(e)}. Try narrowing the question, e.g. to a date range or a single owner.")
+        return None
+    except QueryCancelledError:
+        st.warning("Query cancelled.")
+        return None
+    except (pyodbc.Error, DBAPIError) as e:
         st.error(f"Database error: {str(e)}")
         return None
     except Exception as e:
         st.error(f"Error executing query: {str(e)}")
         return None
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
-def analyze_results(query_result, user_query):
-    """Analyze query results and generate natural language response"""
-    if query_result is None or query_result.empty:
-        return "No results found for your query."
-    
+def build_analysis_prompt(query_result, user_query):
+    """Prompt asking the LLM to answer the question from the query results"""
     prompt_template = """
     Given the following data results and the original user question, provide a clear and concise answer.
     
@@ -472,6 +265,7 @@ def analyze_results(query_result, user_query):
     {results}
     
     Please provide a natural language response that answers the user's question based on the data.
+    If the results are summarized (column profile plus sample rows), take counts and totals from the summary, not the sample.
     """
     
     prompt = PromptTemplate(
@@ -481,15 +275,61 @@ def analyze_results(query_result, user_query):
     
     formatted_prompt = prompt.format(
         question=user_query,
-        results=query_result.to_string()
+        results=profile_frame(query_result)
     )
+    return formatted_prompt
+
+@traced("answer_generation")
+def analyze_results(query_result, user_query):
+    """Analyze query results and generate natural language response"""
+    if query_result is None or query_result.empty:
+        return "No results found for your query."
     
-    response = llm.invoke([HumanMessage(content=formatted_prompt)])
+    response = llm.invoke([HumanMessage(content=build_analysis_prompt(query_result, user_query))])
     return response.content.strip()
 
+def stream_analysis(query_result, user_query):
+    """analyze_results as a stream of text chunks, for st.write_stream"""
+    if query_result is None or query_result.empty:
+        return iter(["No results found for your query."])
+    return traced_stream("answer_generation", stream_llm(llm, build_analysis_prompt(query_result, user_query), "analysis"))
+
+def get_conversation():
+    """This session's recent result frames, for follow-up questions"""
+    if "conversation" not in st.session_state:
+        st.session_state.conversation = Conversation()
+    return st.session_state.conversation
+
+@traced("follow_up")
+def plan_follow_up(user_query, conversation):
+    """Steps turning a previous result into the answer, or None when new data is needed"""
+    follow_up = match_follow_up(user_query, conversation)
+    if follow_up is None and needs_planner(user_query, conversation):
+        response = llm.invoke([HumanMessage(content=build_follow_up_prompt(user_query, conversation))])
+        follow_up = parse_follow_up_plan(response.content, conversation)
+    return follow_up
+
+def answer_from_previous_result(user_query):
+    """Rows for a follow-up computed from a cached result, or None to generate and run SQL"""
+    conversation = get_conversation()
+    try:
+        follow_up = plan_follow_up(user_query, conversation)
+        results = run_follow_up(follow_up, user_query, conversation) if follow_up else None
+    except Exception as e:
+        print(f"Follow-up not answered from the previous result: {str(e)}")
+        return None
+    if results is not None:
+        st.info(f'Answered from the result of "{follow_up.source.question}" without a new query: '
+                f"{describe_steps(follow_up.steps)}")
+    return results
+
 def create_streamlit_app():
     st.title("SQL Query Generator")
     
+    # Start opening database connections while the user types
+    get_db_pool()
+    get_metrics_server()
+    
     # Get database schema
     db_schema = get_database_schema()
     if db_schema is None:
@@ -512,36 +352,52 @@ def create_streamlit_app():
     user_query = st.text_area("Enter your question:", 
                              placeholder="Example: What are the total sales for each product category?")
     
-    if st.button("Generate Answer"):
+    generate_column, cancel_column, new_column = st.columns(3)
+    generate = generate_column.button("Generate Answer")
+    if cancel_column.button("Cancel running query"):
+        cancelled = get_statement_registry().cancel_all() or st.session_state.pop("query_interrupted", False)
+        st.info("Query cancelled." if cancelled else "No query is running.")
+    if new_column.button("New conversation"):
+        get_conversation().clear()
+    
+    if generate:
         if user_query:
             try:
-                # Generate SQL query
-                with st.spinner("Generating SQL query..."):
-                    sql_query = generate_sql_query(user_query, db_schema)
-                    st.subheader("Generated SQL Query:")
-                    st.code(sql_query, language="sql")
-                
-                # Execute query
-                with st.spinner("Executing query..."):
-                    results = execute_sql_query(sql_query)
-                    if results is not None:
-                        st.subheader("Query Results:")
-                        st.dataframe(results)
+                with span("question") as question:
+                    # Follow-ups that sort, filter or regroup the previous result skip SQL entirely
+                    results = answer_from_previous_result(user_query) if FOLLOW_UP_ENABLED else None
+                    if results is None:
+                        # Generate SQL query
+                        with st.spinner("Generating SQL query..."):
+                            # Only the tables relevant to the question go into the prompt
+                            schema_context = select_schema_context(user_query, db_schema)
+                            sql_query = generate_sql_query(user_query, schema_context)
+                            st.subheader("Generated SQL Query:")
+                            st.code(sql_query, language="sql")
+
+                        # Execute query
+                        with st.spinner("Executing query..."):
+                            results = execute_sql_query(sql_query)
+                            get_conversation().remember(user_query, sql_query, results)
+
+                    with st.spinner("Analyzing results..."):
+                        if results is not None:
+                            st.subheader("Query Results:")
+                            st.dataframe(results)
                         
-                        # Add download button for results
-                        csv = results.to_csv(index=False)
-                        st.download_button(
-                            label="Download Results as CSV",
-                            data=csv,
-                            file_name="query_results.csv",
-                            mime="text/csv"
-                        )
+                            # Add download button for results
+                            csv = results.to_csv(index=False)
+                            question.set(rows=len(results))
+                            st.download_button(
+                                label="Download Results as CSV",
+                                data=csv,
+                                file_name="query_results.csv",
+                                mime="text/csv"
+                            )
                         
-                        # Analyze results
-                        with st.spinner("Analyzing results..."):
-                            analysis = analyze_results(results, user_query)
+                            # Analyze results, rendering the answer as it streams in
                             st.subheader("Answer:")
-                            st.write(analysis)
+                            st.write_stream(stream_analysis(results, user_query))
                     
             except Exception as e:
                 st.error(f"Error: {str(e)}")
@@ -0,0 +1,279 @@
+import re
+import difflib
+import threading
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from schema_catalog import SchemaCatalog
+from sql_validator import KEYWORDS
+from tracing import register_counters
+
+# Minimum similarity for a fuzzy column/table match to be applied without asking the LLM
+FUZZY_CUTOFF = 0.75
+DEFAULT_TOP = 100
+
+SOURCE_PATTERN = re.compile(
+    r'\b(?:from|join)\s+((?:\[?\w+\]?\.){0,2}\[?(\w+)\]?)'
+    r'(?:\s+(?:as\s+)?(?!(?:on|where|join|left|right|inner|full|cross|outer|group|order|having|union|with)\b)(\w+))?',
+    re.IGNORECASE
+)
+STRING_LITERAL_PATTERN = re.compile(r"(N?'(?:[^']|'')*')")
+# Text before a name that makes it an alias definition rather than a column reference:
+# "... AS name" or an implicit alias after an operand ("COUNT(*) name", "o.fullname name")
+ALIAS_DEFINITION_PATTERN = re.compile(r'\bAS\s*\[?$', re.IGNORECASE)
+PREVIOUS_TOKEN_PATTERN = re.compile(r'(\w+|[)\]])\s+\[?$')
+TOP_CLAUSE_PATTERN = re.compile(r'\bTOP\s*(?:\(\s*\d+\s*\)|\d+)(?:\s+PERCENT)?(?:\s+WITH\s+TIES)?\s+\[?$', re.IGNORECASE)
+
+# Process-wide counters: rule hits, LLM fallbacks and retries saved
+REPAIR_STATS = Counter()
+_stats_lock = threading.Lock()
+
+
+def record(name: str, amount: int = 1):
+    with _stats_lock:
+        REPAIR_STATS[name] += amount
+
+
+@dataclass
+class RepairResult:
+    sql: str
+    rules: List[str] = field(default_factory=list)
+
+
+def classify_error(message: str) -> List[str]:
+    """Map a driver or validator error message to repairable error classes"""
+    lower = message.lower()
+    classes = []
+    if "invalid column name" in lower:
+        classes.append("invalid_column")
+    if "invalid object name" in lower:
+        classes.append("invalid_object")
+    if "ambiguous column name" in lower:
+        classes.append("ambiguous_column")
+    if "could not be bound" in lower:
+        classes.append("unbound_identifier")
+    if "limit" in lower and ("incorrect syntax" in lower or "not valid in sql server" in lower):
+        classes.append("limit_syntax")
+    if "uniqueidentifier" in lower or "conversion failed when converting from a character string" in lower:
+        classes.append("id_conversion")
+    if "too many rows" in lower:
+        classes.append("too_expensive")
+    if "timeout" in lower or "hyt00" in lower:
+        # No local rule: execute_with_retry asks for a cheaper query instead
+        classes.append("timeout")
+    return classes
+
+
+def _outside_strings(sql: str, pattern: str, replacement, flags=re.IGNORECASE) -> str:
+    """Apply a regex substitution only outside string literals"""
+    parts = STRING_LITERAL_PATTERN.split(sql)
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(pattern, replacement, parts[i], flags=flags)
+    return "".join(parts)
+
+
+def _is_alias_definition(before: str) -> bool:
+    if ALIAS_DEFINITION_PATTERN.search(before):
+        return True
+    previous = PREVIOUS_TOKEN_PATTERN.search(before)
+    if previous is None or TOP_CLAUSE_PATTERN.search(before):
+        return False
+    token = previous.group(1).lower()
+    return token in (")", "]", "end", "null") or token not in KEYWORDS
+
+
+def _replace_unqualified(sql: str, column: str, replacement: str) -> str:
+    """Replace unqualified references to a column, leaving alias definitions of the same name alone"""
+    def replace(match):
+        if _is_alias_definition(match.string[:match.start()]):
+            return match.group()
+        return replacement
+    return _outside_strings(sql, rf'(?<![\w.]){re.escape(column)}\b', replace)
+
+
+def query_sources(sql: str, catalog: SchemaCatalog) -> Dict[str, str]:
+    """alias (lowercase) -> catalog full table name, for every known table in FROM/JOIN"""
+    sources = {}
+    code = STRING_LITERAL_PATTERN.sub("''", sql)
+    for match in SOURCE_PATTERN.finditer(code):
+        table = catalog.table(match.group(1)) or catalog.table(match.group(2))
+        if table:
+            alias = (match.group(3) or match.group(2)).lower()
+            sources[alias] = table.full_name
+    return sources
+
+
+def _best_match(name: str, candidates: List[str]) -> Optional[str]:
+    lowered = {c.lower(): c for c in candidates}
+    matches = difflib.get_close_matches(name.lower(), list(lowered), n=2, cutoff=FUZZY_CUTOFF)
+    if not matches:
+        return None
+    if len(matches) > 1:
+        # Only apply when the winner is clearly better than the runner-up
+        first = difflib.SequenceMatcher(None, name.lower(), matches[0]).ratio()
+        second = difflib.SequenceMatcher(None, name.lower(), matches[1]).ratio()
+        if first - second < 0.05:
+            return None
+    return lowered[matches[0]]
+
+
+def fix_invalid_columns(sql: str, message: str, catalog: SchemaCatalog) -> Optional[str]:
+    sources = query_sources(sql, catalog)
+    changed = sql
+    for column, alias in re.findall(r"Invalid column name '(\w+)'(?:[^|]*?\(alias '(\w+)'\))?", message, re.IGNORECASE):
+        if alias and alias.lower() in sources:
+            table = catalog.table(sources[alias.lower()])
+            replacement = _best_match(column, [c.name for c in table.columns.values()])
+            if replacement:
+                changed = _outside_strings(changed, rf'\b({re.escape(alias)}\s*\.\s*){re.escape(column)}\b',
+                                           rf'\g<1>{replacement}')
+            continue
+
+        candidates = {}
+        for source_alias, table_name in sources.items():
+            for c in catalog.table(table_name).columns.values():
+                candidates.setdefault(c.name, source_alias)
+        replacement = _best_match(column, list(candidates))
+        if replacement:
+            changed = _replace_unqualified(changed, column, replacement)
+            changed = _outside_strings(changed, rf'\b(\w+\s*\.\s*){re.escape(column)}\b', rf'\g<1>{replacement}')
+    return changed if changed != sql else None
+
+
+def fix_invalid_objects(sql: str, message: str, catalog: SchemaCatalog) -> Optional[str]:
+    changed = sql
+    table_names = [t.name for t in catalog.table_list]
+    for name in re.findall(r"Invalid object name '([\w.\[\]]+)'", message, re.IGNORECASE):
+        short_name = name.replace("[", "").replace("]", "").split(".")[-1]
+        replacement = _best_match(short_name, table_names)
+        if replacement:
+            full_name = catalog.table(replacement).full_name
+            changed = _outside_strings(changed, rf'(?<![\w.])(?:\[?\w+\]?\.){{0,2}}\[?{re.escape(short_name)}\]?(?![\w.])',
+                                       full_name)
+    return changed if changed != sql else None
+
+
+def fix_ambiguous_columns(sql: str, message: str, catalog: SchemaCatalog) -> Optional[str]:
+    sources = query_sources(sql, catalog)
+    changed = sql
+    for column in re.findall(r"Ambiguous column name '(\w+)'", message, re.IGNORECASE):
+        # Qualify with the first table in FROM order that has the column (the driving table)
+        owner = next((alias for alias, table in sources.items() if catalog.column(table, column)), None)
+        if owner:
+            changed = _replace_unqualified(changed, column, f"{owner}.{column}")
+    return changed if changed != sql else None
+
+
+def fix_unbound_identifiers(sql: str, message: str, catalog: SchemaCatalog) -> Optional[str]:
+    sources = query_sources(sql, catalog)
+    changed = sql
+    for qualifier, column in re.findall(r"multi-part identifier [\"'](\w+)\.(\w+)[\"']", message, re.IGNORECASE):
+        # Table referenced by name instead of its alias, or a column on the wrong alias
+        alias = next((a for a, t in sources.items() if t.split(".")[-1].lower() == qualifier.lower()), None)
+        if alias is None:
+            owners = [a for a, t in sources.items() if catalog.column(t, column)]
+            alias = owners[0] if len(owners) == 1 else None
+        if alias and alias != qualifier.lower():
+            changed = _outside_strings(changed, rf'\b{re.escape(qualifier)}\s*\.\s*{re.escape(column)}\b',
+                                       f"{alias}.{column}")
+    return changed if changed != sql else None
+
+
+def fix_limit(sql: str) -> Optional[str]:
+    match = re.search(r'\s+LIMIT\s+(\d+)\s*;?\s*$', sql, re.IGNORECASE)
+    if not match:
+        return None
+    without_limit = sql[:match.start()]
+    return ensure_top(without_limit, int(match.group(1)), replace_existing=True)
+
+
+def ensure_top(sql: str, n: int = DEFAULT_TOP, replace_existing: bool = False) -> Optional[str]:
+    """Add TOP n to the outermost SELECT (or tighten an existing larger TOP)"""
+    code = STRING_LITERAL_PATTERN.sub(lambda m: "'" + "x" * (len(m.group()) - 2) + "'", sql)
+    # Outermost SELECT: skip over a leading CTE list
+    depth = 0
+    position = None
+    for match in re.finditer(r'\(|\)|\bselect\b', code, re.IGNORECASE):
+        token = match.group()
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth == 0:
+            position = match.end()
+            break
+    if position is None:
+        return None
+
+    rest = sql[position:]
+    top = re.match(r'(\s+(?:DISTINCT\s+)?)TOP\s*\(?\s*(\d+)\s*\)?', rest, re.IGNORECASE)
+    if top:
+        if int(top.group(2)) <= n and not replace_existing:
+            return None
+        return sql[:position] + f"{top.group(1)}TOP {n}" + rest[top.end():]
+    distinct = re.match(r'\s+DISTINCT\b', rest, re.IGNORECASE)
+    if distinct:
+        return sql[:position] + distinct.group() + f" TOP {n}" + rest[distinct.end():]
+    return sql[:position] + f" TOP {n}" + rest
+
+
+def fix_id_comparisons(sql: str, catalog: SchemaCatalog) -> Optional[str]:
+    """Brace-strip equality comparisons between two ID columns"""
+    sources = query_sources(sql, catalog)
+
+    def is_id(alias: str, column: str) -> bool:
+        table = sources.get(alias.lower())
+        col = catalog.column(table, column) if table else None
+        return bool(column.lower().endswith("id") or (col and (col.is_primary_key or col.references)))
+
+    def wrap(match):
+        left_alias, left_col, right_alias, right_col = match.groups()
+        if not (is_id(left_alias, left_col) and is_id(right_alias, right_col)):
+            return match.group()
+        return (f"REPLACE(REPLACE({left_alias}.{left_col}, '{{', ''), '}}', '') = "
+                f"REPLACE(REPLACE({right_alias}.{right_col}, '{{', ''), '}}', '')")
+
+    changed = _outside_strings(sql, r'(?<![\w.])(\w+)\.(\w+)\s*=\s*(\w+)\.(\w+)\b', wrap)
+    return changed if changed != sql else None
+
+
+def repair_sql(sql: str, error_message: str, catalog: SchemaCatalog) -> Optional[RepairResult]:
+    """Apply deterministic fixes for the classified error; None when no rule applies"""
+    record("attempts")
+    result = RepairResult(sql=sql)
+    for error_class in classify_error(error_message):
+        if error_class == "invalid_column":
+            fixed = fix_invalid_columns(result.sql, error_message, catalog)
+        elif error_class == "invalid_object":
+            fixed = fix_invalid_objects(result.sql, error_message, catalog)
+        elif error_class == "ambiguous_column":
+            fixed = fix_ambiguous_columns(result.sql, error_message, catalog)
+        elif error_class == "unbound_identifier":
+            fixed = fix_unbound_identifiers(result.sql, error_message, catalog)
+        elif error_class == "limit_syntax":
+            fixed = fix_limit(result.sql)
+        elif error_class == "id_conversion":
+            fixed = fix_id_comparisons(result.sql, catalog)
+        elif error_class == "too_expensive":
+            fixed = ensure_top(result.sql)
+        else:
+            fixed = None
+        if fixed:
+            result.sql = fixed
+            result.rules.append(error_class)
+            record(f"rule:{error_class}")
+
+    if not result.rules:
+        return None
+    record("repaired")
+    return result
+
+
+def repair_stats() -> dict:
+    """Counters for rule hits, LLM fallbacks and LLM retries saved by successful repairs"""
+    with _stats_lock:
+        return dict(REPAIR_STATS)
+
+
+register_counters("sql_repairs", "SQL repair rule hits, LLM fallbacks and LLM retries saved", repair_stats)
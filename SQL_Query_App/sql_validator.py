@@ -0,0 +1,532 @@
+import re
+import difflib
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from schema_catalog import SchemaCatalog
+
+
+class SQLValidationError(ValueError):
+    """Raised when a query fails local validation; the message is meant for the retry prompt"""
+
+
+TOKEN_PATTERN = re.compile(r"""
+    (?P<string>N?'(?:[^']|'')*')
+  | (?P<bracket>\[[^\]]+\])
+  | (?P<quoted>"[^"]+")
+  | (?P<number>\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+  | (?P<variable>@@?\w+)
+  | (?P<identifier>\#{0,2}[A-Za-z_][\w$]*)
+  | (?P<operator><>|!=|<=|>=|\|\||::|[-+*/%=<>(),.;~&|^])
+""", re.VERBOSE)
+
+WRITE_KEYWORDS = {
+    "insert", "update", "delete", "drop", "alter", "create", "truncate", "merge", "exec", "execute",
+    "grant", "revoke", "deny", "into", "backup", "restore", "shutdown", "dbcc", "bulk", "openrowset",
+}
+
+KEYWORDS = {
+    "select", "from", "where", "group", "by", "order", "having", "as", "on", "join", "inner", "left", "right",
+    "full", "outer", "cross", "apply", "and", "or", "not", "in", "is", "null", "like", "between", "exists",
+    "case", "when", "then", "else", "end", "distinct", "top", "percent", "with", "ties", "union", "all",
+    "except", "intersect", "asc", "desc", "over", "partition", "rows", "range", "unbounded", "preceding",
+    "following", "current", "row", "offset", "fetch", "next", "only", "first", "collate", "escape", "any",
+    "some", "nolock", "readuncommitted", "within", "current_timestamp", "current_user", "session_user",
+    "system_user", "pivot", "unpivot", "for", "values", "limit", "true", "false", "at", "time", "zone",
+}
+
+TYPE_NAMES = {
+    "int", "integer", "bigint", "smallint", "tinyint", "float", "real", "decimal", "numeric", "money",
+    "smallmoney", "varchar", "nvarchar", "char", "nchar", "text", "ntext", "date", "datetime", "datetime2",
+    "smalldatetime", "datetimeoffset", "time", "bit", "uniqueidentifier", "max", "varbinary", "binary",
+}
+
+DATE_PARTS = {
+    "year", "yy", "yyyy", "quarter", "qq", "q", "month", "mm", "m", "dayofyear", "dy", "y", "day", "dd", "d",
+    "week", "wk", "ww", "weekday", "dw", "hour", "hh", "minute", "mi", "n", "second", "ss", "s",
+    "millisecond", "ms", "microsecond", "mcs", "nanosecond", "ns", "iso_week", "isowk", "isoww",
+}
+
+NON_COLUMN_WORDS = KEYWORDS | TYPE_NAMES | DATE_PARTS
+CLAUSE_END_KEYWORDS = {"where", "group", "order", "having", "union", "except", "intersect", "on", "option"}
+JOIN_KEYWORDS = {"join", "apply"}
+SET_OPERATORS = {"union", "except", "intersect"}
+
+
+@dataclass
+class Token:
+    kind: str
+    text: str
+
+    @property
+    def lower(self) -> str:
+        return self.text.lower()
+
+    @property
+    def name(self) -> str:
+        """Identifier text without brackets/quotes, lowercased"""
+        if self.kind in ("bracket", "quoted"):
+            return self.text[1:-1].lower()
+        return self.text.lower()
+
+    def is_word(self, *words) -> bool:
+        return self.kind == "identifier" and self.lower in words
+
+    def is_op(self, *ops) -> bool:
+        return self.kind == "operator" and self.text in ops
+
+    @property
+    def is_name(self) -> bool:
+        return self.kind in ("identifier", "bracket", "quoted") and not (
+            self.kind == "identifier" and self.lower in KEYWORDS
+        )
+
+
+@dataclass
+class Source:
+    """A table (or opaque derived table/CTE) visible in a query block"""
+    alias: str
+    table: Optional[str]  # catalog full name, None for CTEs, derived tables and table-valued functions
+    aliased: bool = False  # has an explicit alias, so the table name no longer qualifies its columns
+
+
+@dataclass
+class Scope:
+    sources: Dict[str, Source] = field(default_factory=dict)
+    select_aliases: set = field(default_factory=set)
+
+    @property
+    def has_opaque(self) -> bool:
+        return any(source.table is None for source in self.sources.values())
+
+
+def tokenize_sql(query: str) -> List[Token]:
+    query = re.sub(r'--[^\n]*', ' ', query)
+    query = re.sub(r'/\*.*?\*/', ' ', query, flags=re.DOTALL)
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(query):
+        tokens.append(Token(match.lastgroup, match.group()))
+    return tokens
+
+
+class SQLBinder:
+    """Resolves every table and column reference in a SELECT statement against the catalog"""
+
+    def __init__(self, catalog: SchemaCatalog, query: str):
+        self.catalog = catalog
+        self.tokens = tokenize_sql(query)
+        self.errors: List[str] = []
+        self.tables = set()
+        self.cte_names = set()
+
+        # Matching parentheses, and which of them open a subquery
+        self.match = {}
+        stack = []
+        for i, token in enumerate(self.tokens):
+            if token.is_op("("):
+                stack.append(i)
+            elif token.is_op(")"):
+                if not stack:
+                    self.errors.append("Unbalanced parentheses: unexpected ')'")
+                    continue
+                self.match[stack.pop()] = i
+        if stack:
+            self.errors.append("Unbalanced parentheses: missing ')'")
+
+    def error(self, message: str):
+        if message not in self.errors:
+            self.errors.append(message)
+
+    def suggest(self, name: str, candidates) -> str:
+        close = difflib.get_close_matches(name.lower(), [c.lower() for c in candidates], n=3, cutoff=0.6)
+        return f" Did you mean: {', '.join(close)}?" if close else ""
+
+    def is_subquery(self, i: int) -> bool:
+        return (self.tokens[i].is_op("(") and i in self.match and i + 1 < len(self.tokens)
+                and self.tokens[i + 1].is_word("select", "with"))
+
+    # Statement-level checks
+
+    def check_statement(self) -> bool:
+        if not self.tokens:
+            self.error("Query is empty")
+            return False
+        if not self.tokens[0].is_word("select", "with"):
+            self.error(f"Only SELECT queries are allowed, got '{self.tokens[0].text}'")
+            return False
+        for i, token in enumerate(self.tokens):
+            if token.kind == "identifier" and token.lower in WRITE_KEYWORDS:
+                self.error(f"Write or DDL keyword '{token.text.upper()}' is not allowed; only read-only SELECT queries may run")
+            if token.is_op(";") and any(not t.is_op(";") for t in self.tokens[i + 1:]):
+                self.error("Multiple statements are not allowed; return a single SELECT query")
+            if token.is_word("limit"):
+                self.error("LIMIT is not valid in SQL Server; use SELECT TOP n instead")
+        return not self.errors
+
+    # Block binding
+
+    def bind(self):
+        if not self.check_statement():
+            return
+        end = len(self.tokens)
+        while end and self.tokens[end - 1].is_op(";"):
+            end -= 1
+        self.bind_query(0, end, [])
+
+    def bind_query(self, start: int, end: int, outer: List[Scope]):
+        """Bind [WITH ...] SELECT ... [UNION SELECT ...] within token range"""
+        i = start
+        if self.tokens[i].is_word("with"):
+            i = self.bind_ctes(i + 1, end, outer)
+
+        # Split on top-level set operators; each branch has its own scope
+        branches = []
+        branch_start = i
+        j = i
+        while j < end:
+            if self.is_subquery(j) or self.tokens[j].is_op("("):
+                j = self.match.get(j, j) + 1
+                continue
+            if self.tokens[j].kind == "identifier" and self.tokens[j].lower in SET_OPERATORS:
+                branches.append((branch_start, j))
+                j += 1
+                if j < end and self.tokens[j].is_word("all"):
+                    j += 1
+                branch_start = j
+                continue
+            j += 1
+        if not branches:
+            self.bind_select(branch_start, end, outer)
+            return
+
+        # A trailing ORDER BY sorts the whole set operation by the first branch's columns
+        order = self.find_top_level(branch_start, end, "order")
+        branches.append((branch_start, order if order is not None else end))
+        for branch in branches:
+            self.bind_select(*branch, outer)
+        if order is not None:
+            self.bind_set_order_by(order, end, self.output_names(*branches[0]))
+
+    def find_top_level(self, start: int, end: int, word: str) -> Optional[int]:
+        i = start
+        while i < end:
+            if self.tokens[i].is_op("("):
+                i = self.match.get(i, i) + 1
+                continue
+            if self.tokens[i].is_word(word):
+                return i
+            i += 1
+        return None
+
+    def output_names(self, start: int, end: int) -> Optional[set]:
+        """Column names a SELECT block returns; None when a wildcard makes them unknown"""
+        i = start + 1
+        while i < end and self.tokens[i].is_word("distinct", "all"):
+            i += 1
+        if i < end and self.tokens[i].is_word("top"):
+            i += 2 if i + 1 < end else 1
+            while i < end and self.tokens[i].is_word("percent", "with", "ties"):
+                i += 1
+        select_end = self.find_top_level(i, end, "from")
+        items, item = [], []
+        while i < (end if select_end is None else select_end):
+            if self.tokens[i].is_op("("):
+                close = self.match.get(i, i)
+                item.extend(self.tokens[i:close + 1])
+                i = close + 1
+                continue
+            if self.tokens[i].is_op(","):
+                items.append(item)
+                item = []
+            else:
+                item.append(self.tokens[i])
+            i += 1
+        items.append(item)
+
+        names = set()
+        for item in items:
+            if not item or item[-1].is_op("*"):
+                return None
+            if len(item) > 2 and item[0].is_name and item[1].is_op("="):
+                names.add(item[0].name)  # alias = expression
+            elif item[-1].is_name:
+                names.add(item[-1].name)  # column, o.column, AS alias or implicit alias
+        return names
+
+    def bind_set_order_by(self, start: int, end: int, names: Optional[set]):
+        if names is None:
+            return
+        i = start + 2  # ORDER BY
+        while i < end:
+            token = self.tokens[i]
+            if token.is_name and token.lower not in NON_COLUMN_WORDS:
+                parts, after = self.read_dotted(i, end)
+                if not (after < end and self.tokens[after].is_op("(")) and parts[-1] not in names:
+                    self.error(
+                        f"Invalid column name '{parts[-1]}': ORDER BY items must appear in the select list "
+                        f"when the statement contains a UNION, INTERSECT or EXCEPT operator."
+                        f"{self.suggest(parts[-1], names)}"
+                    )
+                i = after
+                continue
+            i += 1
+
+    def bind_ctes(self, i: int, end: int, outer: List[Scope]) -> int:
+        while i < end:
+            token = self.tokens[i]
+            if not token.is_name:
+                self.error(f"Malformed WITH clause near '{token.text}'")
+                return end
+            name = token.name
+            i += 1
+            if i < end and self.tokens[i].is_op("(") and not self.is_subquery(i):
+                i = self.match.get(i, i) + 1  # column list
+            if i < end and self.tokens[i].is_word("as"):
+                i += 1
+            if i >= end or not self.is_subquery(i):
+                self.error(f"Malformed CTE '{name}': expected AS (SELECT ...)")
+                return end
+            close = self.match[i]
+            self.bind_query(i + 1, close, outer)
+            self.cte_names.add(name)
+            i = close + 1
+            if i < end and self.tokens[i].is_op(","):
+                i += 1
+                continue
+            return i
+        return i
+
+    def resolve_table(self, parts: List[str]) -> Optional[str]:
+        name = ".".join(parts)
+        if len(parts) == 1 and parts[0] in self.cte_names:
+            return None
+        if parts[0].startswith("#") or parts[0].startswith("@"):
+            return None
+        table = self.catalog.table(name) if len(parts) >= 3 else self.catalog.table(parts[-1])
+        if table is None:
+            self.error(f"Invalid object name '{name}'.{self.suggest(parts[-1], [t.name for t in self.catalog.table_list])}")
+            return None
+        self.tables.add(table.full_name)
+        return table.full_name
+
+    def read_dotted(self, i: int, end: int) -> tuple:
+        parts = [self.tokens[i].name]
+        i += 1
+        while i + 1 < end and self.tokens[i].is_op(".") and (self.tokens[i + 1].is_name or self.tokens[i + 1].is_op("*")):
+            parts.append(self.tokens[i + 1].name)
+            i += 2
+        return parts, i
+
+    def collect_sources(self, start: int, end: int, outer: List[Scope], scope: Scope) -> set:
+        """Register FROM/JOIN sources of a block; returns token indexes consumed by table references"""
+        consumed = set()
+        i = start
+        in_from = False
+        expect_source = False
+        while i < end:
+            token = self.tokens[i]
+            if token.is_op("(") and not self.is_subquery(i) and not expect_source:
+                i = self.match.get(i, i) + 1
+                continue
+            if self.is_subquery(i) and not expect_source:
+                i = self.match[i] + 1
+                continue
+            if token.is_word("from"):
+                in_from, expect_source = True, True
+                i += 1
+                continue
+            if token.kind == "identifier" and token.lower in JOIN_KEYWORDS:
+                in_from, expect_source = True, True
+                i += 1
+                continue
+            if in_from and token.is_op(","):
+                expect_source = True
+                i += 1
+                continue
+            if token.kind == "identifier" and token.lower in CLAUSE_END_KEYWORDS:
+                # ON keeps the FROM clause open for further joins; anything else closes it
+                if token.lower != "on":
+                    in_from = False
+                expect_source = False
+                i += 1
+                continue
+            if expect_source:
+                expect_source = False
+                if self.is_subquery(i):
+                    close = self.match[i]
+                    self.bind_query(i + 1, close, outer)
+                    consumed.update(range(i, close + 1))
+                    table, parts, i = None, None, close + 1
+                elif token.is_name or token.kind == "variable":
+                    parts, after = self.read_dotted(i, end)
+                    consumed.update(range(i, after))
+                    if after < end and self.tokens[after].is_op("("):
+                        # Table-valued function such as STRING_SPLIT(...): columns unknown,
+                        # its arguments are bound with the rest of the block
+                        table = None
+                        consumed.update((after, self.match.get(after, after)))
+                        i = self.match.get(after, after) + 1
+                    else:
+                        table = self.resolve_table(parts)
+                        i = after
+                else:
+                    i += 1
+                    continue
+
+                alias = parts[-1] if parts else None
+                aliased = False
+                if i < end and self.tokens[i].is_word("as"):
+                    consumed.add(i)
+                    i += 1
+                if i < end and self.tokens[i].is_name:
+                    alias = self.tokens[i].name
+                    aliased = True
+                    consumed.add(i)
+                    i += 1
+                if alias is None:
+                    alias = f"__derived{i}"
+                if alias in scope.sources:
+                    self.error(f"The correlation name '{alias}' is specified multiple times in the same FROM clause")
+                scope.sources[alias] = Source(alias, table, aliased)
+                # Table hints such as WITH (NOLOCK)
+                if i + 1 < end and self.tokens[i].is_word("with") and self.tokens[i + 1].is_op("("):
+                    consumed.update(range(i, self.match.get(i + 1, i + 1) + 1))
+                    i = self.match.get(i + 1, i + 1) + 1
+                continue
+            i += 1
+        return consumed
+
+    def bind_select(self, start: int, end: int, outer: List[Scope]):
+        scope = Scope()
+        consumed = self.collect_sources(start, end, outer, scope)
+        scopes = [scope] + outer
+
+        i = start
+        previous_operand = False
+        while i < end:
+            token = self.tokens[i]
+            if i in consumed:
+                i += 1
+                previous_operand = False
+                continue
+            if self.is_subquery(i):
+                close = self.match[i]
+                self.bind_query(i + 1, close, scopes)
+                i = close + 1
+                previous_operand = True
+                continue
+            if token.is_word("top"):
+                # TOP n / TOP (n) [PERCENT] [WITH TIES]
+                i += 1
+                if i < end and self.tokens[i].is_op("("):
+                    i = self.match.get(i, i) + 1
+                elif i < end:
+                    i += 1
+                previous_operand = False
+                continue
+            if token.is_word("as"):
+                if i + 1 < end and (self.tokens[i + 1].is_name or self.tokens[i + 1].kind == "identifier"):
+                    scope.select_aliases.add(self.tokens[i + 1].name)
+                    i += 2
+                    previous_operand = True
+                    continue
+                i += 1
+                continue
+            if token.is_name:
+                parts, after = self.read_dotted(i, end)
+                if after < end and self.tokens[after].is_op("("):
+                    # Function call (built-in or schema-qualified)
+                    i = after
+                    previous_operand = False
+                    continue
+                if previous_operand and len(parts) == 1:
+                    # Implicit alias: "COUNT(*) total" or "o.name opportunity_name"
+                    scope.select_aliases.add(parts[0])
+                    i = after
+                    previous_operand = True
+                    continue
+                self.bind_column(parts, scopes)
+                i = after
+                previous_operand = True
+                continue
+            if token.is_op("*"):
+                # Wildcard after SELECT or a comma; otherwise multiplication
+                prev = self.tokens[i - 1] if i > start else None
+                previous_operand = prev is None or prev.is_op(",") or prev.is_word("select", "distinct")
+            else:
+                previous_operand = (
+                    token.kind in ("number", "string", "variable")
+                    or token.is_op(")")
+                    or token.is_word("end", "null")
+                )
+            i += 1
+
+    def bind_column(self, parts: List[str], scopes: List[Scope]):
+        column = parts[-1]
+        if column == "*" and len(parts) == 1:
+            return
+        if len(parts) == 1:
+            self.bind_unqualified(column, scopes)
+            return
+
+        qualifier = ".".join(parts[:-1])
+        for scope in scopes:
+            source = scope.sources.get(qualifier) or scope.sources.get(parts[-2])
+            if source is None:
+                # Unaliased table referenced by its own name; an alias hides the table name
+                for candidate in scope.sources.values():
+                    if candidate.table and not candidate.aliased and qualifier in (candidate.table.lower(), candidate.table.split(".")[-1].lower()):
+                        source = candidate
+                        break
+            if source is None:
+                continue
+            if source.table is None or column == "*":
+                return
+            table = self.catalog.table(source.table)
+            if table.column(column) is None:
+                self.error(
+                    f"Invalid column name '{column}' for {source.table} (alias '{source.alias}')."
+                    f"{self.suggest(column, [c.name for c in table.columns.values()])}"
+                )
+            return
+
+        known = sorted({alias for scope in scopes for alias in scope.sources})
+        self.error(f"The multi-part identifier '{'.'.join(parts)}' could not be bound; known aliases: {', '.join(known) or 'none'}")
+
+    def bind_unqualified(self, column: str, scopes: List[Scope]):
+        if column in NON_COLUMN_WORDS or column.startswith("#"):
+            return
+        for scope in scopes:
+            if column in scope.select_aliases or column in scope.sources:
+                return
+            owners = [
+                source for source in scope.sources.values()
+                if source.table and self.catalog.table(source.table).column(column)
+            ]
+            if len(owners) > 1:
+                self.error(
+                    f"Ambiguous column name '{column}' (in {', '.join(s.alias for s in owners)}); qualify it with a table alias"
+                )
+                return
+            if owners or scope.has_opaque:
+                return
+
+        candidates = [c.name for scope in scopes for s in scope.sources.values() if s.table
+                      for c in self.catalog.table(s.table).columns.values()]
+        if not any(scope.sources for scope in scopes):
+            return
+        self.error(f"Invalid column name '{column}'.{self.suggest(column, candidates)}")
+
+
+def validate_sql(query: str, catalog: SchemaCatalog) -> List[str]:
+    """Offline check of a query against the catalog; returns a list of precise error messages"""
+    binder = SQLBinder(catalog, query)
+    binder.bind()
+    return binder.errors
+
+
+def check_sql(query: str, catalog: SchemaCatalog):
+    """Raise SQLValidationError if the query would fail against the catalog"""
+    errors = validate_sql(query, catalog)
+    if errors:
+        raise SQLValidationError("Query failed local validation: " + " | ".join(errors))
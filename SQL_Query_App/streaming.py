@@ -0,0 +1,152 @@
+import time
+import json
+import threading
+import statistics
+from collections import defaultdict, deque
+from typing import Callable, Iterator, Optional
+
+from langchain_core.messages import HumanMessage
+
+from tracing import observe_ttft
+
+# Recent time-to-first-token samples per stream name (seconds)
+TTFT_WINDOW = 500
+_ttft_samples = defaultdict(lambda: deque(maxlen=TTFT_WINDOW))
+_ttft_lock = threading.Lock()
+
+
+def record_ttft(name: str, seconds: float):
+    with _ttft_lock:
+        _ttft_samples[name].append(seconds)
+    # Also on the current span (the traced_stream around the caller) and /metrics
+    observe_ttft(name, seconds)
+
+
+def ttft_stats() -> dict:
+    """count/p50/p95 of time-to-first-token per stream name"""
+    with _ttft_lock:
+        samples = {name: sorted(values) for name, values in _ttft_samples.items()}
+    stats = {}
+    for name, values in samples.items():
+        if not values:
+            continue
+        stats[name] = {
+            "count": len(values),
+            "p50_s": round(statistics.median(values), 3),
+            "p95_s": round(values[min(len(values) - 1, int(len(values) * 0.95))], 3),
+        }
+    return stats
+
+
+def stream_llm(llm, prompt: str, name: str) -> Iterator[str]:
+    """Yield completion text as it arrives, recording time to the first non-empty token"""
+    start = time.perf_counter()
+    first = True
+    for chunk in llm.stream([HumanMessage(content=prompt)]):
+        text = chunk.content if isinstance(chunk.content, str) else ""
+        if not text:
+            continue
+        if first:
+            first = False
+            ttft = time.perf_counter() - start
+            record_ttft(name, ttft)
+            print(f"Time to first token ({name}): {ttft:.2f}s")
+        yield text
+
+
+class JSONStringFieldParser:
+    """Incrementally extracts the value of one string field from a streamed JSON object.
+
+    feed() returns the newly decoded part of the field, so the value can be shown
+    before the closing brace (or even the closing quote) has arrived.
+    """
+
+    def __init__(self, field: str):
+        self.key = json.dumps(field)
+        self.buffer = ""  # raw text not yet consumed
+        self.state = "key"  # key -> colon -> open -> value -> done
+        self.text = ""  # full raw completion, for a final json.loads fallback
+
+    def feed(self, chunk: str) -> str:
+        self.text += chunk
+        self.buffer += chunk
+        output = []
+        while self.buffer:
+            if self.state == "key":
+                index = self.buffer.find(self.key)
+                if index < 0:
+                    # Keep a tail in case the key is split across chunks
+                    self.buffer = self.buffer[-len(self.key):]
+                    break
+                self.buffer = self.buffer[index + len(self.key):]
+                self.state = "colon"
+            elif self.state in ("colon", "open"):
+                stripped = self.buffer.lstrip()
+                if not stripped:
+                    self.buffer = ""
+                    break
+                expected = ":" if self.state == "colon" else '"'
+                if stripped[0] != expected:
+                    # Same text appeared as a value rather than a key; keep looking
+                    self.buffer = stripped
+                    self.state = "key"
+                    continue
+                self.buffer = stripped[1:]
+                self.state = "open" if self.state == "colon" else "value"
+            elif self.state == "value":
+                decoded, consumed, closed = self._decode(self.buffer)
+                output.append(decoded)
+                self.buffer = self.buffer[consumed:]
+                if closed:
+                    self.state = "done"
+                    self.buffer = ""
+                break
+            else:
+                self.buffer = ""
+        return "".join(output)
+
+    @staticmethod
+    def _decode(raw: str):
+        """Decode JSON string content up to the closing quote or an incomplete escape"""
+        decoded = []
+        i = 0
+        while i < len(raw):
+            char = raw[i]
+            if char == '"':
+                return "".join(decoded), i + 1, True
+            if char != "\\":
+                decoded.append(char)
+                i += 1
+                continue
+            if i + 1 >= len(raw):
+                break  # escape split across chunks
+            if raw[i + 1] == "u":
+                # High surrogates need their low half before they can be decoded
+                length = 12 if raw[i + 2:i + 3].lower() == "d" and raw[i + 3:i + 4].lower() in "89ab" else 6
+                if i + length > len(raw):
+                    break
+                decoded.append(json.loads(f'"{raw[i:i + length]}"'))
+                i += length
+                continue
+            decoded.append(json.loads(f'"{raw[i:i + 2]}"'))
+            i += 2
+        return "".join(decoded), i, False
+
+    @property
+    def found(self) -> bool:
+        return self.state in ("value", "done")
+
+
+def stream_json_field(chunks: Iterator[str], field: str, fallback: Optional[Callable[[str], str]] = None) -> Iterator[str]:
+    """Stream one string field out of a JSON completion.
+
+    If the field never shows up (e.g. the model ignored the JSON format), the whole
+    completion is yielded at the end, passed through fallback when given.
+    """
+    parser = JSONStringFieldParser(field)
+    for chunk in chunks:
+        text = parser.feed(chunk)
+        if text:
+            yield text
+    if not parser.found:
+        yield fallback(parser.text) if fallback else parser.text
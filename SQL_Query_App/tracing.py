@@ -0,0 +1,459 @@
+"""Per-stage spans for the SQL pipelines, written as JSON lines and exposed as Prometheus metrics.
+
+Usage:
+    python tracing.py summary [traces.jsonl]    # p50/p95 wall time, escalations, tokens and cost per stage
+
+Spans nest through a context variable, so the LLM token callback and child stages find
+their parent across await points; thread pool work has to be submitted with
+contextvars.copy_context().run to stay in the same trace.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import inspect
+import argparse
+import functools
+import threading
+import contextvars
+import statistics
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field, fields
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from query_cache import CACHE_DIR
+
+try:
+    from langchain_community.callbacks.openai_info import get_openai_token_cost_for_model
+    COST_TABLE_AVAILABLE = True
+except ImportError:
+    COST_TABLE_AVAILABLE = False
+
+# How prompt/completion prices are selected changed between langchain_community releases
+try:
+    from langchain_community.callbacks.openai_info import TokenType
+    PRICE_KWARGS = ({"token_type": TokenType.PROMPT}, {"token_type": TokenType.COMPLETION})
+except ImportError:
+    PRICE_KWARGS = ({"is_completion": False}, {"is_completion": True})
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", os.path.join(CACHE_DIR, "traces.jsonl"))
+# Past this size the span log is moved to <path>.1 (replacing the previous one) and started afresh
+TRACE_LOG_MAX_MB = float(os.getenv("TRACE_LOG_MAX_MB", "50"))
+# Port for the /metrics endpoint; 0 leaves it off. Set METRICS_HOST=0.0.0.0 to allow remote scrapes
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, float("inf"))
+TTFT_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, float("inf"))
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_write_lock = threading.Lock()
+_metrics_lock = threading.Lock()
+_metrics = defaultdict(lambda: {
+    "count": 0, "errors": 0, "duration_sum": 0.0, "buckets": [0] * len(DURATION_BUCKETS),
+    "tokens_in": 0, "tokens_out": 0, "cost_usd": 0.0, "rows": 0, "retries": 0,
+})
+# LLM calls per (stage, model) and escalations per (stage, reason), from the model router
+_route_calls = defaultdict(int)
+_escalations = defaultdict(int)
+# Component counters read at scrape time: name -> (help text, function returning {key: number})
+_counter_sources: Dict[str, tuple] = {}
+# Time to first token per streamed response name
+_ttft = defaultdict(lambda: {"count": 0, "sum": 0.0, "buckets": [0] * len(TTFT_BUCKETS)})
+
+
+@dataclass
+class Span:
+    stage: str
+    trace_id: str
+    span_id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    parent_id: Optional[str] = None
+    start: float = field(default_factory=time.time)
+    duration_s: float = 0.0
+    tokens_in: int = 0
+    tokens_out: int = 0
+    cost_usd: float = 0.0
+    rows: Optional[int] = None
+    retries: int = 0
+    status: str = "ok"
+    error: Optional[str] = None
+    attributes: Dict[str, object] = field(default_factory=dict)
+    parent: Optional["Span"] = field(default=None, repr=False)
+
+    def set(self, **attributes):
+        """Record rows/retries or free-form attributes on the span"""
+        for name, value in attributes.items():
+            if name in ("rows", "retries"):
+                setattr(self, name, value)
+            else:
+                self.attributes[name] = value
+
+    def add_usage(self, tokens_in: int, tokens_out: int, cost: float):
+        # Tokens count towards the stage that made the call and every stage around it
+        span = self
+        while span is not None:
+            span.tokens_in += tokens_in
+            span.tokens_out += tokens_out
+            span.cost_usd += cost
+            span = span.parent
+
+    def to_dict(self) -> dict:
+        data = {f.name: getattr(self, f.name) for f in fields(self) if f.name != "parent"}
+        data["cost_usd"] = round(self.cost_usd, 6)
+        data["duration_s"] = round(self.duration_s, 4)
+        return data
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def _rotate(path: str):
+    """Keep one previous generation of the span log once it grows past TRACE_LOG_MAX_MB"""
+    if TRACE_LOG_MAX_MB <= 0:
+        return
+    try:
+        if os.path.getsize(path) >= TRACE_LOG_MAX_MB * 1024 * 1024:
+            os.replace(path, path + ".1")
+    except FileNotFoundError:
+        pass
+
+
+def _write(span: Span):
+    try:
+        line = json.dumps(span.to_dict(), default=str)
+        with _write_lock:
+            os.makedirs(os.path.dirname(os.path.abspath(TRACE_LOG_PATH)), exist_ok=True)
+            _rotate(TRACE_LOG_PATH)
+            with open(TRACE_LOG_PATH, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+    except Exception as e:
+        print(f"Failed to write trace span: {str(e)}")
+
+
+def _observe(span: Span):
+    with _metrics_lock:
+        metrics = _metrics[span.stage]
+        metrics["count"] += 1
+        metrics["errors"] += span.status == "error"
+        metrics["duration_sum"] += span.duration_s
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if span.duration_s <= bound:
+                metrics["buckets"][i] += 1
+        metrics["tokens_in"] += span.tokens_in
+        metrics["tokens_out"] += span.tokens_out
+        metrics["cost_usd"] += span.cost_usd
+        metrics["rows"] += span.rows or 0
+        metrics["retries"] += span.retries
+
+
+@contextmanager
+def span(stage: str, **attributes) -> Iterator[Span]:
+    """Time a pipeline stage; a span opened with no span around it starts a new trace"""
+    parent = _current_span.get()
+    current = Span(stage=stage, trace_id=parent.trace_id if parent else uuid.uuid4().hex,
+                   parent_id=parent.span_id if parent else None, parent=parent)
+    current.set(**attributes)
+    token = _current_span.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    except GeneratorExit:
+        # A stream the caller stopped reading; not a failure of the stage
+        current.set(abandoned=True)
+        raise
+    except BaseException as e:
+        current.status = "error"
+        current.error = f"{type(e).__name__}: {str(e)}"[:500]
+        raise
+    finally:
+        current.duration_s = time.perf_counter() - start
+        _current_span.reset(token)
+        if TRACING_ENABLED:
+            _observe(current)
+            _write(current)
+
+
+def traced(stage: str):
+    """Decorator running a sync or async function inside a span"""
+    def decorate(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def traced_stream(stage: str, chunks: Iterator[str]) -> Iterator[str]:
+    """Span covering a streamed response, from the first pull until it is exhausted"""
+    with span(stage) as current:
+        characters = 0
+        for chunk in chunks:
+            characters += len(chunk)
+            yield chunk
+        current.set(characters=characters)
+
+
+def in_context(func: Callable) -> Callable:
+    """Bind func to the caller's context (current span), for executor.submit/run_in_executor"""
+    return functools.partial(contextvars.copy_context().run, func)
+
+
+class TracingCallback(BaseCallbackHandler):
+    """Adds the token usage and estimated cost of each LLM call to the current span"""
+
+    run_inline = True
+
+    def on_llm_end(self, response, **kwargs):
+        current = _current_span.get()
+        if current is None:
+            return
+        output = response.llm_output or {}
+        usage = output.get("token_usage") or {}
+        tokens_in = usage.get("prompt_tokens", 0) or 0
+        tokens_out = usage.get("completion_tokens", 0) or 0
+        if not usage:
+            # Streaming responses carry usage on the message, when the API returned it
+            for generations in response.generations:
+                for generation in generations:
+                    metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    tokens_in += metadata.get("input_tokens", 0)
+                    tokens_out += metadata.get("output_tokens", 0)
+        cost = 0.0
+        model = output.get("model_name")
+        if COST_TABLE_AVAILABLE and model:
+            prompt_kwargs, completion_kwargs = PRICE_KWARGS
+            try:
+                cost = (get_openai_token_cost_for_model(model, tokens_in, **prompt_kwargs)
+                        + get_openai_token_cost_for_model(model, tokens_out, **completion_kwargs))
+            except Exception:
+                pass  # model missing from the cost table; tokens are still recorded
+        current.add_usage(tokens_in, tokens_out, cost)
+
+
+def stage_totals() -> Dict[str, dict]:
+    """Per-stage counters since the process started (count, errors, tokens, cost, rows, retries)"""
+    with _metrics_lock:
+        return {stage: {name: value for name, value in values.items() if name != "buckets"}
+                for stage, values in _metrics.items()}
+
+
+def record_route(stage: str, model: str, escalation: Optional[str] = None):
+    """Count an LLM call of a stage; escalation is the reason it went to the strong model, if it did"""
+    with _metrics_lock:
+        _route_calls[(stage, model)] += 1
+        if escalation:
+            _escalations[(stage, escalation)] += 1
+
+
+def route_totals() -> Dict[str, dict]:
+    """Per-stage LLM calls by model, escalations by reason, and the share of first attempts escalated"""
+    with _metrics_lock:
+        calls, escalations = dict(_route_calls), dict(_escalations)
+    totals = defaultdict(lambda: {"calls": {}, "escalations": {}, "escalation_rate": 0.0})
+    for (stage, model), count in calls.items():
+        totals[stage]["calls"][model] = count
+    for (stage, reason), count in escalations.items():
+        totals[stage]["escalations"][reason] = count
+    for stage, values in totals.items():
+        escalated = sum(values["escalations"].values())
+        first_attempts = sum(values["calls"].values()) - escalated
+        values["escalation_rate"] = round(escalated / first_attempts, 4) if first_attempts else 0.0
+    return dict(totals)
+
+
+def register_counters(name: str, help_text: str, read: Callable[[], Dict[str, float]]):
+    """Expose a component's counters (cache hits, repair rule hits, ...) as sql_pipeline_<name>{key="..."}"""
+    with _metrics_lock:
+        _counter_sources[name] = (help_text, read)
+
+
+def counter_values() -> Dict[str, Dict[str, float]]:
+    """Current numeric values of every registered component, by component name"""
+    with _metrics_lock:
+        sources = dict(_counter_sources)
+    values = {}
+    for name, (_, read) in sorted(sources.items()):
+        try:
+            values[name] = {key: value for key, value in read().items()
+                            if isinstance(value, (int, float)) and not isinstance(value, bool)}
+        except Exception as e:
+            print(f"Failed to read {name} counters: {str(e)}")
+    return values
+
+
+def observe_ttft(stream: str, seconds: float):
+    """Record a streamed response's time to first token on the current span and in the metrics"""
+    current = _current_span.get()
+    if current is not None:
+        current.set(ttft_s=round(seconds, 4))
+    with _metrics_lock:
+        metrics = _ttft[stream]
+        metrics["count"] += 1
+        metrics["sum"] += seconds
+        for i, bound in enumerate(TTFT_BUCKETS):
+            if seconds <= bound:
+                metrics["buckets"][i] += 1
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def metrics_text() -> str:
+    """Stage metrics in the Prometheus text exposition format"""
+    with _metrics_lock:
+        snapshot = {stage: {**values, "buckets": list(values["buckets"])} for stage, values in _metrics.items()}
+    lines = [
+        "# HELP sql_pipeline_stage_duration_seconds Wall time of each pipeline stage",
+        "# TYPE sql_pipeline_stage_duration_seconds histogram",
+    ]
+    for stage, values in sorted(snapshot.items()):
+        label = f'stage="{_label(stage)}"'
+        for bound, count in zip(DURATION_BUCKETS, values["buckets"]):
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'sql_pipeline_stage_duration_seconds_bucket{{{label},le="{le}"}} {count}')
+        lines.append(f"sql_pipeline_stage_duration_seconds_sum{{{label}}} {values['duration_sum']:.6f}")
+        lines.append(f"sql_pipeline_stage_duration_seconds_count{{{label}}} {values['count']}")
+
+    counters = [
+        ("sql_pipeline_stage_errors_total", "Stages that raised", "errors", None),
+        ("sql_pipeline_tokens_total", "LLM prompt tokens", "tokens_in", 'direction="in"'),
+        ("sql_pipeline_tokens_total", "LLM completion tokens", "tokens_out", 'direction="out"'),
+        ("sql_pipeline_cost_usd_total", "Estimated LLM cost in USD", "cost_usd", None),
+        ("sql_pipeline_rows_total", "Rows returned by executed queries", "rows", None),
+        ("sql_pipeline_retries_total", "Execution retries", "retries", None),
+    ]
+    declared = set()
+    for name, help_text, key, extra in counters:
+        if name not in declared:
+            declared.add(name)
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        for stage, values in sorted(snapshot.items()):
+            labels = f'stage="{_label(stage)}"' + (f",{extra}" if extra else "")
+            lines.append(f"{name}{{{labels}}} {values[key]}")
+
+    with _metrics_lock:
+        calls, escalations = dict(_route_calls), dict(_escalations)
+    lines += ["# HELP sql_pipeline_llm_calls_total LLM calls by stage and routed model",
+              "# TYPE sql_pipeline_llm_calls_total counter"]
+    for (stage, model), count in sorted(calls.items()):
+        lines.append(f'sql_pipeline_llm_calls_total{{stage="{_label(stage)}",model="{_label(model)}"}} {count}')
+    lines += ["# HELP sql_pipeline_escalations_total Calls repeated on the strong model, by reason",
+              "# TYPE sql_pipeline_escalations_total counter"]
+    for (stage, reason), count in sorted(escalations.items()):
+        lines.append(f'sql_pipeline_escalations_total{{stage="{_label(stage)}",reason="{_label(reason)}"}} {count}')
+
+    with _metrics_lock:
+        ttft = {stream: {**values, "buckets": list(values["buckets"])} for stream, values in _ttft.items()}
+    lines += ["# HELP sql_pipeline_time_to_first_token_seconds Time until a streamed answer's first token",
+              "# TYPE sql_pipeline_time_to_first_token_seconds histogram"]
+    for stream, values in sorted(ttft.items()):
+        label = f'stream="{_label(stream)}"'
+        for bound, count in zip(TTFT_BUCKETS, values["buckets"]):
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'sql_pipeline_time_to_first_token_seconds_bucket{{{label},le="{le}"}} {count}')
+        lines.append(f"sql_pipeline_time_to_first_token_seconds_sum{{{label}}} {values['sum']:.6f}")
+        lines.append(f"sql_pipeline_time_to_first_token_seconds_count{{{label}}} {values['count']}")
+
+    with _metrics_lock:
+        help_texts = {name: help_text for name, (help_text, _) in _counter_sources.items()}
+    for name, values in counter_values().items():
+        metric = f"sql_pipeline_{name}"
+        lines += [f"# HELP {metric} {help_texts[name]}", f"# TYPE {metric} gauge"]
+        for key, value in sorted(values.items()):
+            lines.append(f'{metric}{{key="{_label(key)}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes every few seconds would flood the console
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST) -> Optional[ThreadingHTTPServer]:
+    """Serve /metrics on a daemon thread (once per process); returns None when port is 0"""
+    global _server
+    with _server_lock:
+        if _server is None and port:
+            try:
+                _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError as e:
+                print(f"Metrics endpoint not started on port {port}: {str(e)}")
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+            print(f"Serving metrics on http://{host}:{port}/metrics")
+        return _server
+
+
+def _percentile(values: list, fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(path: str = TRACE_LOG_PATH) -> Dict[str, dict]:
+    """count, errors, escalations, p50/p95 wall time, mean tokens and total cost per stage from a span log"""
+    spans = defaultdict(list)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                data = json.loads(line)
+                spans[data["stage"]].append(data)
+    summary = {}
+    for stage, items in sorted(spans.items()):
+        durations = sorted(item["duration_s"] for item in items)
+        summary[stage] = {
+            "count": len(items),
+            "errors": sum(item["status"] == "error" for item in items),
+            "escalated": sum(bool(item.get("attributes", {}).get("escalated")) for item in items),
+            "p50_s": round(statistics.median(durations), 3),
+            "p95_s": round(_percentile(durations, 0.95), 3),
+            "mean_tokens": round(statistics.mean(item["tokens_in"] + item["tokens_out"] for item in items), 1),
+            "cost_usd": round(sum(item["cost_usd"] for item in items), 4),
+        }
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("summary",))
+    parser.add_argument("path", nargs="?", default=TRACE_LOG_PATH)
+    args = parser.parse_args(argv)
+
+    print(f"{'stage':<22} {'count':>6} {'errors':>6} {'escalated':>9} {'p50_s':>8} {'p95_s':>8} {'tokens':>8} {'cost_usd':>9}")
+    for stage, row in summarize(args.path).items():
+        print(f"{stage:<22} {row['count']:>6} {row['errors']:>6} {row['escalated']:>9} {row['p50_s']:>8.3f} {row['p95_s']:>8.3f} "
+              f"{row['mean_tokens']:>8.0f} {row['cost_usd']:>9.4f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+"""Local triage classifier (TF-IDF plus softmax regression) answering before the triage LLM call.
+
+Usage:
+    python triage_classifier.py train [--labels FILE ...] [--model triage_classifier.json]
+    python triage_classifier.py report [--labels FILE ...] [--folds 5] [--test golden_set.json]
+
+Training examples are questions with the label the LLM gave them, from the label log the app
+appends to on every triage or fused-plan LLM call. The query cache is not used: it also holds
+labels this classifier answered locally, and training on those would reinforce its own
+mistakes. --labels adds JSON lines or JSON lists of {question, query_type}; a question
+labelled more than once keeps its latest label. The app loads the saved model at startup (restart it after retraining) and
+only uses its answer when the top probability reaches TRIAGE_CLASSIFIER_THRESHOLD.
+report cross-validates on the same examples and shows, per threshold, how many triage
+calls would be answered locally and how accurate those answers are.
+"""
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from query_cache import CACHE_DIR, normalize_question
+
+TRIAGE_CLASSIFIER_ENABLED = os.getenv("TRIAGE_CLASSIFIER_ENABLED", "true").lower() == "true"
+TRIAGE_CLASSIFIER_PATH = os.getenv("TRIAGE_CLASSIFIER_PATH", os.path.join(CACHE_DIR, "triage_classifier.json"))
+# Below this top-label probability the question still goes to the triage LLM
+TRIAGE_CLASSIFIER_THRESHOLD = float(os.getenv("TRIAGE_CLASSIFIER_THRESHOLD", "0.9"))
+TRIAGE_LABEL_LOG_PATH = os.getenv("TRIAGE_LABEL_LOG_PATH", os.path.join(CACHE_DIR, "triage_labels.jsonl"))
+
+MAX_FEATURES = 5000
+REPORT_THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99)
+# Label log sources that are LLM answers; anything else is skipped when training
+LLM_LABEL_SOURCES = ("triage", "fused_plan")
+
+
+def tokenize(question: str) -> List[str]:
+    """Words and word pairs of the normalized question"""
+    words = normalize_question(question).split()
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class TriageClassifier:
+    """Multinomial logistic regression on sublinear, L2-normalized TF-IDF word and bigram features"""
+
+    def __init__(self, labels: List[str], vocabulary: List[str], idf: np.ndarray, weights: np.ndarray, bias: np.ndarray):
+        self.labels = labels
+        self.vocabulary = vocabulary
+        self.index = {token: i for i, token in enumerate(vocabulary)}
+        self.idf = idf
+        self.weights = weights  # features x labels
+        self.bias = bias
+
+    def _features(self, question: str) -> Tuple[np.ndarray, np.ndarray]:
+        counts = Counter(token for token in tokenize(question) if token in self.index)
+        if not counts:
+            return np.zeros(0, dtype=int), np.zeros(0)
+        indices = np.fromiter((self.index[token] for token in counts), dtype=int, count=len(counts))
+        values = (1.0 + np.log(np.fromiter(counts.values(), dtype=float, count=len(counts)))) * self.idf[indices]
+        return indices, values / np.linalg.norm(values)
+
+    def probabilities(self, question: str) -> Dict[str, float]:
+        indices, values = self._features(question)
+        logits = self.bias + values @ self.weights[indices]
+        exp = np.exp(logits - logits.max())
+        return dict(zip(self.labels, (exp / exp.sum()).tolist()))
+
+    def predict(self, question: str) -> Tuple[str, float]:
+        """Most likely label and its probability"""
+        probabilities = self.probabilities(question)
+        label = max(probabilities, key=probabilities.get)
+        return label, probabilities[label]
+
+    @classmethod
+    def train(cls, questions: List[str], labels: List[str], l2: float = 1e-3, epochs: int = 400,
+              learning_rate: float = 2.0) -> "TriageClassifier":
+        """Fit by full-batch gradient descent, weighting classes inversely to their frequency"""
+        label_names = sorted(set(labels))
+        documents = [Counter(tokenize(question)) for question in questions]
+        document_frequency = Counter(token for document in documents for token in document)
+        vocabulary = sorted(document_frequency, key=lambda token: (-document_frequency[token], token))[:MAX_FEATURES]
+        vocabulary.sort()
+        n = len(questions)
+        idf = np.array([math.log((1 + n) / (1 + document_frequency[token])) + 1.0 for token in vocabulary])
+        model = cls(label_names, vocabulary, idf, np.zeros((len(vocabulary), len(label_names))), np.zeros(len(label_names)))
+
+        # Sparse rows as (row, feature, value) triples
+        rows, features, values = [], [], []
+        for row, question in enumerate(questions):
+            indices, weights = model._features(question)
+            rows += [row] * len(indices)
+            features += indices.tolist()
+            values += weights.tolist()
+        rows, features, values = np.array(rows, dtype=int), np.array(features, dtype=int), np.array(values)
+
+        targets = np.zeros((n, len(label_names)))
+        targets[np.arange(n), [label_names.index(label) for label in labels]] = 1.0
+        label_counts = targets.sum(axis=0)
+        sample_weights = (targets @ (n / (len(label_names) * label_counts)))[:, None]
+
+        for _ in range(epochs):
+            logits = np.tile(model.bias, (n, 1))
+            np.add.at(logits, rows, model.weights[features] * values[:, None])
+            exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+            error = (exp / exp.sum(axis=1, keepdims=True) - targets) * sample_weights / n
+            gradient = l2 * model.weights
+            np.add.at(gradient, features, error[rows] * values[:, None])
+            model.weights -= learning_rate * gradient
+            model.bias -= learning_rate * error.sum(axis=0)
+        return model
+
+    def save(self, path: str = TRIAGE_CLASSIFIER_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "labels": self.labels,
+                "vocabulary": self.vocabulary,
+                "idf": np.round(self.idf, 6).tolist(),
+                "weights": np.round(self.weights, 6).tolist(),
+                "bias": np.round(self.bias, 6).tolist(),
+            }, f)
+
+    @classmethod
+    def load(cls, path: str = TRIAGE_CLASSIFIER_PATH) -> "TriageClassifier":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        weights = np.array(data["weights"]).reshape(len(data["vocabulary"]), len(data["labels"]))
+        return cls(data["labels"], data["vocabulary"], np.array(data["idf"]), weights, np.array(data["bias"]))
+
+
+def load_triage_classifier(path: str = TRIAGE_CLASSIFIER_PATH) -> Optional[TriageClassifier]:
+    """The trained model, or None when none has been trained yet"""
+    if not os.path.exists(path):
+        return None
+    try:
+        return TriageClassifier.load(path)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Triage classifier not loaded from {path}: {str(e)}")
+        return None
+
+
+class TriageLabelLog:
+    """Append-only JSON lines of questions and the label the LLM gave them, for retraining"""
+
+    def __init__(self, path: str = TRIAGE_LABEL_LOG_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, question: str, query_type: str, source: str):
+        line = json.dumps({"question": question, "query_type": query_type, "source": source, "ts": time.time()})
+        try:
+            with self._lock:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+        except OSError as e:
+            print(f"Failed to log triage label: {str(e)}")
+
+
+def _read_labels(path: str) -> Iterable[Tuple[str, str]]:
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    items = json.loads(text) if text.lstrip().startswith("[") else [json.loads(line) for line in text.splitlines() if line.strip()]
+    for item in items:
+        # Hand-labelled files have no source; logged labels must come from the LLM
+        if item.get("source", "triage") in LLM_LABEL_SOURCES:
+            yield item["question"], item["query_type"]
+
+
+def load_examples(paths: List[str]) -> Tuple[List[str], List[str]]:
+    """Labelled questions from every readable source, deduplicated on the normalized question"""
+    examples = {}
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        for question, query_type in _read_labels(path):
+            if question and query_type:
+                examples[normalize_question(question)] = (question, query_type)
+    questions = [question for question, _ in examples.values()]
+    return questions, [query_type for _, query_type in examples.values()]
+
+
+def cross_validate(questions: List[str], labels: List[str], folds: int, seed: int = 7) -> List[Tuple[str, str, float]]:
+    """(true label, predicted label, confidence) for every example, each predicted by a model that didn't see it"""
+    order = np.random.default_rng(seed).permutation(len(questions))
+    results = []
+    for fold in range(folds):
+        held_out = set(order[fold::folds].tolist())
+        train = [i for i in range(len(questions)) if i not in held_out]
+        if len({labels[i] for i in train}) < 2:
+            continue
+        model = TriageClassifier.train([questions[i] for i in train], [labels[i] for i in train])
+        results += [(labels[i], *model.predict(questions[i])) for i in sorted(held_out)]
+    return results
+
+
+def print_report(results: List[Tuple[str, str, float]], threshold: float):
+    print(f"{'threshold':>9} {'local':>7} {'local acc':>9} {'overall acc':>11}")
+    for bound in sorted(set(REPORT_THRESHOLDS) | {threshold}):
+        local = [(truth, predicted) for truth, predicted, confidence in results if confidence >= bound]
+        correct = sum(truth == predicted for truth, predicted in local)
+        # Questions below the threshold go to the LLM, whose label is the reference
+        overall = (correct + len(results) - len(local)) / len(results)
+        local_accuracy = f"{correct / len(local):.1%}" if local else "-"
+        marker = "  <- TRIAGE_CLASSIFIER_THRESHOLD" if bound == threshold else ""
+        print(f"{bound:>9.2f} {len(local) / len(results):>7.0%} {local_accuracy:>9} {overall:>11.1%}{marker}")
+
+    labels = sorted({truth for truth, _, _ in results} | {predicted for _, predicted, _ in results})
+    print(f"\nConfusion at {threshold:.2f} (rows: LLM label, columns: local label, questions answered locally)")
+    print(f"{'':<18}" + "".join(f"{label:>18}" for label in labels))
+    for truth in labels:
+        counts = Counter(predicted for t, predicted, confidence in results if t == truth and confidence >= threshold)
+        print(f"{truth:<18}" + "".join(f"{counts[label]:>18}" for label in labels))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("train", "report"))
+    parser.add_argument("--labels", nargs="*", default=[], help="Extra labelled questions (JSON lines or a JSON list)")
+    parser.add_argument("--model", default=TRIAGE_CLASSIFIER_PATH)
+    parser.add_argument("--threshold", type=float, default=TRIAGE_CLASSIFIER_THRESHOLD)
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--test", help="Also score the saved model on this labelled set")
+    args = parser.parse_args(argv)
+
+    questions, labels = load_examples([TRIAGE_LABEL_LOG_PATH] + args.labels)
+    print(f"{len(questions)} labelled questions: {json.dumps(dict(Counter(labels)))}")
+    if len(set(labels)) < 2:
+        print("Need questions with at least two different labels to train")
+        return 1
+
+    if args.command == "train":
+        start = time.perf_counter()
+        model = TriageClassifier.train(questions, labels)
+        model.save(args.model)
+        print(f"Trained on {len(questions)} questions in {time.perf_counter() - start:.1f}s; saved to {args.model}")
+        return 0
+
+    print(f"\n{args.folds}-fold cross-validation")
+    print_report(cross_validate(questions, labels, args.folds), args.threshold)
+    model = load_triage_classifier(args.model)
+    if model is None:
+        print(f"\nNo saved model at {args.model}; run train first")
+        return 0
+    start = time.perf_counter()
+    for question in questions:
+        model.predict(question)
+    print(f"\nSaved model: {(time.perf_counter() - start) / len(questions) * 1e6:.0f} us per question")
+    if args.test:
+        test_questions, test_labels = load_examples([args.test])
+        results = [(label, *model.predict(question)) for question, label in zip(test_questions, test_labels)]
+        print(f"\nSaved model on {args.test} ({len(results)} questions)")
+        print_report(results, args.threshold)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())